@@ -1,12 +1,11 @@
+from sanic import Sanic
+
 from service import app
+from service.launcher import LaunchSettings, extend, prepare
+
+# at module level: with START_METHOD=spawn, workers re-import this module
+extend(app)
 
 if __name__ == '__main__':
-    """
-    app.prepare(
-        fast=True,
-        motd=False,
-        verbosity=0,
-        access_log=False,
-    )
-    """
-    app.run(host="0.0.0.0")
+    prepare(app, LaunchSettings.from_env())
+    Sanic.serve(primary=app)
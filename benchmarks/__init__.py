@@ -0,0 +1,4 @@
+"""
+Microbenchmarks; run from the repository root with
+``python -m benchmarks.<module>``.
+"""
@@ -0,0 +1,123 @@
+"""
+What the operation dispatcher costs over the handlers it replaced.
+
+``legacy`` is the previous path of a /sale handler after decoding: build the
+OnlinePayments arguments, then run_operation looked up the async gateway,
+the gateway guard and the idempotency cache on every call and counted the
+response code. ``dispatcher`` runs the same sale through service.dispatch
+with its default middleware, which also times every operation (about half
+the difference); ``bare`` is the dispatcher with no middleware. All end in
+the same stub instead of the executor and the SDK, so only the plumbing is
+measured; the verify cache, idempotency and the gateway guard are off, as
+they are by default.
+"""
+import asyncio
+import time
+from functools import partial
+from types import SimpleNamespace
+from uuid import uuid4
+
+from service.blue_print import OPERATIONS, SaleRequestInput, charge_kwargs
+from service.business.functions import CreditCardDataDataclass
+from service.business.params import Constants, HeartlandParams
+from service.dispatch import MIDDLEWARE, Call, Dispatcher
+from service.idempotency import idempotency_key
+from service.metrics import record_error, record_result
+
+REQUEST_INPUT = SaleRequestInput(
+    params=HeartlandParams(
+        url="https://cert.api2.heartlandportico.com",
+        public_key="pkapi_cert_P6dRqs1LzfWJ6HgGVZ",
+        private_key="skapi_cert_MYl2AQAowiQAbLp5JesGKh7QFkcizOP2jcX9BrEMqQ",
+        term_id="0001",
+        cert_str="",
+        account_num="777703685",
+        developer_id="000000",
+        version_number="0000",
+        username="777703685",
+        password="$Test1234",
+        constants=Constants(default_currency="USD"),
+    ),
+    reference=uuid4(),
+    qa=False,
+    amount=10.25,
+    zip_code="75024",
+    credit_card_data=CreditCardDataDataclass(
+        number="4111111111111111", exp_month="12", exp_year="30", cvn="123",
+    ),
+)
+RESULT = {"response_code": "00", "transaction_id": "1234567890"}
+
+
+async def executor_run(fn):
+    return fn()
+
+
+APP = SimpleNamespace(ctx=SimpleNamespace(executor=SimpleNamespace(run=executor_run)))
+
+
+def gateway(**kwargs):
+    return RESULT
+
+
+async def legacy():
+    request_input, operation = REQUEST_INPUT, "sale"
+    kwargs = charge_kwargs(request_input)
+
+    def call():
+        return gateway(**kwargs)
+
+    async_gateway = getattr(APP.ctx, "async_gateway", None)
+    run = APP.ctx.executor.run if async_gateway is None else async_gateway.run
+    guard = getattr(APP.ctx, "gateway_guard", None)
+    if guard is not None:
+        run = partial(guard.run, guard.key(request_input.params), run)
+    idempotency = getattr(APP.ctx, "idempotency", None)
+    try:
+        if idempotency is None or not request_input.reference or operation not in {"sale"}:
+            result = await run(call)
+        else:
+            result = await idempotency.run(
+                idempotency_key(operation, request_input.params, request_input.reference),
+                partial(run, call),
+            )
+    except Exception as e:
+        record_error(operation, e)
+        raise
+    record_result(operation, result)
+    return result
+
+
+async def offload(call: Call):
+    return await call.app.ctx.executor.run(partial(gateway, **call.kwargs))
+
+
+DISPATCHER = Dispatcher(MIDDLEWARE, offload)
+BARE = Dispatcher((), offload)
+
+
+async def dispatched():
+    return await DISPATCHER.run(APP, OPERATIONS["sale"], REQUEST_INPUT)
+
+
+async def bare():
+    return await BARE.run(APP, OPERATIONS["sale"], REQUEST_INPUT)
+
+
+async def timeit(fn, number: int) -> float:
+    await fn()
+    start = time.perf_counter()
+    for _ in range(number):
+        await fn()
+    return time.perf_counter() - start
+
+
+async def main():
+    number = 50000
+    for name, fn in (("legacy", legacy), ("dispatcher", dispatched), ("bare", bare)):
+        total = await timeit(fn, number)
+        print(f"{name:>10}: {total / number * 1e6:6.2f} us/request")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
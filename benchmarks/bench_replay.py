@@ -0,0 +1,145 @@
+"""
+The full path of a route (decode, SDK builders, Portico XML, result
+extraction, encode) against recorded gateway responses, with no network.
+
+Record a cassette once, against the cert environment or benchmarks.fake_portico,
+by running the service with one worker and sending it the requests to replay:
+
+    SANIC_GATEWAY_CASSETTE=record SANIC_GATEWAY_CASSETTE_PATH=sale.jsonl.gz \\
+        WORKERS=1 python app.py
+
+then replay it in-process, as often as needed, on any machine:
+
+    python -m benchmarks.bench_replay --cassette sale.jsonl.gz --route sale \\
+        --requests 2000 --profile sale.prof
+
+Requests go straight through the app's ASGI interface, started once. Latencies
+are not replayed by default (--latency-scale 0), so the time is the service's
+own; --profile writes a cProfile of the timed requests.
+"""
+import argparse
+import asyncio
+import cProfile
+import json
+import statistics
+import time
+
+from benchmarks.loadtest import BODIES
+from service import app
+
+
+async def lifespan(started: asyncio.Event, stop: asyncio.Event):
+    """
+    Runs the app's start-up once, and its shutdown once ``stop`` is set.
+    """
+    messages = iter([{"type": "lifespan.startup"}])
+
+    async def receive():
+        message = next(messages, None)
+        if message is None:
+            await stop.wait()
+            message = {"type": "lifespan.shutdown"}
+        return message
+
+    async def send(message):
+        if message["type"] == "lifespan.startup.complete":
+            started.set()
+
+    await app({"type": "lifespan", "asgi": {"version": "3.0"}}, receive, send)
+
+
+async def post(path: str, body: bytes) -> tuple[int, bytes]:
+    """
+    One request straight through the app's ASGI interface.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"bench"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("127.0.0.1", 80),
+    }
+    requests = iter([{"type": "http.request", "body": body, "more_body": False}])
+    status, chunks = 0, []
+
+    async def receive():
+        return next(requests, None) or {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+def body(route: str) -> bytes:
+    # the gateway URL only has to match the recorded path
+    return json.dumps(BODIES[route]("https://cert.api2.heartlandportico.com")).encode()
+
+
+async def run(route: str, requests: int, profile: cProfile.Profile) -> list[float]:
+    started, stop = asyncio.Event(), asyncio.Event()
+    server = asyncio.create_task(lifespan(started, stop))
+    await started.wait()
+    path = f"/api/heartland/{route}"
+    times = []
+    try:
+        await post(path, body(route))
+        for _ in range(requests):
+            payload = body(route)
+            start = time.perf_counter()
+            profile.enable()
+            status, response = await post(path, payload)
+            profile.disable()
+            times.append(time.perf_counter() - start)
+            if status != 200:
+                raise RuntimeError(f"{route} answered {status}: {response.decode()}")
+    finally:
+        stop.set()
+        await server
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cassette", required=True)
+    parser.add_argument("--route", default="sale", choices=sorted(BODIES))
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--latency-scale", type=float, default=0.0)
+    parser.add_argument("--profile", help="write a cProfile of the timed requests here")
+    args = parser.parse_args()
+
+    app.config.GATEWAY_CASSETTE = "replay"
+    app.config.GATEWAY_CASSETTE_PATH = args.cassette
+    app.config.GATEWAY_CASSETTE_LATENCY_SCALE = args.latency_scale
+    # every request would otherwise be a circuit breaker sample
+    app.config.GATEWAY_GUARD = False
+
+    profile = cProfile.Profile()
+    times = asyncio.run(run(args.route, args.requests, profile))
+    if args.profile:
+        profile.dump_stats(args.profile)
+    times.sort()
+    print(f"{args.route}: {len(times)} requests")
+    print(f"  median: {statistics.median(times) * 1e3:.3f} ms")
+    print(f"     p99: {times[int(len(times) * 0.99) - 1] * 1e3:.3f} ms")
+    print(f"    mean: {statistics.fmean(times) * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
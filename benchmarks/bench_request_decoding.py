@@ -0,0 +1,77 @@
+"""
+Decoding cost of a realistic /sale body.
+
+``legacy`` is the previous path: the request's parsed JSON handed to
+ignore_properties, which reflected over the dataclass fields on every call
+and recursed through the __post_init__ hooks. ``compiled`` uses the cached
+per-class decoders and ``msgspec`` the typed fast path of decode_json.
+"""
+import json
+import timeit
+from dataclasses import fields
+from uuid import uuid4
+
+from service import blue_print, json_util
+from service.blue_print import SaleRequestInput
+from service.business import params
+
+BODY = json.dumps({
+    "params": {
+        "url": "https://cert.api2.heartlandportico.com",
+        "public_key": "pkapi_cert_P6dRqs1LzfWJ6HgGVZ",
+        "private_key": "skapi_cert_MYl2AQAowiQAbLp5JesGKh7QFkcizOP2jcX9BrEMqQ",
+        "term_id": "0001",
+        "cert_str": "",
+        "account_num": "777703685",
+        "developer_id": "000000",
+        "version_number": "0000",
+        "username": "777703685",
+        "password": "$Test1234",
+        "constants": {"default_currency": "USD"},
+    },
+    "reference": str(uuid4()),
+    "qa": False,
+    "amount": 10.25,
+    "zip_code": "75024",
+    "credit_card_data": {
+        "number": "4111111111111111",
+        "exp_month": "12",
+        "exp_year": "30",
+        "cvn": "123",
+        "zip_code": "75024",
+    },
+}).encode()
+
+
+def legacy_ignore_properties(cls, dict_):
+    if isinstance(dict_, cls):
+        return dict_
+    class_fields = {f.name for f in fields(cls)}
+    filtered = {k: v for k, v in dict_.items() if k in class_fields}
+    return cls(**filtered)
+
+
+def legacy():
+    return legacy_ignore_properties(SaleRequestInput, json.loads(BODY))
+
+
+def compiled():
+    return json_util.decoder_for(SaleRequestInput)(json.loads(BODY))
+
+
+def fast():
+    return json_util.decode_json(SaleRequestInput, BODY)
+
+
+if __name__ == "__main__":
+    number = 20000
+    candidates = [("legacy", legacy), ("compiled", compiled)]
+    if json_util.msgspec is not None:
+        candidates.append(("msgspec", fast))
+    for name, fn in candidates:
+        # the __post_init__ hooks recurse through ignore_properties
+        hook = legacy_ignore_properties if fn is legacy else json_util.ignore_properties
+        blue_print.ignore_properties = params.ignore_properties = hook
+        fn()
+        total = timeit.timeit(fn, number=number)
+        print(f"{name:>8}: {total / number * 1e6:6.2f} us/request")
@@ -0,0 +1,64 @@
+"""
+Encoding cost of an echoed /sale request and of a full transaction result.
+
+``legacy`` is the previous echo path: ``dumps`` with an encoder that
+``asdict``-copied every dataclass, then ``sanic.json`` encoding that string a
+second time as a JSON string literal. ``stdlib`` and ``orjson`` are the
+response serializers from service.json_util, each encoding the object once.
+"""
+import json
+import timeit
+from dataclasses import asdict, is_dataclass
+from uuid import UUID
+
+from service import json_util
+from service.blue_print import SaleRequestInput
+
+from benchmarks.bench_request_decoding import BODY
+
+REQUEST = json_util.decode_json(SaleRequestInput, BODY)
+
+RESULT = {
+    "response_code": "00",
+    "response_message": "APPROVAL",
+    "transaction_id": "1234567890",
+    "authorization_code": "12345A",
+    "avs_response_code": "Y",
+    "avs_response_message": "ADDRESS AND ZIP MATCH",
+    "cvn_response_code": "M",
+    "cvn_response_message": "MATCH",
+    "card_type": "Visa",
+    "card_last_4": "1111",
+    "reference_number": "123456789012",
+    "client_transaction_id": "6b1f0d1c-7c9e-4b7e-9d7e-1a2b3c4d5e6f",
+    "token": "supt_0123456789abcdef",
+}
+
+
+class LegacyEncoder(json.JSONEncoder):
+    def default(self, o):
+        if is_dataclass(o):
+            return asdict(o)
+        if isinstance(o, UUID):
+            return str(o)
+        return super().default(o)
+
+
+def legacy_echo():
+    return json.dumps(json.dumps(REQUEST, cls=LegacyEncoder)).encode()
+
+
+if __name__ == "__main__":
+    number = 20000
+    candidates = [("legacy", legacy_echo, None)]
+    names = ["stdlib"] + (["orjson"] if json_util.orjson is not None else [])
+    for name in names:
+        dumps = json_util.serializer(name)
+        candidates.append((name, lambda dumps=dumps: dumps(REQUEST), dumps))
+    for name, fn, dumps in candidates:
+        echo = timeit.timeit(fn, number=number) / number
+        line = f"{name:>8}: echo {echo * 1e6:6.2f} us"
+        if dumps is not None:
+            result = timeit.timeit(lambda: dumps(RESULT), number=number) / number
+            line += f", result {result * 1e6:6.2f} us"
+        print(line)
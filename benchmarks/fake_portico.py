@@ -0,0 +1,246 @@
+"""
+A local stand-in for the Portico gateway, for load tests.
+
+Answers every POST with a Portico SOAP response for the transaction type in
+the request (CreditSale, CreditAuth, CreditReturn, CreditVoid, BatchClose,
+...), after a configurable latency. A share of requests can be declined by the
+issuer, rejected by the gateway or fail with an HTTP 503.
+
+    python -m benchmarks.fake_portico --port 8900 --latency-ms 150 --jitter-ms 50
+
+and point the ``url`` of the request params at http://127.0.0.1:8900.
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Union
+
+TRANSACTION_TYPE = re.compile(rb"<(?:\w+:)?Transaction>\s*<(?:\w+:)?(\w+)")
+CLIENT_TXN_ID = re.compile(rb"<(?:\w+:)?ClientTxnId>([^<]*)<")
+
+ENVELOPE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"'
+    ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+    ' xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+    "<soap:Body>"
+    '<PosResponse rootUrl="https://cert.api2.heartlandportico.com/Hps.Exchange.PosGateway"'
+    ' xmlns="http://Hps.Exchange.PosGateway">'
+    "<Ver1.0>"
+    "<Header>"
+    "<LicenseId>123456</LicenseId>"
+    "<SiteId>123456</SiteId>"
+    "<DeviceId>1234567</DeviceId>"
+    "<GatewayTxnId>{txn_id}</GatewayTxnId>"
+    "<GatewayRspCode>{gateway_code}</GatewayRspCode>"
+    "<GatewayRspMsg>{gateway_message}</GatewayRspMsg>"
+    "<RspDT>{timestamp}</RspDT>"
+    "{client_txn_id}"
+    "</Header>"
+    "{transaction}"
+    "</Ver1.0>"
+    "</PosResponse>"
+    "</soap:Body>"
+    "</soap:Envelope>"
+)
+
+AUTHORIZATION = (
+    "<RspCode>{code}</RspCode>"
+    "<RspText>{text}</RspText>"
+    "<AuthCode>{auth_code}</AuthCode>"
+    "<AVSRsltCode>Y</AVSRsltCode>"
+    "<CVVRsltCode>M</CVVRsltCode>"
+    "<RefNbr>{reference}</RefNbr>"
+    "<AVSResultCodeMsg>AVS Match</AVSResultCodeMsg>"
+    "<CardType>Visa</CardType>"
+    "<CVVRsltText>Match.</CVVRsltText>"
+)
+
+BATCH_CLOSE = (
+    "<BatchId>{batch_id}</BatchId>"
+    "<TxnCnt>{count}</TxnCnt>"
+    "<TotalAmt>{total}</TotalAmt>"
+    "<BatchSeqNbr>{batch_id}</BatchSeqNbr>"
+)
+
+# transaction types that carry an issuer authorization
+AUTHORIZING = frozenset({
+    "CreditSale",
+    "CreditAuth",
+    "CreditReturn",
+    "CreditAccountVerify",
+})
+
+
+@dataclass
+class Behaviour:
+    latency_ms: float = 100.0
+    jitter_ms: float = 0.0
+    decline_rate: float = 0.0
+    error_rate: float = 0.0
+    http_error_rate: float = 0.0
+
+
+class FakePortico:
+    def __init__(self, behaviour: Behaviour, seed: Union[int, None] = None):
+        self.behaviour = behaviour
+        self.random = random.Random(seed)
+        self.txn_ids = itertools.count(1000000000)
+        self.batch_ids = itertools.count(1000)
+        self.requests = 0
+
+    def delay(self) -> float:
+        b = self.behaviour
+        return max(0.0, b.latency_ms + self.random.uniform(-b.jitter_ms, b.jitter_ms)) / 1000.0
+
+    def respond(self, body: bytes) -> tuple[int, bytes]:
+        """
+        The HTTP status and SOAP body for a PosRequest.
+        """
+        self.requests += 1
+        b = self.behaviour
+        if self.random.random() < b.http_error_rate:
+            return 503, b"Service Unavailable"
+
+        match = TRANSACTION_TYPE.search(body)
+        kind = match.group(1).decode() if match else "Unknown"
+        client = CLIENT_TXN_ID.search(body)
+        txn_id = next(self.txn_ids)
+
+        if self.random.random() < b.error_rate:
+            gateway_code, gateway_message, transaction = 30, "Gateway timed out", ""
+        else:
+            gateway_code, gateway_message = 0, "Success"
+            transaction = f"<Transaction><{kind}>{self._details(kind, txn_id)}</{kind}></Transaction>"
+
+        text = ENVELOPE.format(
+            txn_id=txn_id,
+            gateway_code=gateway_code,
+            gateway_message=gateway_message,
+            timestamp=time.strftime("%Y-%m-%dT%H:%M:%S.000"),
+            client_txn_id=(
+                f"<ClientTxnId>{client.group(1).decode()}</ClientTxnId>" if client else ""
+            ),
+            transaction=transaction,
+        )
+        return 200, text.encode()
+
+    def _details(self, kind: str, txn_id: int) -> str:
+        if kind == "BatchClose":
+            return BATCH_CLOSE.format(
+                batch_id=next(self.batch_ids),
+                count=self.random.randint(1, 500),
+                total=f"{self.random.uniform(10, 50000):.2f}",
+            )
+        if kind not in AUTHORIZING:
+            return ""
+        declined = self.random.random() < self.behaviour.decline_rate
+        return AUTHORIZATION.format(
+            code="05" if declined else "00",
+            text="DECLINE" if declined else "APPROVAL",
+            auth_code="" if declined else f"{txn_id % 1000000:06d}",
+            reference=f"{txn_id:012d}",
+        )
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        A minimal HTTP/1.1 keep-alive loop; enough for the SDK and aiohttp.
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                length = 0
+                close = False
+                for line in head.split(b"\r\n")[1:]:
+                    name, _, value = line.partition(b":")
+                    name = name.strip().lower()
+                    if name == b"content-length":
+                        length = int(value)
+                    elif name == b"connection" and value.strip().lower() == b"close":
+                        close = True
+                body = await reader.readexactly(length) if length else b""
+
+                await asyncio.sleep(self.delay())
+                status, payload = self.respond(body)
+                reason = b"OK" if status == 200 else b"Service Unavailable"
+                writer.write(
+                    b"HTTP/1.1 %d %s\r\n"
+                    b"Content-Type: text/xml; charset=utf-8\r\n"
+                    b"Content-Length: %d\r\n"
+                    b"%s\r\n" % (
+                        status, reason, len(payload),
+                        b"Connection: close\r\n" if close else b"",
+                    ) + payload
+                )
+                await writer.drain()
+                if close:
+                    return
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle, host, port, backlog=4096)
+
+
+def start_in_thread(behaviour: Behaviour, host: str = "127.0.0.1", port: int = 0) -> str:
+    """
+    Runs a FakePortico on a daemon thread and returns its base URL.
+    """
+    started = threading.Event()
+    address: list[tuple[str, int]] = []
+
+    def run():
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(FakePortico(behaviour).serve(host, port))
+        address.append(server.sockets[0].getsockname()[:2])
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="fake-portico", daemon=True).start()
+    started.wait()
+    return "http://{}:{}".format(*address[0])
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--decline-rate", type=float, default=0.0,
+                        help="share of authorizations declined by the issuer (RspCode 05)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of requests rejected by the gateway (GatewayRspCode 30)")
+    parser.add_argument("--http-error-rate", type=float, default=0.0,
+                        help="share of requests answered with HTTP 503")
+
+
+def behaviour_from(args: argparse.Namespace) -> Behaviour:
+    return Behaviour(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        decline_rate=args.decline_rate,
+        error_rate=args.error_rate,
+        http_error_rate=args.http_error_rate,
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = await FakePortico(behaviour_from(args)).serve(args.host, args.port)
+    print(f"fake Portico listening on http://{args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
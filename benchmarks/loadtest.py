@@ -0,0 +1,265 @@
+"""
+Load test against a local fake Portico gateway.
+
+Starts benchmarks.fake_portico and ``app.py`` (unless --target points at a
+running service), drives one of the /api/heartland routes at a fixed request
+rate and reports latency percentiles, throughput and the peak memory of the
+service's worker processes:
+
+    python -m benchmarks.loadtest --route sale --rps 500 --duration 30 --workers 2
+
+Requests are scheduled open-loop, and latency is measured from when a
+request was due rather than when it was sent, so a stalled service shows up
+in the percentiles instead of quietly lowering the request rate. Needs aiohttp
+(a dev dependency).
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Union
+from uuid import uuid4
+
+import aiohttp
+
+from benchmarks.fake_portico import add_arguments
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CARD = {"number": "4111111111111111", "exp_month": "12", "exp_year": "30", "cvn": "123"}
+
+
+def params(gateway_url: str) -> dict[str, Any]:
+    return {
+        "url": gateway_url,
+        "public_key": "pkapi_cert_loadtest",
+        "private_key": "skapi_cert_loadtest",
+        "term_id": "0001",
+        "cert_str": "",
+        "account_num": "777703685",
+        "developer_id": "000000",
+        "version_number": "0000",
+        "username": "777703685",
+        "password": "loadtest",
+        "constants": {"default_currency": "USD"},
+    }
+
+
+def _base(gateway_url: str) -> dict[str, Any]:
+    return {"params": params(gateway_url), "reference": str(uuid4()), "qa": True}
+
+
+def _charge(gateway_url: str) -> dict[str, Any]:
+    return {**_base(gateway_url), "amount": 10.25, "zip_code": "75024", "credit_card_data": CARD}
+
+
+def _transaction(gateway_url: str) -> dict[str, Any]:
+    return {
+        **_base(gateway_url),
+        "heartland_transaction_id": "1000000001",
+        "payment_transaction_amount": "10.25",
+        "amount": None,
+    }
+
+
+def _verify(gateway_url: str) -> dict[str, Any]:
+    address = dict.fromkeys(
+        ("street_address_1", "street_address_2", "street_address_3", "city", "province"))
+    return {**_base(gateway_url), "credit_card_data": CARD,
+            "address": {**address, "postal_code": "75024"}}
+
+
+BODIES: dict[str, Callable[[str], dict[str, Any]]] = {
+    "sale": _charge,
+    "authorize": _charge,
+    "verify": _verify,
+    "refund": _transaction,
+    "capture": _transaction,
+    "reversal": _transaction,
+    "void": _transaction,
+    "settle": _base,
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def descendants(pid: int) -> list[int]:
+    """
+    Child processes of ``pid``, recursively (Linux only).
+    """
+    children: dict[int, list[int]] = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # the command name is in parentheses and may contain spaces
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry.name))
+    found, stack = [], [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def rss_mb(pid: int) -> Union[float, None]:
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def sample_memory(pid: int, peaks: dict[int, float], interval: float = 0.5):
+    while True:
+        for child in [pid, *descendants(pid)]:
+            rss = rss_mb(child)
+            if rss is not None:
+                peaks[child] = max(peaks.get(child, 0.0), rss)
+        await asyncio.sleep(interval)
+
+
+async def drive(target: str, route: str, gateway_url: str, rps: float, duration: float,
+                connections: int) -> tuple[list[float], Counter, float]:
+    url = f"{target}/api/heartland/{route}"
+    make_body = BODIES[route]
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    total = int(rps * duration)
+    connector = aiohttp.TCPConnector(limit=connections)
+    timeout = aiohttp.ClientTimeout(total=120)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def one(due: float, body: bytes):
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            try:
+                async with session.post(url, data=body) as response:
+                    await response.read()
+                    status = str(response.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - due)
+            statuses[status] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            one(start + i / rps, json.dumps(make_body(gateway_url)).encode())
+            for i in range(total)
+        ))
+        elapsed = time.perf_counter() - start
+    return latencies, statuses, elapsed
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--route", choices=sorted(BODIES), default="sale")
+    parser.add_argument("--rps", type=float, default=100.0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--connections", type=int, default=1000,
+                        help="client connection limit")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--target", help="base URL of a running service; not started here")
+    parser.add_argument("--gateway-url", help="a running fake gateway; not started here")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    processes: list[subprocess.Popen] = []
+    try:
+        gateway_url = args.gateway_url
+        if gateway_url is None:
+            port = free_port()
+            processes.append(subprocess.Popen([
+                sys.executable, "-m", "benchmarks.fake_portico", "--port", str(port),
+                "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+                "--decline-rate", str(args.decline_rate), "--error-rate", str(args.error_rate),
+                "--http-error-rate", str(args.http_error_rate),
+            ], cwd=ROOT, stdout=subprocess.DEVNULL))
+            gateway_url = f"http://127.0.0.1:{port}"
+
+        target, service = args.target, None
+        if target is None:
+            port = free_port()
+            env = dict(os.environ, WORKERS=str(args.workers), HOST="127.0.0.1", PORT=str(port))
+            service = subprocess.Popen(
+                [sys.executable, "app.py"], cwd=ROOT, env=env,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            processes.append(service)
+            target = f"http://127.0.0.1:{port}"
+        await wait_until_up(f"{target}/metrics")
+
+        peaks: dict[int, float] = {}
+        sampler = asyncio.ensure_future(sample_memory(service.pid, peaks)) if service else None
+        try:
+            latencies, statuses, elapsed = await drive(
+                target, args.route, gateway_url, args.rps, args.duration, args.connections
+            )
+        finally:
+            if sampler is not None:
+                sampler.cancel()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=120)
+
+    report = {
+        "route": args.route,
+        "requests": len(latencies),
+        "target_rps": args.rps,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 2),
+        "statuses": dict(statuses),
+        # the Sanic main process, its workers and multiprocessing helpers;
+        # the workers are the largest
+        "peak_rss_mb_by_pid": {str(pid): round(mb, 1) for pid, mb in sorted(peaks.items())},
+        "peak_rss_mb_total": round(sum(peaks.values()), 1),
+    }
+    if args.json:
+        print(json.dumps(report))
+        return
+    for key, value in report.items():
+        print(f"{key:>18}: {value}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
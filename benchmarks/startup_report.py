@@ -0,0 +1,134 @@
+"""
+Where a worker's cold start goes.
+
+Reports what ``python -X importtime -c "import app"`` spends per top-level
+package and on the slowest modules, then starts ``app.py`` a few times and
+measures the time from spawning it to the first answered request:
+
+    python -m benchmarks.startup_report --runs 5
+
+The first request is GET /metrics, which touches no SDK code, so the time is
+the service's own start-up (imports, listeners, prewarm) and not a gateway
+call.
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import defaultdict
+from pathlib import Path
+
+from benchmarks.loadtest import free_port
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def import_times(module: str = "app") -> list[tuple[str, int, int]]:
+    """
+    (module, self µs, cumulative µs) for every module ``import module`` loads,
+    in import order.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def by_package(rows: list[tuple[str, int, int]]) -> dict[str, int]:
+    """
+    Self time summed per top-level package, in µs.
+    """
+    totals: dict[str, int] = defaultdict(int)
+    for name, self_us, _ in rows:
+        totals[name.split(".", 1)[0]] += self_us
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+def time_to_first_request(timeout: float = 60.0) -> float:
+    """
+    Seconds from spawning ``app.py`` with one worker to its first 200.
+    """
+    port = free_port()
+    env = dict(os.environ, WORKERS="1", HOST="127.0.0.1", PORT=str(port))
+    url = f"http://127.0.0.1:{port}/metrics"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "app.py"], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                # a connection made before the worker is up waits in the
+                # listen backlog and is answered once it is
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:  # refused until the socket is bound
+                pass
+            if process.poll() is not None:
+                raise RuntimeError(f"app.py exited with {process.returncode}")
+            time.sleep(0.01)
+        raise RuntimeError(f"no answer within {timeout}s")
+    finally:
+        # the main process may still be starting up and ignore SIGTERM; a
+        # graceful stop is not what is being measured
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=3,
+                        help="app.py starts to time; 0 to only report imports")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    rows = import_times()
+    report = {
+        "import_app_ms": round(sum(self_us for _, self_us, _ in rows) / 1000, 1),
+        "modules": len(rows),
+        "by_package_ms": {
+            name: round(us / 1000, 1)
+            for name, us in list(by_package(rows).items())[:args.top]
+        },
+        "slowest_modules_ms": {
+            name: round(us / 1000, 1)
+            for name, us, _ in sorted(rows, key=lambda row: -row[1])[:args.top]
+        },
+    }
+    if args.runs:
+        runs = [time_to_first_request() for _ in range(args.runs)]
+        report["first_request_ms"] = {
+            "median": round(statistics.median(runs) * 1000, 1),
+            "min": round(min(runs) * 1000, 1),
+            "max": round(max(runs) * 1000, 1),
+        }
+
+    if args.json:
+        print(json.dumps(report))
+        return
+    for key, value in report.items():
+        if isinstance(value, dict):
+            print(f"{key}:")
+            for name, ms in value.items():
+                print(f"  {name:>48}: {ms}")
+        else:
+            print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
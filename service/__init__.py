@@ -1,10 +1,225 @@
+from functools import partial
+
 from sanic import Sanic
 
-from service.blue_print import bp as bp_bp
+from service.blue_print import bp as bp_bp, close_batch, job_item, prewarm
+from service.breaker import GatewayGuard
+from service.business.batches import batches
+from service.business.containers import containers
+from service.business.cassette import Cassette
+from service.business.transport import PooledTransport, transport
+from service.executor import PaymentsExecutor
+from service.idempotency import IdempotencyCache
+from service.jobs import JobJournal, JobRunner
+from service.settlement import SettlementScheduler
+from service.verify_cache import VerifyCache
+from service.json_util import serializer
+from service.metrics import bp as metrics_bp, start_timer, stop_timer
+from service.profiler import bp as admin_bp, track as track_profiled
+from service.metrics import (
+    CIRCUIT_STATE,
+    CONCURRENCY_LIMIT,
+    EXECUTOR_QUEUED,
+    GATEWAY_IN_FLIGHT,
+    EXECUTOR_RUNNING,
+    POOL_CONNECTIONS_OPENED,
+    POOL_IDLE_CONNECTIONS,
+)
 
 app = Sanic("GlobalPaymentsService")
 
 app.blueprint(bp_bp)
+app.blueprint(metrics_bp)
+app.blueprint(admin_bp)
+app.on_request(start_timer)
+app.on_request(track_profiled)
+app.on_response(stop_timer)
 
 app.config.HEALTH = True
 app.config.HEALTH_ENDPOINT = True
+
+# Bounded pool for the blocking Heartland SDK calls; override with
+# SANIC_PAYMENTS_EXECUTOR_* environment variables.
+app.config.setdefault("PAYMENTS_EXECUTOR_WORKERS", 32)
+app.config.setdefault("PAYMENTS_EXECUTOR_QUEUE", 64)
+app.config.setdefault("PAYMENTS_EXECUTOR_TIMEOUT", 70.0)
+
+# Configured SDK containers are cached per merchant.
+app.config.setdefault("CONTAINER_CACHE_SIZE", 256)
+app.config.setdefault("CONTAINER_CACHE_TTL", 3600.0)
+
+# Keep-alive connection pools to the gateway, one per host.
+app.config.setdefault("GATEWAY_NUM_POOLS", 16)
+app.config.setdefault("GATEWAY_POOL_SIZE", 32)
+app.config.setdefault("GATEWAY_POOL_BLOCK", False)
+app.config.setdefault("GATEWAY_KEEP_ALIVE", True)
+app.config.setdefault("GATEWAY_CONNECT_TIMEOUT", 5.0)
+app.config.setdefault("GATEWAY_READ_TIMEOUT", 65.0)
+app.config.setdefault("GATEWAY_RETRIES", 2)
+# kept-alive connections idle longer than this are closed, not reused, so a
+# payment is not sent just as the gateway drops the connection
+app.config.setdefault("GATEWAY_IDLE_TIMEOUT", 4.0)
+# "sync" sends gateway requests from executor threads; "async" sends them
+# with aiohttp from the event loop, up to GATEWAY_ASYNC_LIMIT at once.
+app.config.setdefault("GATEWAY_TRANSPORT", "sync")
+app.config.setdefault("GATEWAY_ASYNC_LIMIT", 1000)
+# "record" appends every gateway round trip, masked, to GATEWAY_CASSETTE_PATH;
+# "replay" answers from it without the network, after the recorded latency
+# times GATEWAY_CASSETTE_LATENCY_SCALE. See service.business.cassette; record
+# with one worker, since workers would interleave their writes.
+app.config.setdefault("GATEWAY_CASSETTE", "")
+app.config.setdefault("GATEWAY_CASSETTE_PATH", "gateway-cassette.jsonl.gz")
+app.config.setdefault("GATEWAY_CASSETTE_LATENCY_SCALE", 1.0)
+
+# Circuit breaker and adaptive concurrency limit per gateway host, or per
+# merchant with GATEWAY_GUARD_SCOPE = "merchant", for at most
+# GATEWAY_GUARD_MAX_ENTRIES of them; see service.breaker.
+app.config.setdefault("GATEWAY_GUARD", True)
+app.config.setdefault("GATEWAY_GUARD_SCOPE", "url")
+app.config.setdefault("GATEWAY_GUARD_MAX_ENTRIES", 256)
+app.config.setdefault("CIRCUIT_WINDOW", 30.0)
+app.config.setdefault("CIRCUIT_MIN_CALLS", 20)
+app.config.setdefault("CIRCUIT_FAILURE_RATE", 0.5)
+app.config.setdefault("CIRCUIT_SLOW_CALL_SECONDS", 10.0)
+app.config.setdefault("CIRCUIT_SLOW_CALL_RATE", 0.8)
+app.config.setdefault("CIRCUIT_OPEN_SECONDS", 15.0)
+app.config.setdefault("CIRCUIT_PROBES", 3)
+app.config.setdefault("CONCURRENCY_INITIAL_LIMIT", 64)
+app.config.setdefault("CONCURRENCY_MIN_LIMIT", 4)
+app.config.setdefault("CONCURRENCY_MAX_LIMIT", 1000)
+app.config.setdefault("CONCURRENCY_LATENCY_THRESHOLD", 5.0)
+
+# Transactions remembered per worker to choose void or refund up front.
+app.config.setdefault("BATCH_STATE_MAX_TRANSACTIONS", 100000)
+
+# /batch fan-out: default and maximum operations in flight per batch.
+app.config.setdefault("BATCH_CONCURRENCY", 8)
+app.config.setdefault("BATCH_MAX_CONCURRENCY", 32)
+app.config.setdefault("BATCH_MAX_OPERATIONS", 10000)
+
+# Bulk refund/void/capture jobs, journaled in JOBS_PATH (shared by every
+# worker) so they survive a restart, and deleted JOBS_TTL seconds after they
+# were last touched; see service.jobs.
+app.config.setdefault("JOBS_PATH", "/tmp/globalpayments-jobs.sqlite3")
+app.config.setdefault("JOBS_TTL", 7 * 86400.0)
+app.config.setdefault("JOBS_CONCURRENCY", 8)
+app.config.setdefault("JOBS_MAX_CONCURRENCY", 32)
+app.config.setdefault("JOBS_LEASE", 30.0)
+# longest upload record in bytes; a longer one fails the upload with a 400
+app.config.setdefault("JOBS_MAX_LINE", 64 * 1024)
+
+# De-duplication of sale/authorize/refund retries by reference:
+# "memory" (per worker), "sqlite" (shared through IDEMPOTENCY_PATH) or "none".
+# IDEMPOTENCY_SECRET keys the request fingerprints; the sqlite store needs it
+# set to the same value in every worker.
+app.config.setdefault("IDEMPOTENCY_STORE", "memory")
+app.config.setdefault("IDEMPOTENCY_SECRET", "")
+app.config.setdefault("IDEMPOTENCY_PATH", "/tmp/globalpayments-idempotency.sqlite3")
+app.config.setdefault("IDEMPOTENCY_TTL", 86400.0)
+app.config.setdefault("IDEMPOTENCY_MAX_ENTRIES", 100000)
+app.config.setdefault("IDEMPOTENCY_PENDING_TTL", 120.0)
+app.config.setdefault("IDEMPOTENCY_WAIT", 75.0)
+
+# Batch closes run as jobs shared by every worker through SETTLE_JOBS_PATH;
+# /settle waits up to SETTLE_WAIT seconds for one. SETTLE_SCHEDULE_PATH is an
+# optional JSON list of {"params": ..., "at": "HH:MM"} (UTC) daily closes, run
+# by whichever worker holds SETTLE_LOCK_PATH.
+app.config.setdefault("SETTLE_JOBS_PATH", "/tmp/globalpayments-settlement.sqlite3")
+app.config.setdefault("SETTLE_JOB_TTL", 7 * 86400.0)
+app.config.setdefault("SETTLE_WAIT", 75.0)
+app.config.setdefault("SETTLE_SCHEDULE_PATH", "")
+app.config.setdefault("SETTLE_LOCK_PATH", "/tmp/globalpayments-settlement.lock")
+
+# Optional cache of /verify results per card + address, see service.verify_cache.
+app.config.setdefault("VERIFY_CACHE", False)
+app.config.setdefault("VERIFY_CACHE_TTL", 30.0)
+app.config.setdefault("VERIFY_CACHE_MAX_ENTRIES", 10000)
+app.config.setdefault("VERIFY_CACHE_SALT", "")
+
+# Response encoder: "orjson", "stdlib" or "auto" (orjson when installed).
+app.config.setdefault("JSON_SERIALIZER", "auto")
+
+# /admin/profile samples a worker on demand; it answers 404 until ADMIN_TOKEN
+# is set and then needs "Authorization: Bearer <ADMIN_TOKEN>". See service.profiler.
+app.config.setdefault("ADMIN_TOKEN", "")
+app.config.setdefault("PROFILE_INTERVAL", 0.01)
+app.config.setdefault("PROFILE_MAX_SECONDS", 120.0)
+
+
+@app.before_server_start
+async def start_executor(app: Sanic):
+    app.ctx.executor = PaymentsExecutor.from_config(app.config)
+    app.ctx.dumps = serializer(str(app.config.JSON_SERIALIZER))
+    containers.set_limits(
+        max_size=int(app.config.CONTAINER_CACHE_SIZE),
+        ttl=float(app.config.CONTAINER_CACHE_TTL),
+    )
+    transport.configure(**PooledTransport.config_kwargs(app.config))
+    transport.cassette = Cassette.from_config(app.config)
+    app.ctx.idempotency = IdempotencyCache.from_config(app.config)
+    app.ctx.verify_cache = VerifyCache.from_config(app.config)
+    app.ctx.gateway_guard = GatewayGuard.from_config(app.config)
+    app.ctx.settlement = SettlementScheduler.from_config(app.config, partial(close_batch, app))
+    app.ctx.settlement.start()
+    batches.set_limits(max_transactions=int(app.config.BATCH_STATE_MAX_TRANSACTIONS))
+    batches.last_settled = app.ctx.settlement.jobs.last_settled
+    app.ctx.jobs = JobRunner(
+        JobJournal(
+            str(app.config.JOBS_PATH),
+            lease=float(app.config.JOBS_LEASE),
+            ttl=float(app.config.JOBS_TTL),
+        ),
+        partial(job_item, app),
+    )
+    app.ctx.async_gateway = None
+    if str(app.config.GATEWAY_TRANSPORT).lower() == "async":
+        # imported here so sync deployments don't load aiohttp at start-up
+        from service.business.async_transport import AsyncTransport
+
+        app.ctx.async_gateway = AsyncTransport.from_config(app.config, transport.cassette)
+        await app.ctx.async_gateway.start()
+
+    executor = app.ctx.executor
+    EXECUTOR_QUEUED.set_function(lambda: executor.queued)
+    EXECUTOR_RUNNING.set_function(lambda: executor.running)
+    POOL_IDLE_CONNECTIONS.set_function(
+        lambda: [((host,), s["idle_connections"]) for host, s in transport.stats().items()]
+    )
+    POOL_CONNECTIONS_OPENED.set_function(
+        lambda: [((host,), s["connections_opened"]) for host, s in transport.stats().items()]
+    )
+    guard = app.ctx.gateway_guard
+    if guard is not None:
+        states = {"closed": 0, "half_open": 1, "open": 2}
+        CIRCUIT_STATE.set_function(
+            lambda: [((key,), states[s["state"]]) for key, s in guard.stats().items()]
+        )
+        CONCURRENCY_LIMIT.set_function(
+            lambda: [((key,), s["limit"]) for key, s in guard.stats().items()]
+        )
+        GATEWAY_IN_FLIGHT.set_function(
+            lambda: [((key,), s["in_flight"]) for key, s in guard.stats().items()]
+        )
+
+
+@app.before_server_start
+async def warm_worker(app: Sanic):
+    prewarm()
+
+
+@app.after_server_stop
+async def stop_executor(app: Sanic):
+    batches.last_settled = None
+    await app.ctx.settlement.close()
+    await app.ctx.jobs.close()
+    app.ctx.executor.shutdown(wait=True)
+    transport.clear()
+    if app.ctx.async_gateway is not None:
+        await app.ctx.async_gateway.close()
+    if transport.cassette is not None:
+        transport.cassette.close()
+        transport.cassette = None
+    if app.ctx.idempotency is not None:
+        app.ctx.idempotency.close()
+    if app.ctx.verify_cache is not None:
+        app.ctx.verify_cache.close()
@@ -0,0 +1,64 @@
+"""
+Helpers for /api/heartland/batch.
+"""
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Union
+
+from service.business.params import HeartlandParams
+from service.deadline import parse as parse_deadline
+from service.json_util import ignore_properties
+
+# fields an operation inherits from the batch unless it sets its own
+SHARED_FIELDS = ("params", "qa", "projection", "deadline")
+
+
+@dataclass
+class BatchRequestInput:
+    operations: list[dict[str, Any]]
+    params: Union[HeartlandParams, None] = None
+    qa: bool = False
+    projection: Union[str, None] = None
+    concurrency: Union[int, None] = None
+    # epoch seconds or ISO 8601, see service.deadline
+    deadline: Union[float, str, None] = None
+
+    def __post_init__(self):
+        if self.params is not None and not isinstance(self.params, HeartlandParams):
+            self.params = ignore_properties(HeartlandParams, self.params)
+        if self.deadline is not None:
+            self.deadline = parse_deadline(self.deadline)
+
+    def items(self) -> list[dict[str, Any]]:
+        """
+        The operations with the shared fields filled in.
+        """
+        shared = {
+            name: getattr(self, name)
+            for name in SHARED_FIELDS
+            if getattr(self, name) is not None
+        }
+        shared.setdefault("reference", None)
+        return [{**shared, **operation} for operation in self.operations]
+
+
+async def fan_out(
+    calls: list[Callable[[], Awaitable[dict[str, Any]]]], limit: int
+) -> AsyncIterator[dict[str, Any]]:
+    """
+    Runs the calls with at most ``limit`` in flight, yielding their results
+    as they complete.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def bounded(call):
+        async with semaphore:
+            return await call()
+
+    tasks = [asyncio.ensure_future(bounded(call)) for call in calls]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
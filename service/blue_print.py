@@ -1,26 +1,50 @@
 from contextlib import suppress
-from dataclasses import dataclass
-from json import dumps
-from typing import cast, Union
-from uuid import UUID
+from dataclasses import dataclass, field
+from functools import partial
+from operator import itemgetter
+from typing import Any, AsyncIterator, cast, Type, TypeVar, Union
+from uuid import UUID, uuid4
 
-from sanic import json, Request
+from sanic import HTTPResponse, json, Request, Sanic
 from sanic.blueprints import Blueprint
+from sanic.exceptions import BadRequest, NotFound
+
+from python_sdk.globalpayments.api.entities import Transaction
 
 from service.business.functions import OnlinePayments, card_data, CreditCardDataDataclass, VerifyAddressDataClass, verify_address_data
 from service.business.params import HeartlandParams
-from service.json_util import ignore_properties, EnhancedJSONEncoder
+from service.business.results import PROJECTIONS, plan_for
+from service.batch import BatchRequestInput, fan_out
+from service.business.transport import transport
+from service import deadline
+from service.deadline import HEADER as DEADLINE_HEADER, parse as parse_deadline
+from service.dispatch import Operation, dispatcher
+from service.jobs import Job, job_params, JobParamsInput, JobRequestInput, parse_rows, PARAMS_HEADER
+from service.json_util import decode_json, ignore_properties, stdlib_dumps, warm_decoders, Serializer
+from service.metrics import stage
+from service.settlement import SUCCEEDED
 
 bp = Blueprint("Heartland", url_prefix="/api/heartland")
 
+_T = TypeVar("_T")
+
 
 @dataclass
 class RequestInput:
     params: HeartlandParams
     reference: UUID
     qa: bool
+    # which result fields to return, see service.business.results
+    projection: Union[str, None] = field(default=None, kw_only=True)
+    # when the caller stops waiting, epoch seconds or ISO 8601; see
+    # service.deadline
+    deadline: Union[float, str, None] = field(default=None, kw_only=True)
 
     def __post_init__(self):
+        if self.projection is not None and self.projection not in PROJECTIONS:
+            raise ValueError(f"Unknown projection: {self.projection}")
+        if self.deadline is not None:
+            self.deadline = parse_deadline(self.deadline)
         if not isinstance(self.params, HeartlandParams):
             self.params = ignore_properties(HeartlandParams, self.params)
         if self.reference and not isinstance(self.reference, UUID):
@@ -69,17 +93,74 @@ class CaptureRequestInput(RequestInput):
     payment_transaction_amount: str
 
 
-@bp.post("/verify")
-def verify(request: Request):
-    request_input = ignore_properties(VerifyRequestInput, request.json)
-    if getattr(request.app.ctx, "echo", False):
-        return json(dumps(request_input, cls=EnhancedJSONEncoder))
+def decode_request(request: Request, cls: Type[_T]) -> _T:
+    """
+    Decodes the request body into one of the RequestInput dataclasses.
+    """
+    try:
+        with stage("decode"):
+            return decode_json(cls, request.body)
+    except ValueError as e:
+        raise BadRequest(f"Invalid request body: {e}")
+
+
+def serializer_for(request: Request) -> Serializer:
+    return getattr(request.app.ctx, "dumps", stdlib_dumps)
+
+
+def request_deadline(request: Request) -> Union[float, None]:
+    """
+    The ``X-Request-Deadline`` header in epoch seconds, see service.deadline.
+    """
+    value = request.headers.get(DEADLINE_HEADER)
+    if not value:
+        return None
+    try:
+        return parse_deadline(value)
+    except ValueError:
+        raise BadRequest(f"Invalid {DEADLINE_HEADER}: {value}")
+
+
+def respond(request: Request, body: Any, status: int = 200) -> HTTPResponse:
+    """
+    ``sanic.json`` with the app's JSON_SERIALIZER, timed as the encode stage.
+    Request inputs (dataclasses) can be passed as they are.
+    """
+    with stage("encode"):
+        return json(body, status=status, dumps=serializer_for(request))
+
+
+async def run_operation(app: Sanic, request_input: RequestInput, operation: str) -> Any:
+    """
+    Runs one of OPERATIONS through the dispatcher, see service.dispatch.
+    """
+    return await dispatcher.run(app, OPERATIONS[operation], request_input)
+
+
+def prewarm():
+    """
+    Compiles the request decoders and the Transaction field plan, so the
+    first requests a worker serves don't pay for it.
+    """
+    warm_decoders(
+        RequestInput,
+        SaleRequestInput,
+        VerifyRequestInput,
+        RefundRequestInput,
+        CaptureRequestInput,
+        BatchRequestInput,
+        JobRequestInput,
+    )
+    plan_for(Transaction)
+
+
+@bp.get("/transport/stats")
+async def transport_stats(request: Request):
+    return respond(request, transport.stats())
+
 
-    result = OnlinePayments(
-        params=request_input.params,
-        reference=request_input.reference,
-        qa=request_input.qa
-    ).verify(
+def verify_kwargs(request_input: VerifyRequestInput) -> dict[str, Any]:
+    return dict(
         card=card_data(
             number=request_input.credit_card_data.number,
             exp_month=request_input.credit_card_data.exp_month,
@@ -95,20 +176,11 @@ def verify(request: Request):
             request_input.address.postal_code,
         )
     )
-    return json(result)
 
 
-@bp.post("/sale")
-def sale(request: Request):
-    request_input = ignore_properties(SaleRequestInput, request.json)
-    if getattr(request.app.ctx, "echo", False):
-        return json(dumps(request_input, cls=EnhancedJSONEncoder))
-
-    result = OnlinePayments(
-        params=request_input.params,
-        reference=request_input.reference,
-        qa=request_input.qa
-    ).sale(
+def charge_kwargs(request_input: SaleRequestInput) -> dict[str, Any]:
+    """sale and authorize"""
+    return dict(
         amount=request_input.amount,
         card=card_data(
             number=request_input.credit_card_data.number,
@@ -118,128 +190,262 @@ def sale(request: Request):
         ),
         zip_code=request_input.zip_code
     )
-    return json(result)
-
 
-@bp.post("/authorize")
-def authorize(request):
-    request_input = ignore_properties(SaleRequestInput, request.json)
-    if getattr(request.app.ctx, "echo", False):
-        return json(dumps(request_input, cls=EnhancedJSONEncoder))
 
-    result = OnlinePayments(
-        params=request_input.params,
-        reference=request_input.reference,
-        qa=request_input.qa
-    ).authorize(
-        amount=request_input.amount,
-        card=card_data(
-            number=request_input.credit_card_data.number,
-            exp_month=request_input.credit_card_data.exp_month,
-            exp_year=request_input.credit_card_data.exp_year,
-            cvn=request_input.credit_card_data.cvn,
-        ),
-        zip_code=request_input.zip_code
+def transaction_kwargs(request_input: Union[CaptureRequestInput, RefundRequestInput]) -> dict[str, Any]:
+    """capture, reversal and void"""
+    return dict(
+        heartland_transaction_id=request_input.heartland_transaction_id,
+        payment_transaction_amount=request_input.payment_transaction_amount,
     )
-    return json(result)
 
 
-@bp.post("/settle")
-def settle(request):
-    request_input = ignore_properties(RequestInput, request.json)
-    if getattr(request.app.ctx, "echo", False):
-        return json(dumps(request_input, cls=EnhancedJSONEncoder))
+def refund_kwargs(request_input: RefundRequestInput) -> dict[str, Any]:
+    """refund and force_refund"""
+    return dict(transaction_kwargs(request_input), amount=request_input.amount)
 
-    OnlinePayments(
-        params=request_input.params,
-        reference=request_input.reference,
-        qa=request_input.qa
-    ).settle()
-    return json({"settle_status": True})
 
+def settled(result: Any) -> dict[str, Any]:
+    """capture answers whether the amount was captured, not the transaction"""
+    return {"settle_status": True}
 
-@bp.post("/capture")
-def capture(request):
-    request_input = ignore_properties(CaptureRequestInput, request.json)
-    if getattr(request.app.ctx, "echo", False):
-        return json(dumps(request_input, cls=EnhancedJSONEncoder))
-
-    OnlinePayments(
-        params=request_input.params,
-        reference=request_input.reference,
-        qa=request_input.qa
-    ).capture(
-        heartland_transaction_id=request_input.heartland_transaction_id,
-        payment_transaction_amount=request_input.payment_transaction_amount,
-    )
-    return json({"settle_status": True})
 
+OPERATIONS: dict[str, Operation] = {operation.name: operation for operation in (
+    Operation("verify", VerifyRequestInput, verify_kwargs, path="/verify", cached=True),
+    Operation("sale", SaleRequestInput, charge_kwargs, path="/sale", idempotent=True),
+    Operation("authorize", SaleRequestInput, charge_kwargs, path="/authorize", idempotent=True),
+    Operation("settle", RequestInput),
+    Operation("capture", CaptureRequestInput, transaction_kwargs, settled, path="/capture"),
+    Operation("refund", RefundRequestInput, refund_kwargs, path="/refund", idempotent=True),
+    Operation("reversal", RefundRequestInput, transaction_kwargs, path="/reversal"),
+    Operation("void", RefundRequestInput, transaction_kwargs, path="/void"),
+    Operation("force_refund", RefundRequestInput, refund_kwargs, path="/force/refund"),
+)}
 
-@bp.post("/refund")
-def refund(request):
-    request_input = ignore_properties(RefundRequestInput, request.json)
-    if getattr(request.app.ctx, "echo", False):
-        return json(dumps(request_input, cls=EnhancedJSONEncoder))
-
-    result = OnlinePayments(
-        params=request_input.params,
-        reference=request_input.reference,
-        qa=request_input.qa
-    ).refund(
-        heartland_transaction_id=request_input.heartland_transaction_id,
-        payment_transaction_amount=request_input.payment_transaction_amount,
-        amount=request_input.amount,
-    )
-    return json(result)
 
+def operation_route(operation: Operation):
+    """
+    Decodes the request into the operation's input type, runs it and answers
+    with its response; with ECHO on, answers with the decoded input instead.
+    """
+    async def handler(request: Request):
+        request_input = decode_request(request, operation.input_type)
+        epoch = request_deadline(request)
+        if getattr(request.app.ctx, "echo", False):
+            return respond(request, request_input)
 
-@bp.post("/reversal")
-async def reversal(request):
-    request_input = ignore_properties(RefundRequestInput, request.json)
-    if getattr(request.app.ctx, "echo", False):
-        return json(dumps(request_input, cls=EnhancedJSONEncoder))
+        with deadline.until(epoch):
+            result = await dispatcher.run(request.app, operation, request_input)
+        return respond(request, operation.response(result))
+    return handler
 
-    result = OnlinePayments(
-        params=request_input.params,
-        reference=request_input.reference,
-        qa=request_input.qa
-    ).reversal(
-        heartland_transaction_id=request_input.heartland_transaction_id,
-        payment_transaction_amount=request_input.payment_transaction_amount,
-    )
-    return json(result)
 
+for _operation in OPERATIONS.values():
+    if _operation.path is not None:
+        bp.add_route(
+            operation_route(_operation), _operation.path, methods=["POST"], name=_operation.name
+        )
 
-@bp.post("/void")
-async def void(request):
-    request_input = ignore_properties(RefundRequestInput, request.json)
-    if getattr(request.app.ctx, "echo", False):
-        return json(dumps(request_input, cls=EnhancedJSONEncoder))
 
-    result = OnlinePayments(
-        params=request_input.params,
-        reference=request_input.reference,
-        qa=request_input.qa
-    ).void(
-        heartland_transaction_id=request_input.heartland_transaction_id,
-        payment_transaction_amount=request_input.payment_transaction_amount,
+async def close_batch(app: Sanic, params: HeartlandParams) -> Any:
+    """
+    Closes the merchant's batch; the settlement scheduler's job body.
+    """
+    return await run_operation(
+        app, RequestInput(params=params, reference=uuid4(), qa=False), "settle"
     )
-    return json(result)
 
 
-@bp.post("/force/refund")
-async def force_refund(request):
-    request_input = ignore_properties(RefundRequestInput, request.json)
+@bp.post("/settle")
+async def settle(request: Request):
+    """
+    Closes the merchant's batch, or joins the close already running for it.
+    Waits up to SETTLE_WAIT seconds, or until the request's deadline, for the
+    result; with ``?wait=false``, or when the close takes longer, answers 202
+    with the job to poll at ``/settle/<job_id>``.
+    """
+    request_input = decode_request(request, RequestInput)
     if getattr(request.app.ctx, "echo", False):
-        return json(dumps(request_input, cls=EnhancedJSONEncoder))
-
-    result = OnlinePayments(
-        params=request_input.params,
-        reference=request_input.reference,
-        qa=request_input.qa
-    ).force_refund(
-        heartland_transaction_id=request_input.heartland_transaction_id,
-        payment_transaction_amount=request_input.payment_transaction_amount,
-        amount=request_input.amount,
+        return respond(request, request_input)
+
+    settlement = request.app.ctx.settlement
+    job = settlement.submit(request_input.params)
+    if request.args.get("wait", "").lower() not in ("0", "false", "no"):
+        # the close itself runs on regardless of who is waiting for it
+        with deadline.until(request_deadline(request)), deadline.until(request_input.deadline):
+            wait = deadline.cap(float(request.app.config.SETTLE_WAIT))
+        job = await settlement.wait(job, wait)
+        if job.status == SUCCEEDED:
+            return respond(request, {"settle_status": True, "job": job})
+    return respond(request, {"job": job}, status=202)
+
+
+@bp.get("/settle/<job_id>")
+async def settle_job(request: Request, job_id: str):
+    job = request.app.ctx.settlement.get(job_id)
+    if job is None:
+        raise NotFound(f"No settle job {job_id}")
+    return respond(request, {"job": job})
+
+
+# what a batch may run
+BATCH_OPERATIONS = {
+    name: OPERATIONS[name] for name in ("sale", "authorize", "refund", "capture", "void")
+}
+
+
+# what bulk jobs may run, see service.jobs
+JOB_OPERATIONS = {name: OPERATIONS[name] for name in ("refund", "void", "capture")}
+
+
+async def run_item(
+    app: Sanic,
+    item: dict[str, Any],
+    operations: dict[str, Operation] = BATCH_OPERATIONS,
+) -> dict[str, Any]:
+    """
+    Runs one operation of a batch or job; a failure is returned, not raised.
+    """
+    operation = item.get("operation")
+    try:
+        if operation not in operations:
+            raise ValueError(f"Unsupported operation: {operation}")
+        request_input = ignore_properties(operations[operation].input_type, item)
+        if getattr(app.ctx, "echo", False):
+            result = request_input
+        else:
+            # the same body the operation's own route answers with
+            result = operations[operation].response(
+                await dispatcher.run(app, operations[operation], request_input)
+            )
+    except Exception as e:
+        return {"status": "error", "error": f"{type(e).__name__}: {e}"}
+    return {"status": "ok", "result": result}
+
+
+async def _batch_item(request: Request, index: int, item: dict[str, Any]) -> dict[str, Any]:
+    return {"index": index, "operation": item.get("operation"), **await run_item(request.app, item)}
+
+
+async def job_item(
+    app: Sanic, job: Job, params: HeartlandParams, line: int, row: dict[str, Any]
+) -> dict[str, Any]:
+    return await run_item(app, job.item(params, line, row), JOB_OPERATIONS)
+
+
+@bp.post("/batch")
+async def batch(request: Request):
+    """
+    Runs several operations concurrently. Results come back in request order,
+    or as NDJSON lines in completion order with ``?stream=true``; one failed
+    item does not fail the others.
+    """
+    request_input = decode_request(request, BatchRequestInput)
+    max_operations = int(request.app.config.BATCH_MAX_OPERATIONS)
+    if len(request_input.operations) > max_operations:
+        raise BadRequest(f"At most {max_operations} operations per batch")
+    limit = min(
+        request_input.concurrency or int(request.app.config.BATCH_CONCURRENCY),
+        int(request.app.config.BATCH_MAX_CONCURRENCY),
+    )
+    calls = [
+        partial(_batch_item, request, index, item)
+        for index, item in enumerate(request_input.items())
+    ]
+
+    with deadline.until(request_deadline(request)):
+        if request.args.get("stream", "").lower() not in ("1", "true", "yes"):
+            outcomes = [outcome async for outcome in fan_out(calls, limit)]
+            outcomes.sort(key=itemgetter("index"))
+            return respond(request, {"results": outcomes})
+
+        dumps = serializer_for(request)
+        response = await request.respond(content_type="application/x-ndjson")
+        async for outcome in fan_out(calls, limit):
+            await response.send(dumps(outcome) + b"\n")
+        await response.eof()
+
+
+def _job(request: Request, job_id: str) -> Job:
+    job = request.app.ctx.jobs.journal.get(job_id)
+    if job is None:
+        raise NotFound(f"No job {job_id}")
+    return job
+
+
+async def _upload(request: Request) -> AsyncIterator[bytes]:
+    while (chunk := await request.stream.read()) is not None:
+        yield chunk
+
+
+@bp.post("/jobs")
+async def create_job(request: Request):
+    """
+    Creates a bulk refund / void / capture job; upload its rows with
+    ``PUT /jobs/<job_id>/input``.
+    """
+    request_input = decode_request(request, JobRequestInput)
+    concurrency = min(
+        request_input.concurrency or int(request.app.config.JOBS_CONCURRENCY),
+        int(request.app.config.JOBS_MAX_CONCURRENCY),
+    )
+    journal = request.app.ctx.jobs.journal
+    job = journal.create(request_input, concurrency)
+    return respond(request, journal.status(job), status=201)
+
+
+@bp.put("/jobs/<job_id>/input", stream=True)
+async def upload_job_input(request: Request, job_id: str):
+    """
+    Runs the job's rows as they are uploaded, CSV with ``Content-Type:
+    text/csv`` and NDJSON otherwise; answers when every row has run. The
+    job's params come again in the ``X-Job-Params`` header. Uploading the
+    same input again resumes an interrupted upload.
+    """
+    job = _job(request, job_id)
+    try:
+        params = job_params(request.headers.get(PARAMS_HEADER))
+    except (ValueError, TypeError) as e:
+        raise BadRequest(f"Invalid {PARAMS_HEADER}: {e}")
+    rows = parse_rows(
+        _upload(request),
+        request.headers.get("content-type", ""),
+        int(request.app.config.JOBS_MAX_LINE),
     )
-    return json(result)
+    try:
+        await request.app.ctx.jobs.run_upload(job, params, rows)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise BadRequest(f"Invalid job input: {e}")
+    journal = request.app.ctx.jobs.journal
+    return respond(request, journal.status(journal.get(job_id)))
+
+
+@bp.post("/jobs/<job_id>/resume")
+async def resume_job(request: Request, job_id: str):
+    """
+    Runs the rows a complete upload left queued, with the job's params
+    presented again; answers when they have run.
+    """
+    job = _job(request, job_id)
+    request_input = decode_request(request, JobParamsInput)
+    await request.app.ctx.jobs.resume(job, request_input.params)
+    journal = request.app.ctx.jobs.journal
+    return respond(request, journal.status(journal.get(job_id)))
+
+
+@bp.get("/jobs/<job_id>")
+async def job_status(request: Request, job_id: str):
+    return respond(request, request.app.ctx.jobs.journal.status(_job(request, job_id)))
+
+
+@bp.get("/jobs/<job_id>/results")
+async def job_results(request: Request, job_id: str):
+    """
+    Finished rows as NDJSON, in input order.
+    """
+    _job(request, job_id)
+    dumps = serializer_for(request)
+    response = await request.respond(content_type="application/x-ndjson")
+    for page in request.app.ctx.jobs.journal.outcomes(job_id):
+        await response.send(b"".join(dumps(outcome) + b"\n" for outcome in page))
+    await response.eof()
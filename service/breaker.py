@@ -0,0 +1,332 @@
+"""
+Circuit breaking and adaptive concurrency limits for gateway calls.
+
+When Portico slows down or fails, every call waits for the full timeout and
+the executor fills up for all merchants. Calls are tracked per gateway host
+(or per merchant): a breaker stops sending to a gateway that keeps failing or
+answering slowly, and an AIMD limiter shrinks the calls allowed in flight as
+latency rises. Either one rejects excess calls straight away with a 503 and a
+Retry-After header instead of letting them queue.
+"""
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Hashable, TypeVar, Union
+from urllib.parse import urlsplit
+
+from sanic.exceptions import ServiceUnavailable
+
+from python_sdk.globalpayments.api.entities.exceptions import GatewayException
+
+from service.business.containers import merchant_id
+from service.business.params import HeartlandParams
+from service.executor import ExecutorTimeout
+from service.metrics import CIRCUIT_REJECTED
+
+_T = TypeVar("_T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class GatewayUnavailable(ServiceUnavailable):
+    """Raised instead of calling a gateway whose circuit is open or whose
+    concurrency limit is reached."""
+    quiet = True
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+        self.retry_after = retry_after
+
+
+def is_gateway_failure(error: BaseException) -> bool:
+    """
+    Timeouts and transport errors count against a gateway; errors the gateway
+    answered with (bad credentials, invalid requests) are the caller's.
+    """
+    if isinstance(error, ExecutorTimeout):
+        return True
+    return isinstance(error, GatewayException) and getattr(error, "response_code", None) is None
+
+
+class CircuitBreaker:
+    """
+    Opens when, over the last ``window`` seconds and at least ``min_calls``
+    calls, the share of failures or of slow calls passes its threshold. After
+    ``open_seconds`` it lets ``probes`` calls through: if they all succeed the
+    circuit closes, if any fails it opens again.
+    """
+
+    def __init__(
+        self,
+        window: float = 30.0,
+        min_calls: int = 20,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        slow_call_rate: float = 0.8,
+        open_seconds: float = 15.0,
+        probes: int = 3,
+    ):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self._calls: deque[tuple[float, bool, bool]] = deque()
+        self._failures = 0
+        self._slow = 0
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_passed = 0
+
+    def before(self, now: float):
+        """
+        Raises:
+            GatewayUnavailable: the circuit is open, or half-open with every
+                probe already in flight
+        """
+        if self.state == OPEN:
+            remaining = self._opened_at + self.open_seconds - now
+            if remaining > 0:
+                raise GatewayUnavailable("Gateway circuit is open", remaining)
+            self.state = HALF_OPEN
+            self._probes_started = self._probes_passed = 0
+        if self.state == HALF_OPEN:
+            if self._probes_started >= self.probes:
+                raise GatewayUnavailable("Gateway circuit is half-open", 1.0)
+            self._probes_started += 1
+
+    def after(self, now: float, seconds: float, failed: bool):
+        slow = seconds >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            if failed or slow:
+                self._open(now)
+            else:
+                self._probes_passed += 1
+                if self._probes_passed >= self.probes:
+                    self._close()
+            return
+        if self.state == OPEN:
+            return  # a call that started before the circuit opened
+
+        self._calls.append((now, failed, slow))
+        self._failures += failed
+        self._slow += slow
+        self._trim(now)
+        calls = len(self._calls)
+        if calls >= self.min_calls and (
+            self._failures / calls >= self.failure_rate
+            or self._slow / calls >= self.slow_call_rate
+        ):
+            self._open(now)
+
+    def release(self):
+        """A call that ended without an outcome (cancelled, invalid input)."""
+        if self.state == HALF_OPEN and self._probes_started > self._probes_passed:
+            self._probes_started -= 1
+
+    def _trim(self, now: float):
+        horizon = now - self.window
+        while self._calls and self._calls[0][0] < horizon:
+            _, failed, slow = self._calls.popleft()
+            self._failures -= failed
+            self._slow -= slow
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self._opened_at = now
+
+    def _close(self):
+        self.state = CLOSED
+        self._calls.clear()
+        self._failures = self._slow = 0
+
+
+class ConcurrencyLimiter:
+    """
+    AIMD limit on calls in flight: every call that succeeds within
+    ``latency_threshold`` raises the limit by ``1 / limit`` (about one per
+    round of calls), every failure or slow call multiplies it by ``backoff``.
+    """
+
+    def __init__(
+        self,
+        initial: int = 64,
+        minimum: int = 4,
+        maximum: int = 1000,
+        latency_threshold: float = 5.0,
+        backoff: float = 0.9,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_threshold = latency_threshold
+        self.backoff = backoff
+        self.in_flight = 0
+
+    def acquire(self):
+        """
+        Raises:
+            GatewayUnavailable: ``limit`` calls are already in flight
+        """
+        if self.in_flight >= int(self.limit):
+            raise GatewayUnavailable("Gateway concurrency limit reached", 1.0)
+        self.in_flight += 1
+
+    def release(self, seconds: float, failed: Union[bool, None]):
+        self.in_flight -= 1
+        if failed is None:
+            return
+        if failed or seconds >= self.latency_threshold:
+            self.limit = max(self.minimum, self.limit * self.backoff)
+        elif self.in_flight + 1 >= int(self.limit) * 0.5:
+            # only grow while the limit is actually being used
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+
+def gateway_host(url: str) -> str:
+    """
+    The host (and port, if any) of a gateway URL, lowercased and without
+    credentials or path, so callers can't make up new keys by varying them.
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    return f"{host}:{port}" if port else host
+
+
+class GatewayGuard:
+    """
+    A breaker and a limiter for each gateway host (or merchant), in an LRU of
+    at most ``max_entries``: the keys come from the request's params and are
+    metric labels, so they must not grow without bound. Guards with calls in
+    flight are not evicted.
+    """
+
+    def __init__(
+        self,
+        per_merchant: bool = False,
+        breaker: Union[dict[str, Any], None] = None,
+        limiter: Union[dict[str, Any], None] = None,
+        clock: Callable[[], float] = time.monotonic,
+        max_entries: int = 256,
+    ):
+        self.per_merchant = per_merchant
+        self.breaker_kwargs = breaker or {}
+        self.limiter_kwargs = limiter or {}
+        self.clock = clock
+        self.max_entries = max_entries
+        self._guards: OrderedDict[
+            Hashable, tuple[CircuitBreaker, ConcurrencyLimiter]
+        ] = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config) -> Union["GatewayGuard", None]:
+        if not config.GATEWAY_GUARD:
+            return None
+        scope = str(config.GATEWAY_GUARD_SCOPE).lower()
+        if scope not in ("url", "merchant"):
+            raise ValueError(f"Unknown GATEWAY_GUARD_SCOPE: {config.GATEWAY_GUARD_SCOPE}")
+        return cls(
+            per_merchant=scope == "merchant",
+            max_entries=int(config.GATEWAY_GUARD_MAX_ENTRIES),
+            breaker=dict(
+                window=float(config.CIRCUIT_WINDOW),
+                min_calls=int(config.CIRCUIT_MIN_CALLS),
+                failure_rate=float(config.CIRCUIT_FAILURE_RATE),
+                slow_call_seconds=float(config.CIRCUIT_SLOW_CALL_SECONDS),
+                slow_call_rate=float(config.CIRCUIT_SLOW_CALL_RATE),
+                open_seconds=float(config.CIRCUIT_OPEN_SECONDS),
+                probes=int(config.CIRCUIT_PROBES),
+            ),
+            limiter=dict(
+                initial=int(config.CONCURRENCY_INITIAL_LIMIT),
+                minimum=int(config.CONCURRENCY_MIN_LIMIT),
+                maximum=int(config.CONCURRENCY_MAX_LIMIT),
+                latency_threshold=float(config.CONCURRENCY_LATENCY_THRESHOLD),
+            ),
+        )
+
+    def key(self, params: HeartlandParams) -> str:
+        host = gateway_host(params.url)
+        if self.per_merchant:
+            return f"{host}#{merchant_id(params)}"
+        return host
+
+    def get(self, key: str) -> tuple[CircuitBreaker, ConcurrencyLimiter]:
+        guard = self._guards.get(key)
+        if guard is None:
+            self._evict(self.max_entries - 1)
+            guard = self._guards[key] = (
+                CircuitBreaker(**self.breaker_kwargs),
+                ConcurrencyLimiter(**self.limiter_kwargs),
+            )
+        else:
+            self._guards.move_to_end(key)
+        return guard
+
+    def _evict(self, size: int):
+        excess = len(self._guards) - size
+        if excess <= 0:
+            return
+        idle = [key for key, (_, limiter) in self._guards.items() if not limiter.in_flight]
+        for key in idle[:excess]:
+            del self._guards[key]
+
+    async def run(self, key: str, fn: Callable[..., Awaitable[_T]], *args: Any) -> _T:
+        """
+        Awaits ``fn(*args)`` unless the gateway behind ``key`` is shedding load.
+        Only called from the event loop, so the state needs no locking.
+
+        Raises:
+            GatewayUnavailable: the call was not attempted
+        """
+        breaker, limiter = self.get(key)
+        try:
+            breaker.before(self.clock())
+        except GatewayUnavailable:
+            CIRCUIT_REJECTED.inc(reason=breaker.state)
+            raise
+        try:
+            limiter.acquire()
+        except GatewayUnavailable:
+            breaker.release()
+            CIRCUIT_REJECTED.inc(reason="concurrency")
+            raise
+
+        start = self.clock()
+        failed: Union[bool, None] = None
+        try:
+            result = await fn(*args)
+            failed = False
+            return result
+        except Exception as e:
+            if is_gateway_failure(e):
+                failed = True
+            elif isinstance(e, GatewayException):
+                failed = False  # the gateway answered
+            raise
+        finally:
+            now = self.clock()
+            limiter.release(now - start, failed)
+            if failed is None:
+                breaker.release()
+            else:
+                breaker.after(now, now - start, failed)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        return {
+            key: {
+                "state": breaker.state,
+                "limit": int(limiter.limit),
+                "in_flight": limiter.in_flight,
+            }
+            for key, (breaker, limiter) in self._guards.items()
+        }
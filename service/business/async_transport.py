@@ -0,0 +1,162 @@
+"""
+Non-blocking transport for the Portico gateway, selected with
+``GATEWAY_TRANSPORT = "async"``.
+
+OnlinePayments operations run on the event loop through an exchange (see
+service.business.exchange): the SDK still builds every request and parses
+every response, and only the round trip goes over aiohttp's pooled
+connections. An operation waiting on the gateway holds a coroutine instead of
+an executor thread, so concurrency is bounded by ``limit`` connections rather
+than by the thread pool.
+"""
+import asyncio
+import ssl
+from functools import partial
+from typing import Callable, TypeVar, Union
+
+import certifi
+
+from python_sdk.globalpayments.api.entities.exceptions import GatewayException
+from python_sdk.globalpayments.api.gateways import GatewayResponse
+
+from service import deadline
+from service.business import exchange
+from service.business.cassette import Cassette
+from service.business.exchange import GatewayRequest
+from service.deadline import GatewayDeadlineExceeded
+from service.metrics import DEADLINE_EXCEEDED, GATEWAY_HTTP_RESPONSES, stage
+
+try:
+    import aiohttp
+except ImportError:  # optional, only needed for GATEWAY_TRANSPORT = "async"
+    aiohttp = None
+
+_T = TypeVar("_T")
+
+
+class AsyncTransport:
+    """
+    Sends gateway requests with aiohttp.
+
+    Like PooledTransport, only connection errors are retried, since nothing
+    reached the gateway; a payment is never sent twice.
+    """
+
+    def __init__(
+        self,
+        limit: int = 1000,
+        keep_alive: bool = True,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 65.0,
+        retries: int = 2,
+        cassette: Union[Cassette, None] = None,
+    ):
+        if aiohttp is None:
+            raise RuntimeError("GATEWAY_TRANSPORT is async but aiohttp is not installed")
+        self.limit = limit
+        self.keep_alive = keep_alive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.cassette = cassette
+        self._session: Union["aiohttp.ClientSession", None] = None
+
+    @classmethod
+    def from_config(cls, config, cassette: Union[Cassette, None] = None) -> "AsyncTransport":
+        return cls(
+            limit=int(config.GATEWAY_ASYNC_LIMIT),
+            keep_alive=bool(config.GATEWAY_KEEP_ALIVE),
+            connect_timeout=float(config.GATEWAY_CONNECT_TIMEOUT),
+            read_timeout=float(config.GATEWAY_READ_TIMEOUT),
+            retries=int(config.GATEWAY_RETRIES),
+            cassette=cassette,
+        )
+
+    async def start(self):
+        """
+        Opens the session; call from a running loop.
+        """
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=0,
+            force_close=not self.keep_alive,
+            ssl=ssl.create_default_context(cafile=certifi.where()),
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                connect=self.connect_timeout,
+                sock_read=self.read_timeout,
+            ),
+        )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def run(self, fn: Callable[[], _T]) -> _T:
+        """
+        Runs an OnlinePayments call, sending its gateway requests with aiohttp.
+        """
+        if self.cassette is None:
+            return await exchange.run(fn, self.send)
+        return await exchange.run(fn, partial(self.cassette.send_async, send=self.send))
+
+    async def send(self, request: GatewayRequest) -> GatewayResponse:
+        """
+        Sends a request prepared by PooledTransport.prepare, for no longer
+        than the time left before the request's deadline.
+
+        Raises:
+            GatewayException: the gateway could not be reached or timed out
+            DeadlineExceeded: the deadline passed before it was sent
+            GatewayDeadlineExceeded: the deadline passed before the answer
+        """
+        attempt = 0
+        while True:
+            options = {}
+            left = deadline.remaining()
+            if left is not None:
+                deadline.check("gateway")
+                options["timeout"] = aiohttp.ClientTimeout(
+                    total=left,
+                    connect=min(self.connect_timeout, left),
+                    sock_read=min(self.read_timeout, left),
+                )
+            try:
+                with stage("gateway"):
+                    async with self._session.request(
+                        request.method,
+                        request.url,
+                        headers=request.headers,
+                        data=request.body,
+                        **options,
+                    ) as response:
+                        body = await response.read()
+                break
+            except aiohttp.ClientConnectorError as e:
+                if attempt < self.retries:
+                    await asyncio.sleep(0.05 * 2 ** attempt)
+                    attempt += 1
+                    continue
+                error: Exception = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            GATEWAY_HTTP_RESPONSES.inc(status=type(error).__name__)
+            if deadline.passed():
+                # cut short by the caller, not a gateway failure
+                DEADLINE_EXCEEDED.inc(stage="response")
+                raise GatewayDeadlineExceeded(
+                    "Request deadline passed waiting for the gateway"
+                ) from error
+            raise GatewayException(
+                "Error occurred while communicating with gateway."
+            ) from error
+
+        GATEWAY_HTTP_RESPONSES.inc(status=response.status)
+        result = GatewayResponse()
+        result.status_code = response.status
+        result.response_text = body.decode("utf-8")
+        return result
@@ -0,0 +1,103 @@
+"""
+Which transactions are still in an open batch, per merchant.
+
+A full refund voids the transaction while its batch is open and refunds it
+once the batch has closed. Trying the void first and refunding when it fails
+costs a second gateway round trip for every refund after settlement, so the
+transactions this worker has seen are remembered with when they were seen,
+and batch closes with when they ran. A transaction seen before the merchant's
+last close is settled; one seen after it is still open; anything else (seen
+by another worker, or while the close was running) is unknown and still goes
+void-then-refund.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Union
+
+OPEN = "open"
+CLOSED = "closed"
+UNKNOWN = "unknown"
+
+# merchant -> (start, end) of its last successful batch close
+LastSettled = Callable[[str], Union[tuple[float, float], None]]
+
+
+class BatchTracker:
+    def __init__(self, max_transactions: int = 100000):
+        self.max_transactions = max_transactions
+        # set to read closes run by other workers, see service.settlement
+        self.last_settled: Union[LastSettled, None] = None
+        self._seen: OrderedDict[tuple[str, str], float] = OrderedDict()
+        # merchant -> (closed before, unknown until)
+        self._closes: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def set_limits(self, max_transactions: int):
+        with self._lock:
+            self.max_transactions = max_transactions
+            self._evict()
+
+    def seen(self, merchant: str, transaction_id: Union[str, None]):
+        """
+        Records a transaction that just joined the merchant's open batch.
+        """
+        if not transaction_id:
+            return
+        key = (merchant, transaction_id)
+        with self._lock:
+            self._seen[key] = time.time()
+            self._seen.move_to_end(key)
+            self._evict()
+
+    def settled(self, merchant: str, started: float, finished: float):
+        """
+        Records a batch close that ran from ``started`` to ``finished``.
+        """
+        with self._lock:
+            self._merge(merchant, started, finished)
+
+    def closed(self, merchant: str, transaction_id: str):
+        """
+        Records that the transaction's batch has closed, so every transaction
+        seen before it has been settled too.
+        """
+        with self._lock:
+            seen = self._seen.pop((merchant, transaction_id), None)
+            if seen is not None:
+                self._merge(merchant, seen + 1e-6, seen + 1e-6)
+
+    def state(self, merchant: str, transaction_id: str) -> str:
+        """
+        OPEN, CLOSED or UNKNOWN for a transaction's batch.
+        """
+        last_settled = self.last_settled
+        remote = last_settled(merchant) if last_settled is not None else None
+        with self._lock:
+            if remote is not None:
+                self._merge(merchant, *remote)
+            seen = self._seen.get((merchant, transaction_id))
+            if seen is None:
+                return UNKNOWN
+            closed_before, unknown_until = self._closes.get(merchant, (0.0, 0.0))
+        if seen < closed_before:
+            return CLOSED
+        if seen <= unknown_until:
+            return UNKNOWN
+        return OPEN
+
+    def clear(self):
+        with self._lock:
+            self._seen.clear()
+            self._closes.clear()
+
+    def _merge(self, merchant: str, started: float, finished: float):
+        closed_before, unknown_until = self._closes.get(merchant, (0.0, 0.0))
+        self._closes[merchant] = (max(closed_before, started), max(unknown_until, finished))
+
+    def _evict(self):
+        while len(self._seen) > self.max_transactions:
+            self._seen.popitem(last=False)
+
+
+batches = BatchTracker()
@@ -0,0 +1,207 @@
+"""
+Records gateway round trips to a cassette and replays them without the network.
+
+With ``GATEWAY_CASSETTE = "record"`` every request the transport sends and the
+response (or error) it gets back are appended to GATEWAY_CASSETTE_PATH with
+the time the round trip took. With ``"replay"`` nothing is sent: each request
+is answered with a recorded response for the same kind of request, after the
+recorded latency times GATEWAY_CASSETTE_LATENCY_SCALE (0 answers at once).
+That makes profiles and benchmarks of the whole /sale path reproducible on a
+machine with no gateway to talk to.
+
+Requests are matched on method, URL path and the Portico transaction type
+(CreditSale, CreditVoid, BatchClose, ...), not on their bodies, which differ
+by reference and amount on every call; the responses recorded for a kind of
+request are served in turn.
+
+Cassettes are one JSON object per line, gzip-compressed when the path ends in
+``.gz``. Card data and credentials are never written: request bodies go
+through SensitiveDataFilter, and in responses, which are replayed to the SDK
+and have to stay parseable, the sensitive Portico elements and anything shaped
+like a card number are masked.
+"""
+import asyncio
+import gzip
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, TextIO, Union
+from urllib.parse import urlsplit
+
+from python_sdk.globalpayments.api.entities.exceptions import GatewayException
+from python_sdk.globalpayments.api.gateways import GatewayResponse
+
+from service.business.exchange import GatewayRequest, Outcome
+from service.metrics import GATEWAY_HTTP_RESPONSES, stage
+from service.packages.lumberjack.SensitiveDataFilter import SensitiveDataFilter
+
+RECORD = "record"
+REPLAY = "replay"
+
+TRANSACTION_TYPE = re.compile(r"<(?:\w+:)?Transaction>\s*<(?:\w+:)?(\w+)")
+SENSITIVE_ELEMENTS = re.compile(
+    r"(<(?:\w+:)?(?:CardNbr|CVV2|ExpMonth|ExpYear|TokenValue|TrackData|SecretAPIKey"
+    r"|UserName|Password|CardHolderFirstName|CardHolderLastName|CardHolderAddr"
+    r"|CardHolderZip|CardHolderEmail|CardHolderPhone)\b[^>]*>)[^<]*"
+)
+CARD_NUMBER = re.compile(r"(?<![\d.])\d{13,19}(?![\d.])")
+
+_filter = SensitiveDataFilter()
+
+
+def _text(body: Union[str, bytes, None]) -> str:
+    if body is None:
+        return ""
+    return body.decode("utf-8", "replace") if isinstance(body, bytes) else body
+
+
+def mask_request(body: Union[str, bytes, None]) -> str:
+    return _filter.mask_sensitive_data(
+        SENSITIVE_ELEMENTS.sub(rf"\1{_filter.REPLACEMENT}", _text(body))
+    )
+
+
+def mask_response(text: str) -> str:
+    text = SENSITIVE_ELEMENTS.sub(rf"\1{_filter.REPLACEMENT}", text)
+    return CARD_NUMBER.sub(_filter.REPLACEMENT, text)
+
+
+def request_key(request: GatewayRequest) -> str:
+    match = TRANSACTION_TYPE.search(_text(request.body))
+    key = f"{request.method} {urlsplit(request.url).path}"
+    return f"{key} {match.group(1)}" if match else key
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str, latency_scale: float = 1.0):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._file: Union[TextIO, None] = None
+        self._entries: dict[str, list[dict[str, Any]]] = defaultdict(list)
+        self._next: dict[str, int] = defaultdict(int)
+        if mode == RECORD:
+            # appended to, so several runs can add to one cassette
+            self._file = self._open("at")
+        else:
+            with self._open("rt") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]].append(entry)
+
+    @classmethod
+    def from_config(cls, config) -> Union["Cassette", None]:
+        mode = str(config.GATEWAY_CASSETTE).lower()
+        if not mode:
+            return None
+        return cls(
+            str(config.GATEWAY_CASSETTE_PATH),
+            mode,
+            latency_scale=float(config.GATEWAY_CASSETTE_LATENCY_SCALE),
+        )
+
+    def _open(self, mode: str) -> TextIO:
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode, encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def record(self, request: GatewayRequest, outcome: Outcome, seconds: float):
+        entry: dict[str, Any] = {
+            "key": request_key(request),
+            "seconds": round(seconds, 6),
+            "request": mask_request(request.body),
+        }
+        if isinstance(outcome, Exception):
+            entry["error"] = str(outcome)
+        else:
+            entry["status"] = outcome.status_code
+            entry["response"] = mask_response(outcome.response_text)
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def play(self, request: GatewayRequest) -> tuple[Outcome, float]:
+        """
+        The next recorded outcome for this kind of request, and how long to
+        wait before answering with it.
+        """
+        key = request_key(request)
+        entries = self._entries.get(key)
+        if not entries:
+            return GatewayException(f"No recorded response for {key}"), 0.0
+        with self._lock:
+            index = self._next[key]
+            self._next[key] = index + 1
+        entry = entries[index % len(entries)]
+        delay = entry["seconds"] * self.latency_scale
+        if "error" in entry:
+            GATEWAY_HTTP_RESPONSES.inc(status="GatewayException")
+            return GatewayException(entry["error"]), delay
+        GATEWAY_HTTP_RESPONSES.inc(status=entry["status"])
+        response = GatewayResponse()
+        response.status_code = entry["status"]
+        response.response_text = entry["response"]
+        return response, delay
+
+    def send(
+        self, request: GatewayRequest, send: Callable[[GatewayRequest], GatewayResponse]
+    ) -> GatewayResponse:
+        """
+        Replays ``request``, or sends it with ``send`` and records it.
+        """
+        if self.mode == REPLAY:
+            outcome, delay = self.play(request)
+            if delay > 0:
+                with stage("gateway"):
+                    time.sleep(delay)
+            return _result(outcome)
+        start = time.perf_counter()
+        try:
+            response = send(request)
+        except GatewayException as e:
+            self.record(request, e, time.perf_counter() - start)
+            raise
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    async def send_async(
+        self,
+        request: GatewayRequest,
+        send: Callable[[GatewayRequest], Awaitable[GatewayResponse]],
+    ) -> GatewayResponse:
+        """
+        Like send, for AsyncTransport.
+        """
+        if self.mode == REPLAY:
+            outcome, delay = self.play(request)
+            if delay > 0:
+                with stage("gateway"):
+                    await asyncio.sleep(delay)
+            return _result(outcome)
+        start = time.perf_counter()
+        try:
+            response = await send(request)
+        except GatewayException as e:
+            self.record(request, e, time.perf_counter() - start)
+            raise
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _result(outcome: Outcome) -> GatewayResponse:
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
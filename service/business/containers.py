@@ -0,0 +1,137 @@
+"""
+Per-merchant ServicesContainer registry.
+
+The SDK keeps a single process-global ServicesContainer which every builder's
+``execute()`` reads through ``ServicesContainer.instance()``. Reconfiguring it
+per request rebuilds the connector each time and lets overlapping requests for
+different merchants use each other's credentials, so instead we build one
+container per merchant, cache it, and bind it to the calling context while an
+operation runs.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Union
+
+from python_sdk.globalpayments.api import ServicesConfig, ServicesContainer
+
+from service.business.params import HeartlandParams
+from service.business.transport import PooledTransport, transport
+from service.metrics import CONTAINER_LOOKUPS
+
+ContainerKey = tuple[str, str, str]
+
+_bound_container: ContextVar[Union[ServicesContainer, None]] = ContextVar(
+    "bound_container", default=None
+)
+_sdk_instance = ServicesContainer.instance
+
+
+def _instance() -> ServicesContainer:
+    container = _bound_container.get()
+    if container is not None:
+        return container
+    return _sdk_instance()
+
+
+ServicesContainer.instance = staticmethod(_instance)
+
+
+@contextmanager
+def bind(container: ServicesContainer) -> Iterator[ServicesContainer]:
+    """
+    Makes ``ServicesContainer.instance()`` return ``container`` in this context.
+    """
+    token = _bound_container.set(container)
+    try:
+        yield container
+    finally:
+        _bound_container.reset(token)
+
+
+def container_key(params: HeartlandParams) -> ContainerKey:
+    return params.url, params.private_key, params.developer_id
+
+
+def merchant_id(params: HeartlandParams) -> str:
+    """
+    A stable identifier for a merchant that does not expose its key.
+    """
+    return hashlib.sha256("\0".join(container_key(params)).encode()).hexdigest()[:32]
+
+
+class ContainerRegistry:
+    """
+    An LRU cache of configured ServicesContainers with a time-to-live.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 256,
+        ttl: float = 3600.0,
+        transport: Union[PooledTransport, None] = None,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.transport = transport
+        self._entries: OrderedDict[ContainerKey, tuple[ServicesContainer, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        # ServicesContainer.configure writes the global instance, so builds
+        # are serialized and the result is read back straight away.
+        self._build_lock = threading.Lock()
+
+    def set_limits(self, max_size: int, ttl: float):
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._evict()
+
+    def get(self, params: HeartlandParams) -> ServicesContainer:
+        """
+        Returns the container for this merchant, building it on a miss.
+        """
+        key = container_key(params)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                CONTAINER_LOOKUPS.inc(result="hit")
+                return entry[0]
+
+        CONTAINER_LOOKUPS.inc(result="miss")
+        container = self._build(params)
+        with self._lock:
+            self._entries[key] = (container, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            self._evict()
+        return container
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self):
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _build(self, params: HeartlandParams) -> ServicesContainer:
+        config = ServicesConfig()
+        config.secret_api_key = params.private_key
+        config.developer_id = params.developer_id
+        config.service_url = params.url
+        with self._build_lock:
+            ServicesContainer.configure(config)
+            container = _sdk_instance()
+        if self.transport is not None:
+            self.transport.install(container.get_client())
+        return container
+
+
+containers = ContainerRegistry(transport=transport)
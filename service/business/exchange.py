@@ -0,0 +1,94 @@
+"""
+Drives the SDK's synchronous gateway calls from async code.
+
+Builders call ``Gateway.send_request`` and block on the answer. To send that
+request without blocking, the operation runs in a greenlet with an
+``Exchange`` bound: when it reaches the gateway, the transport hands the
+prepared request over and the greenlet switches back to the event loop, which
+sends it asynchronously and switches back in with the response. The operation
+runs once, start to finish, so whatever it does around its gateway calls
+(metrics, logging, batch state) happens once too.
+"""
+import contextvars
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Awaitable, Callable, TypeVar, Union
+
+from python_sdk.globalpayments.api.gateways import GatewayResponse
+
+try:
+    from greenlet import getcurrent, greenlet
+except ImportError:  # optional, only needed for GATEWAY_TRANSPORT = "async"
+    greenlet = None
+
+_T = TypeVar("_T")
+
+
+@dataclass(frozen=True)
+class GatewayRequest:
+    method: str
+    url: str
+    headers: dict[str, str]
+    body: Union[str, bytes, None]
+
+
+# a response, or the GatewayException sending the request raised
+Outcome = Union[GatewayResponse, Exception]
+
+
+class Exchange:
+    """
+    Suspends the operation on each gateway request until its outcome is in.
+    """
+
+    def __init__(self, loop_greenlet: "greenlet"):
+        self._loop_greenlet = loop_greenlet
+
+    def send(self, request: GatewayRequest) -> GatewayResponse:
+        outcome = self._loop_greenlet.switch(request)
+        if isinstance(outcome, Exception):
+            # raised where the SDK made the call, like the sync transport
+            raise outcome
+        return outcome
+
+
+_current: ContextVar[Union[Exchange, None]] = ContextVar("gateway_exchange", default=None)
+
+
+def current_exchange() -> Union[Exchange, None]:
+    return _current.get()
+
+
+async def run(
+    fn: Callable[[], _T],
+    send: Callable[[GatewayRequest], Awaitable[GatewayResponse]],
+    max_requests: int = 8,
+) -> _T:
+    """
+    Runs ``fn`` until it completes, sending each gateway request it makes
+    with ``send``.
+    """
+    if greenlet is None:
+        raise RuntimeError("GATEWAY_TRANSPORT is async but greenlet is not installed")
+    # the operation sees the caller's context (deadline, route) plus the exchange
+    context = contextvars.copy_context()
+    context.run(_current.set, Exchange(getcurrent()))
+    operation = greenlet(fn)
+    operation.gr_context = context
+    try:
+        value = operation.switch()
+        requests = 0
+        while not operation.dead:
+            if requests == max_requests:
+                raise RuntimeError(f"Operation made more than {max_requests} gateway requests")
+            requests += 1
+            try:
+                outcome: Outcome = await send(value)
+            except Exception as e:
+                outcome = e
+            value = operation.switch(outcome)
+        return value
+    finally:
+        if not operation.dead:
+            # unwinds the operation with GreenletExit
+            operation.throw()
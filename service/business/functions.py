@@ -1,18 +1,27 @@
+import time
 from dataclasses import dataclass
+from functools import wraps
 from typing import Any, Union
 from uuid import UUID
 
-from python_sdk.globalpayments.api import ServicesConfig, ServicesContainer
 from python_sdk.globalpayments.api.entities import Transaction
 from python_sdk.globalpayments.api.entities.address import Address
+from python_sdk.globalpayments.api.entities.exceptions import GatewayException
 from python_sdk.globalpayments.api.payment_methods.credit import CreditCardData
-from python_sdk.globalpayments.api.services.batch_service import BatchService
 
+from service.business.batches import CLOSED, batches
+from service.business.containers import bind, containers, merchant_id
 from service.business.params import HeartlandParams
+from service.business.results import extract_results
+from service.metrics import REFUND_BATCH_STATE, REFUND_VOID_FALLBACKS, stage
 from service.packages.lumberjack import get_logger
 
 logger = get_logger()
 
+# Portico's GatewayRspCode for a void of a transaction that is no longer in an
+# open batch ("the referenced original transaction is invalid")
+VOID_SETTLED_CODES = frozenset({"3"})
+
 
 @dataclass
 class VerifyAddressDataClass:
@@ -94,6 +103,17 @@ def get_zip_code_address(zipcode: str) -> Address:
     return address
 
 
+def with_container(method):
+    """
+    Runs an OnlinePayments operation against the merchant's own container.
+    """
+    @wraps(method)
+    def wrapper(self: "OnlinePayments", *args, **kwargs):
+        with bind(self.container), stage("execute"):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 # noinspection PyMethodMayBeStatic
 class OnlinePayments:
     """
@@ -101,63 +121,49 @@ class OnlinePayments:
     with the HeartlandAPI.
     """
 
-    def __init__(self, params: HeartlandParams, reference: UUID, qa=False):
+    def __init__(
+        self,
+        params: HeartlandParams,
+        reference: UUID,
+        qa=False,
+        projection: Union[str, None] = None,
+    ):
         self.params = params
         self.reference = reference
-        config = ServicesConfig()
-        config.secret_api_key = params.private_key
-        config.developer_id = params.developer_id
-        config.service_url = params.url
-        ServicesContainer.configure(config)
+        self.projection = projection
+        with stage("configure"):
+            self.container = containers.get(params)
 
     def __results(self, transaction) -> dict[str, Any]:
-        fields = {}
-        for key in dir(transaction):
-            value = getattr(transaction, key)
-            if not key.startswith("_") and isinstance(value, str):
-                fields[key] = value
-        return fields
+        with stage("extract"):
+            return extract_results(transaction, self.projection)
 
-    def sale(self, amount: float, card: CreditCardData, zip_code=None):
-        zip_code_address = None
-        if zip_code:
-            zip_code_address = get_zip_code_address(zip_code)
+    def __batched(self, transaction_id: Union[str, None]):
+        batches.seen(merchant_id(self.params), transaction_id)
+
+    def __charge(self, builder, card: CreditCardData, zip_code: Union[str, None]):
+        """
+        Sends a sale or authorization; the CVN and zip code are only sent
+        when given.
+        """
         if card.cvn:
-            if zip_code_address:
-                transaction = (
-                    card.charge(amount)
-                    .with_cvc(card.cvn)
-                    .with_address(zip_code_address)
-                    .with_currency(self.params.constants.default_currency)
-                    .with_client_transaction_id(self.reference)
-                    .execute()
-                )
-            else:
-                transaction = (
-                    card.charge(amount)
-                    .with_cvc(card.cvn)
-                    .with_currency(self.params.constants.default_currency)
-                    .with_client_transaction_id(self.reference)
-                    .execute()
-                )
-        else:
-            if zip_code_address:
-                transaction = (
-                    card.charge(amount)
-                    .with_address(zip_code_address)
-                    .with_currency(self.params.constants.default_currency)
-                    .with_client_transaction_id(self.reference)
-                    .execute()
-                )
-            else:
-                transaction = (
-                    card.charge(amount)
-                    .with_currency(self.params.constants.default_currency)
-                    .with_client_transaction_id(self.reference)
-                    .execute()
-                )
+            builder = builder.with_cvc(card.cvn)
+        if zip_code:
+            builder = builder.with_address(get_zip_code_address(zip_code))
+        return (
+            builder
+            .with_currency(self.params.constants.default_currency)
+            .with_client_transaction_id(self.reference)
+            .execute()
+        )
+
+    @with_container
+    def sale(self, amount: float, card: CreditCardData, zip_code=None):
+        transaction = self.__charge(card.charge(amount), card, zip_code)
+        self.__batched(getattr(transaction, "transaction_id", None))
         return self.__results(transaction)
 
+    @with_container
     def verify(self, card: CreditCardData, address: Address):
         transaction = (
             card.verify()
@@ -167,52 +173,23 @@ class OnlinePayments:
         )
         return self.__results(transaction)
 
+    @with_container
     def authorize(self, amount: float, card: CreditCardData, zip_code=None):
-        zip_code_address = None
-        if zip_code:
-            zip_code_address = get_zip_code_address(zip_code)
-        if card.cvn:
-            if zip_code_address:
-                transaction = (
-                    card.authorize(amount)
-                    .with_cvc(card.cvn)
-                    .with_address(zip_code_address)
-                    .with_currency(self.params.constants.default_currency)
-                    .with_client_transaction_id(self.reference)
-                    .execute()
-                )
-            else:
-                transaction = (
-                    card.authorize(amount)
-                    .with_cvc(card.cvn)
-                    .with_currency(self.params.constants.default_currency)
-                    .with_client_transaction_id(self.reference)
-                    .execute()
-                )
-        else:
-            if zip_code_address:
-                transaction = (
-                    card.authorize(amount)
-                    .with_address(zip_code_address)
-                    .with_currency(self.params.constants.default_currency)
-                    .with_client_transaction_id(self.reference)
-                    .execute()
-                )
-            else:
-                transaction = (
-                    card.authorize(amount)
-                    .with_currency(self.params.constants.default_currency)
-                    .with_client_transaction_id(self.reference)
-                    .execute()
-                )
-
-        return self.__results(transaction)
+        # an authorization only joins the batch once it is captured
+        return self.__results(self.__charge(card.authorize(amount), card, zip_code))
 
+    @with_container
     def settle(self):
+        # only batch closes need the batch service and its builders
+        from python_sdk.globalpayments.api.services.batch_service import BatchService
+
+        started = time.time()
         result = BatchService.close_batch()
+        batches.settled(merchant_id(self.params), started, time.time())
         logger.info(f"Result from closing the batch: {result}")
         return result
 
+    @with_container
     def refund(
         self,
         heartland_transaction_id: str,
@@ -228,12 +205,27 @@ class OnlinePayments:
                 .execute()
             )
         else:
-            try:
-                result = transaction.void().execute()
-            except Exception:
-                logger.exception(
-                    "Exception running void, the batch probably already closed"
-                )
+            merchant = merchant_id(self.params)
+            batch = batches.state(merchant, heartland_transaction_id)
+            REFUND_BATCH_STATE.inc(batch=batch)
+            result = None
+            if batch != CLOSED:
+                try:
+                    result = transaction.void().execute()
+                except GatewayException as e:
+                    # no answer from the gateway: the void may have gone
+                    # through, so refunding could pay the money back twice
+                    if e.response_code is None:
+                        raise
+                    # expected once the batch has closed, so no traceback
+                    logger.info(
+                        f"Void failed ({e.response_code}: {e}),"
+                        f" the batch probably already closed; refunding"
+                    )
+                    REFUND_VOID_FALLBACKS.inc(batch=batch)
+                    if str(e.response_code) in VOID_SETTLED_CODES:
+                        batches.closed(merchant, heartland_transaction_id)
+            if result is None:
                 result = (
                     transaction.refund(float(payment_transaction_amount))
                     .with_currency(self.params.constants.default_currency)
@@ -242,6 +234,7 @@ class OnlinePayments:
 
         return self.__results(result)
 
+    @with_container
     def force_refund(
         self,
         heartland_transaction_id: str,
@@ -256,6 +249,7 @@ class OnlinePayments:
         )
         return self.__results(result)
 
+    @with_container
     def capture(
         self,
         heartland_transaction_id: str,
@@ -267,8 +261,10 @@ class OnlinePayments:
             .with_currency(self.params.constants.default_currency)
             .execute()
         )
+        self.__batched(heartland_transaction_id)
         return self.__results(result)
 
+    @with_container
     def reversal(
         self,
         heartland_transaction_id: str,
@@ -282,6 +278,7 @@ class OnlinePayments:
         )
         return self.__results(result)
 
+    @with_container
     def void(
         self,
         heartland_transaction_id: str,
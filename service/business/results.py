@@ -0,0 +1,111 @@
+"""
+Turns SDK result objects (Transaction and friends) into response dicts.
+
+Responses carry the public string attributes of the result. Rather than
+reflecting over ``dir()`` of every result, the names worth reading are worked
+out once per result type; callers can also ask for a smaller projection.
+"""
+import threading
+from typing import Any, Union
+
+MINIMAL = (
+    "response_code",
+    "response_message",
+    "transaction_id",
+    "authorization_code",
+)
+
+STANDARD = MINIMAL + (
+    "avs_response_code",
+    "avs_response_message",
+    "cvn_response_code",
+    "cvn_response_message",
+    "card_type",
+    "card_last_4",
+    "reference_number",
+    "client_transaction_id",
+    "token",
+)
+
+# None means every public string attribute
+PROJECTIONS: dict[str, Union[tuple[str, ...], None]] = {
+    "minimal": MINIMAL,
+    "standard": STANDARD,
+    "full": None,
+}
+
+DEFAULT_PROJECTION = "full"
+
+_plans: dict[type, tuple[tuple[str, ...], frozenset[str]]] = {}
+_plans_lock = threading.Lock()
+
+
+def plan_for(cls: type) -> tuple[tuple[str, ...], frozenset[str]]:
+    """
+    The public, non-callable class-level names of ``cls`` (properties and
+    attribute defaults), in ``dir()`` order, plus the same names as a set.
+    """
+    plan = _plans.get(cls)
+    if plan is None:
+        names = tuple(
+            name for name in dir(cls)
+            if not name.startswith("_") and not callable(getattr(cls, name, None))
+        )
+        plan = (names, frozenset(names))
+        with _plans_lock:
+            _plans[cls] = plan
+    return plan
+
+
+def extract_results(result: Any, projection: Union[str, None] = None) -> dict[str, Any]:
+    """
+    Collects the public string attributes of an SDK result.
+
+    Args:
+        result: the object returned by a builder's ``execute()``
+        projection: one of PROJECTIONS, defaults to "full"
+
+    Returns:
+        dict[str, Any]
+    """
+    names = PROJECTIONS[projection or DEFAULT_PROJECTION]
+    fields = {}
+    if names is not None:
+        for key in names:
+            value = getattr(result, key, None)
+            if isinstance(value, str):
+                fields[key] = value
+        return fields
+
+    class_names, known = plan_for(type(result))
+    for key in class_names:
+        value = getattr(result, key)
+        if isinstance(value, str):
+            fields[key] = value
+    for key, value in getattr(result, "__dict__", {}).items():
+        if key not in known and not key.startswith("_") and isinstance(value, str):
+            fields[key] = value
+    return fields
+
+
+# BatchSummary attribute -> response field
+BATCH_SUMMARY_FIELDS = {
+    "id": "batch_id",
+    "sequence_number": "sequence_number",
+    "transaction_count": "transaction_count",
+    "total_amount": "total_amount",
+}
+
+
+def batch_summary(result: Any) -> dict[str, str]:
+    """
+    The batch id, count and total of a ``BatchService.close_batch()`` result,
+    as strings; fields the gateway did not return are left out.
+    """
+    summary = getattr(result, "batch_summary", None) or result
+    fields = {}
+    for name, key in BATCH_SUMMARY_FIELDS.items():
+        value = getattr(summary, name, None)
+        if value is not None and not callable(value):
+            fields[key] = str(value)
+    return fields
@@ -0,0 +1,308 @@
+"""
+Pooled, keep-alive HTTP transport for the Portico gateway.
+
+The SDK's ``Gateway.send_request`` opens a fresh connection (and TLS session)
+for every call. ``PooledTransport.install`` replaces it on a connector with one
+that sends through a shared urllib3 ``PoolManager``, which keeps one pool of
+reusable connections per gateway host.
+
+A kept-alive connection can be closed by the gateway (or a load balancer in
+front of it) while it sits idle, and a POST sent on it just as it closes
+fails without an answer. Payments are not retried on read errors, so that
+would surface as a gateway failure. Instead, connections idle for longer
+than ``idle_timeout`` are closed rather than reused, and a request that
+fails while it is being written on a reused connection is retried like a
+connection error, since the gateway cannot have acted on half a request.
+"""
+import threading
+import time
+from functools import partial
+from typing import Any, Union
+from urllib.parse import urlencode
+
+import certifi
+import urllib3
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ProtocolError
+from urllib3.util import Retry, Timeout
+
+from python_sdk.globalpayments.api.entities.exceptions import GatewayException
+from python_sdk.globalpayments.api.gateways import GatewayResponse
+
+from service import deadline
+from service.business.cassette import Cassette
+from service.deadline import GatewayDeadlineExceeded
+from service.business.exchange import GatewayRequest, current_exchange
+from service.metrics import DEADLINE_EXCEEDED, GATEWAY_HTTP_RESPONSES, stage
+
+
+class StaleConnection(ProtocolError):
+    """A reused connection failed before the request was written."""
+
+
+class _GatewayRetry(Retry):
+    def _is_connection_error(self, err: Exception) -> bool:
+        return isinstance(err, StaleConnection) or super()._is_connection_error(err)
+
+
+class _ConnectionMixin:
+    # set by the pool when the connection is handed out again
+    reused = False
+    idle_since = 0.0
+
+    def request(self, *args, **kwargs):
+        try:
+            return super().request(*args, **kwargs)
+        except OSError as e:
+            if self.reused:
+                raise StaleConnection("Reused connection closed while sending", e) from e
+            raise
+
+
+class _HTTPConnection(_ConnectionMixin, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_ConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _PoolMixin:
+    def __init__(self, *args, idle_timeout: float = 4.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        # seconds a connection may sit idle and still be reused
+        self.idle_timeout = idle_timeout
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        if conn.sock is not None and time.monotonic() - conn.idle_since > self.idle_timeout:
+            conn.close()
+        conn.reused = conn.sock is not None
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.idle_since = time.monotonic()
+        super()._put_conn(conn)
+
+
+class _HTTPConnectionPool(_PoolMixin, HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(_PoolMixin, HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class PooledTransport:
+    """
+    Sends gateway requests over pooled keep-alive connections.
+
+    Connection errors, and failures writing a request on a reused
+    connection, are retried for every call, since nothing reached the
+    gateway; read errors (e.g. a reset mid-response) are only retried for
+    idempotent methods, so a payment POST is never sent twice.
+    """
+
+    def __init__(
+        self,
+        num_pools: int = 16,
+        maxsize: int = 32,
+        block: bool = False,
+        keep_alive: bool = True,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 65.0,
+        retries: int = 2,
+        idle_timeout: float = 4.0,
+    ):
+        self._lock = threading.Lock()
+        # records or replays gateway round trips, see service.business.cassette
+        self.cassette: Union[Cassette, None] = None
+        self.configure(
+            num_pools=num_pools,
+            maxsize=maxsize,
+            block=block,
+            keep_alive=keep_alive,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retries=retries,
+            idle_timeout=idle_timeout,
+        )
+
+    def configure(
+        self,
+        num_pools: int,
+        maxsize: int,
+        block: bool,
+        keep_alive: bool,
+        connect_timeout: float,
+        read_timeout: float,
+        retries: int,
+        idle_timeout: float = 4.0,
+    ):
+        """
+        Rebuilds the pool manager; open connections of the old one are closed.
+        """
+        manager = urllib3.PoolManager(
+            num_pools=num_pools,
+            maxsize=maxsize,
+            block=block,
+            cert_reqs="CERT_REQUIRED",
+            ca_certs=certifi.where(),
+            timeout=Timeout(connect=connect_timeout, read=read_timeout),
+            retries=_GatewayRetry(
+                total=retries,
+                connect=retries,
+                read=retries,
+                status=0,
+                redirect=0,
+                allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                raise_on_status=False,
+                backoff_factor=0.05,
+            ),
+        )
+        manager.pool_classes_by_scheme = {
+            "http": partial(_HTTPConnectionPool, idle_timeout=idle_timeout),
+            "https": partial(_HTTPSConnectionPool, idle_timeout=idle_timeout),
+        }
+        with self._lock:
+            previous = getattr(self, "_manager", None)
+            self._manager = manager
+            self.keep_alive = keep_alive
+            self.connect_timeout = connect_timeout
+            self.read_timeout = read_timeout
+        if previous is not None:
+            previous.clear()
+
+    @staticmethod
+    def config_kwargs(config) -> dict[str, Any]:
+        return dict(
+            num_pools=int(config.GATEWAY_NUM_POOLS),
+            maxsize=int(config.GATEWAY_POOL_SIZE),
+            block=bool(config.GATEWAY_POOL_BLOCK),
+            keep_alive=bool(config.GATEWAY_KEEP_ALIVE),
+            connect_timeout=float(config.GATEWAY_CONNECT_TIMEOUT),
+            read_timeout=float(config.GATEWAY_READ_TIMEOUT),
+            retries=int(config.GATEWAY_RETRIES),
+            idle_timeout=float(config.GATEWAY_IDLE_TIMEOUT),
+        )
+
+    def install(self, gateway):
+        """
+        Routes ``gateway.send_request`` through this transport.
+        """
+        gateway.send_request = partial(self.send_request, gateway)
+        return gateway
+
+    def prepare(
+        self,
+        gateway,
+        verb: str,
+        endpoint: str,
+        data: Union[str, bytes, None] = None,
+        query_string_params: Union[dict[str, Any], None] = None,
+    ) -> GatewayRequest:
+        headers = dict(gateway.headers or {})
+        headers["Content-Type"] = gateway.content_type
+        headers["Connection"] = "keep-alive" if self.keep_alive else "close"
+        url = gateway.service_url + endpoint
+        if query_string_params:
+            url += "?" + urlencode(query_string_params)
+        return GatewayRequest(method=verb, url=url, headers=headers, body=data)
+
+    def send_request(
+        self,
+        gateway,
+        verb: str,
+        endpoint: str,
+        data: Union[str, bytes, None] = None,
+        query_string_params: Union[dict[str, Any], None] = None,
+    ) -> GatewayResponse:
+        """
+        Same contract as the SDK's ``Gateway.send_request``. Inside an
+        async exchange the request is handed to it instead of being sent;
+        with a cassette it is recorded or replayed, see
+        service.business.cassette.
+        """
+        request = self.prepare(gateway, verb, endpoint, data, query_string_params)
+        exchange = current_exchange()
+        if exchange is not None:
+            return exchange.send(request)
+        if self.cassette is not None:
+            return self.cassette.send(request, self.send)
+        return self.send(request)
+
+    def send(self, request: GatewayRequest) -> GatewayResponse:
+        """
+        Sends a prepared request, with its timeouts capped to the time left
+        before the request's deadline.
+
+        Raises:
+            GatewayException: the gateway could not be reached or timed out
+            DeadlineExceeded: the deadline passed before it was sent
+            GatewayDeadlineExceeded: the deadline passed before the answer
+        """
+        options: dict[str, Any] = {}
+        left = deadline.remaining()
+        if left is not None:
+            deadline.check("gateway")
+            options["timeout"] = Timeout(
+                connect=min(self.connect_timeout, left), read=min(self.read_timeout, left)
+            )
+        try:
+            with stage("gateway"):
+                response = self._manager.request(
+                    request.method,
+                    request.url,
+                    headers=request.headers,
+                    body=request.body,
+                    preload_content=True,
+                    **options,
+                )
+        except Exception as e:
+            GATEWAY_HTTP_RESPONSES.inc(status=type(e).__name__)
+            if deadline.passed():
+                # cut short by the caller, not a gateway failure
+                DEADLINE_EXCEEDED.inc(stage="response")
+                raise GatewayDeadlineExceeded(
+                    "Request deadline passed waiting for the gateway"
+                ) from e
+            raise GatewayException(
+                "Error occurred while communicating with gateway."
+            ) from e
+
+        GATEWAY_HTTP_RESPONSES.inc(status=response.status)
+
+        result = GatewayResponse()
+        result.status_code = response.status
+        result.response_text = response.data.decode("utf-8")
+        return result
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        Connection pool counters keyed by ``scheme://host:port``.
+        """
+        pools = self._manager.pools
+        stats = {}
+        for key in pools.keys():
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            # The pool's queue holds idle connections plus ``None`` for
+            # every slot that has never been (or is no longer) connected.
+            idle = list(pool.pool.queue) if pool.pool else []
+            stats[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                "maxsize": pool.pool.maxsize if pool.pool else 0,
+                "idle_connections": sum(1 for conn in idle if conn is not None),
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+            }
+        return stats
+
+    def clear(self):
+        self._manager.clear()
+
+
+transport = PooledTransport()
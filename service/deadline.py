@@ -0,0 +1,117 @@
+"""
+Request deadlines.
+
+A caller can say when it stops waiting, with an ``X-Request-Deadline`` header
+or a ``deadline`` field in the request body: epoch seconds, or an ISO 8601
+time (UTC when it has no offset). The earlier of the two applies to the
+operations the request runs. A request already past its deadline is not
+dispatched; one that waited in the executor queue past it is dropped before it
+reaches the SDK; and the executor wait and the gateway timeouts are capped to
+the time left, so threads and connections are not held for a caller that has
+gone.
+
+A call the caller stopped waiting for may still have reached the gateway, and
+a sale may have gone through; service.dispatch logs the outcome of such calls
+as orphans so they can be reconciled.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Iterator, Union
+
+from sanic.exceptions import SanicException
+
+from service.metrics import DEADLINE_EXCEEDED
+
+HEADER = "X-Request-Deadline"
+
+# time.monotonic() the current request's caller stops waiting at; copied
+# into executor threads with the context
+_deadline: ContextVar[Union[float, None]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(SanicException):
+    """Raised when the caller's deadline passed before the call finished."""
+    status_code = 504
+    quiet = True
+
+
+class GatewayDeadlineExceeded(DeadlineExceeded):
+    """
+    Raised when the deadline passed while waiting for the gateway: unlike the
+    other stages, the request may have reached it.
+    """
+
+
+def parse(value: Union[str, float, int]) -> float:
+    """
+    Epoch seconds for a deadline given as epoch seconds or ISO 8601.
+
+    Raises:
+        ValueError: neither
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+@contextmanager
+def until(epoch: Union[float, None]) -> Iterator[None]:
+    """
+    Applies a deadline, in epoch seconds, to the calls made in the block,
+    unless an earlier one already applies.
+    """
+    if epoch is None:
+        yield
+        return
+    at = time.monotonic() + epoch - time.time()
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Union[float, None]:
+    """
+    Seconds left before the current deadline, None without one.
+    """
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def check(stage: str):
+    """
+    Raises:
+        DeadlineExceeded: the current deadline has passed
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        DEADLINE_EXCEEDED.inc(stage=stage)
+        raise DeadlineExceeded(f"Request deadline passed before {stage}")
+
+
+def passed() -> bool:
+    """
+    Whether the current deadline, if there is one, has passed.
+    """
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def cap(timeout: float) -> float:
+    """
+    ``timeout``, or the time left before the deadline if that is shorter.
+    """
+    left = remaining()
+    return timeout if left is None else max(min(timeout, left), 0.0)
@@ -0,0 +1,263 @@
+"""
+Runs payment operations through one table and one middleware chain.
+
+Every operation the service offers is an Operation: its request input type,
+how the input maps onto the ``OnlinePayments`` method of the same name and
+what its route answers with. Routes, batches, jobs and the settlement
+scheduler all call operations through a Dispatcher, so whatever wraps a
+gateway call (deadlines, metrics, caching, idempotency, the gateway guard,
+the executor) is a middleware applied once for all of them:
+
+    async def middleware(call: Call, call_next: Handler) -> Any:
+        ...
+        return await call_next(call)
+
+The chain is composed when the Dispatcher is created, not per call.
+"""
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Awaitable, Callable, Iterable, Union
+
+from sanic import Sanic
+
+from service import deadline
+from service.business.containers import merchant_id
+from service.business.functions import OnlinePayments
+from service.deadline import DeadlineExceeded, GatewayDeadlineExceeded
+from service.executor import ExecutorTimeout, on_submit
+from service.idempotency import idempotency_key
+from service.metrics import OPERATION_SECONDS, ORPHANED_RESULTS, record_error, record_result
+from service.packages.lumberjack import get_logger
+from service.packages.lumberjack.SensitiveDataFilter import SensitiveDataFilter
+
+logger = get_logger()
+
+
+def no_arguments(request_input: Any) -> dict[str, Any]:
+    return {}
+
+
+def same_result(result: Any) -> Any:
+    return result
+
+
+@dataclass(frozen=True)
+class Operation:
+    name: str
+    input_type: type
+    # OnlinePayments.<name> keyword arguments for a request input
+    arguments: Callable[[Any], dict[str, Any]] = no_arguments
+    # the route's response body for a result
+    response: Callable[[Any], Any] = same_result
+    # POST route under the blueprint; None when it has its own handler
+    path: Union[str, None] = None
+    # a retried call with the same reference is answered from the
+    # idempotency cache instead of reaching the gateway twice
+    idempotent: bool = False
+    # identical calls share the verify cache, see service.verify_cache
+    cached: bool = False
+
+
+@dataclass
+class Call:
+    app: Sanic
+    operation: Operation
+    request_input: Any
+    kwargs: dict[str, Any] = field(default_factory=dict)
+
+
+Handler = Callable[[Call], Awaitable[Any]]
+Middleware = Callable[[Call, Handler], Awaitable[Any]]
+
+
+async def deadlined(call: Call, call_next: Handler) -> Any:
+    """
+    Applies the request input's deadline, if it has one, and drops calls
+    whose deadline has already passed; see service.deadline.
+    """
+    with deadline.until(getattr(call.request_input, "deadline", None)):
+        deadline.check("dispatch")
+        return await call_next(call)
+
+
+async def cached(call: Call, call_next: Handler) -> Any:
+    verify_cache = getattr(call.app.ctx, "verify_cache", None)
+    if verify_cache is None or not call.operation.cached:
+        return await call_next(call)
+    request_input = call.request_input
+    return await verify_cache.run(
+        verify_cache.key(
+            request_input.params, request_input.credit_card_data, request_input.address
+        ),
+        partial(call_next, call),
+    )
+
+
+async def recorded(call: Call, call_next: Handler) -> Any:
+    """
+    Counts gateway response codes and times every operation.
+    """
+    operation = call.operation.name
+    start = time.perf_counter()
+    try:
+        result = await call_next(call)
+    except Exception as e:
+        record_error(operation, e)
+        raise
+    finally:
+        OPERATION_SECONDS.observe(time.perf_counter() - start, operation=operation)
+    record_result(operation, result)
+    return result
+
+
+async def idempotent(call: Call, call_next: Handler) -> Any:
+    idempotency = getattr(call.app.ctx, "idempotency", None)
+    request_input = call.request_input
+    if idempotency is None or not call.operation.idempotent or not request_input.reference:
+        return await call_next(call)
+    return await idempotency.run(
+        idempotency_key(call.operation.name, request_input.params, request_input.reference),
+        partial(call_next, call),
+        idempotency.fingerprint(request_input),
+    )
+
+
+async def guarded(call: Call, call_next: Handler) -> Any:
+    """
+    Rejects calls to a gateway that is failing or overloaded with a 503,
+    see service.breaker.
+    """
+    guard = getattr(call.app.ctx, "gateway_guard", None)
+    if guard is None:
+        return await call_next(call)
+    return await guard.run(guard.key(call.request_input.params), call_next, call)
+
+
+def orphaned(call: Call, outcome: Any):
+    """
+    Logs the outcome of a call its caller stopped waiting for, so a sale that
+    went through can be reconciled. Only ids and response codes are logged;
+    the reference and transaction id go in the ``identifiers`` extra, which
+    SensitiveDataFilter leaves unmasked.
+    """
+    if isinstance(outcome, DeadlineExceeded) and not isinstance(outcome, GatewayDeadlineExceeded):
+        return  # dropped before anything was sent
+    operation = call.operation.name
+    identifiers = {"reference": str(call.request_input.reference), "transaction_id": None}
+    if isinstance(outcome, BaseException):
+        ORPHANED_RESULTS.inc(operation=operation, outcome="error")
+        summary = f"{type(outcome).__name__}: {outcome}"
+    else:
+        ORPHANED_RESULTS.inc(operation=operation, outcome="ok")
+        fields = outcome if isinstance(outcome, dict) else {}
+        summary = f"response_code={fields.get('response_code')}"
+        if fields.get("transaction_id") is not None:
+            identifiers["transaction_id"] = str(fields["transaction_id"])
+    logger.warning(
+        f"Orphaned {operation} for merchant {merchant_id(call.request_input.params)}: {summary}",
+        extra={SensitiveDataFilter.IDENTIFIERS: identifiers},
+    )
+
+
+class _Outcome:
+    """
+    Hands a call's outcome to ``orphaned`` if its caller stops waiting,
+    whichever of the two happens first.
+    """
+
+    def __init__(self, call: Call):
+        self.call = call
+        self._lock = threading.Lock()
+        self._abandoned = False
+        self._finished = False
+        self._outcome: Any = None
+
+    def finished(self, outcome: Any):
+        with self._lock:
+            self._finished, self._outcome = True, outcome
+            abandoned = self._abandoned
+        if abandoned:
+            orphaned(self.call, outcome)
+
+    def done(self, future: asyncio.Future):
+        if future.cancelled():
+            self.finished(asyncio.CancelledError())
+        else:
+            self.finished(future.exception() or future.result())
+
+    def abandoned(self):
+        with self._lock:
+            self._abandoned = True
+            finished, outcome = self._finished, self._outcome
+        if finished:
+            orphaned(self.call, outcome)
+
+
+async def offload(call: Call) -> Any:
+    """
+    Calls ``OnlinePayments.<operation>`` on the payments executor, or on the
+    event loop when GATEWAY_TRANSPORT is "async".
+    """
+    request_input = call.request_input
+
+    def execute():
+        payments = OnlinePayments(
+            params=request_input.params,
+            reference=request_input.reference,
+            qa=request_input.qa,
+            projection=request_input.projection,
+        )
+        return getattr(payments, call.operation.name)(**call.kwargs)
+
+    # the call keeps going when the caller stops waiting for it
+    outcome = _Outcome(call)
+
+    def tracked():
+        try:
+            result = execute()
+        except Exception as e:
+            outcome.finished(e)
+            raise
+        outcome.finished(result)
+        return result
+
+    async_gateway = getattr(call.app.ctx, "async_gateway", None)
+    if async_gateway is None:
+        waiting = call.app.ctx.executor.run(tracked)
+    else:
+        # shielded, like an executor thread, and reported the same way
+        task = asyncio.ensure_future(async_gateway.run(execute))
+        task.add_done_callback(outcome.done)
+        submitted = on_submit.get()
+        if submitted is not None:
+            submitted(task)
+        waiting = asyncio.shield(task)
+
+    try:
+        return await waiting
+    except (ExecutorTimeout, DeadlineExceeded, asyncio.CancelledError):
+        outcome.abandoned()
+        raise
+
+
+# outermost first
+MIDDLEWARE: tuple[Middleware, ...] = (deadlined, cached, recorded, idempotent, guarded)
+
+
+class Dispatcher:
+    def __init__(self, middleware: Iterable[Middleware] = MIDDLEWARE, handler: Handler = offload):
+        self.middleware = tuple(middleware)
+        for wrap in reversed(self.middleware):
+            handler = partial(wrap, call_next=handler)
+        self._handler = handler
+
+    async def run(self, app: Sanic, operation: Operation, request_input: Any) -> Any:
+        return await self._handler(
+            Call(app, operation, request_input, operation.arguments(request_input))
+        )
+
+
+dispatcher = Dispatcher()
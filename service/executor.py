@@ -0,0 +1,136 @@
+"""
+Runs blocking OnlinePayments work off the event loop.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, TypeVar, Union
+
+from sanic.exceptions import SanicException, ServiceUnavailable
+
+from service import deadline, profiler
+from service.deadline import DeadlineExceeded
+from service.metrics import (
+    DEADLINE_EXCEEDED,
+    EXECUTOR_REJECTED,
+    EXECUTOR_TIMEOUTS,
+    EXECUTOR_WAIT_SECONDS,
+)
+
+_T = TypeVar("_T")
+
+# Called with the future of a call submitted from this context, so whoever
+# stops waiting for it can still act on its outcome; see service.idempotency.
+on_submit: contextvars.ContextVar[Union[Callable[[Future], None], None]] = contextvars.ContextVar(
+    "executor_on_submit", default=None
+)
+
+
+class ExecutorSaturated(ServiceUnavailable):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+class ExecutorTimeout(SanicException):
+    """Raised when a call does not finish within the configured timeout."""
+    status_code = 504
+    quiet = True
+
+
+class PaymentsExecutor:
+    """
+    A bounded thread pool for the blocking Heartland SDK calls.
+
+    At most ``max_workers`` calls run at once and at most ``max_queue``
+    more wait for a thread; anything beyond that is rejected immediately
+    with a 503 instead of queueing up latency.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, timeout: float):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="payments"
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._running = 0
+
+    @classmethod
+    def from_config(cls, config) -> "PaymentsExecutor":
+        return cls(
+            max_workers=int(config.PAYMENTS_EXECUTOR_WORKERS),
+            max_queue=int(config.PAYMENTS_EXECUTOR_QUEUE),
+            timeout=float(config.PAYMENTS_EXECUTOR_TIMEOUT),
+        )
+
+    async def run(self, fn: Callable[..., _T], *args: Any, **kwargs: Any) -> _T:
+        """
+        Runs ``fn`` on the pool and waits for it without blocking the loop,
+        for no longer than the request's deadline (see service.deadline).
+        A call still queued when the deadline passes is not run.
+
+        Raises:
+            ExecutorSaturated: the pool and its queue are full
+            ExecutorTimeout: ``fn`` did not finish within ``timeout`` seconds
+            DeadlineExceeded: the deadline passed first
+        """
+        if not self._slots.acquire(blocking=False):
+            EXECUTOR_REJECTED.inc()
+            raise ExecutorSaturated("Payment executor is saturated")
+        with self._lock:
+            self._in_flight += 1
+        context = contextvars.copy_context()
+        try:
+            future = self._pool.submit(
+                context.run, self._call, time.perf_counter(), fn, args, kwargs
+            )
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        submitted = on_submit.get()
+        if submitted is not None:
+            submitted(future)
+        timeout = deadline.cap(self.timeout)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            if timeout < self.timeout:
+                DEADLINE_EXCEEDED.inc(stage="wait")
+                raise DeadlineExceeded("Request deadline passed during the payment call") from None
+            EXECUTOR_TIMEOUTS.inc()
+            raise ExecutorTimeout("Payment call timed out") from None
+
+    @property
+    def running(self) -> int:
+        """Calls running on a thread."""
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        """Calls waiting for a thread."""
+        return self._in_flight - self._running
+
+    def _call(self, submitted: float, fn: Callable[..., _T], args, kwargs) -> _T:
+        EXECUTOR_WAIT_SECONDS.observe(time.perf_counter() - submitted)
+        deadline.check("queue")
+        with self._lock:
+            self._running += 1
+        try:
+            with profiler.attributed():
+                return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
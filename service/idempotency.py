@@ -0,0 +1,388 @@
+"""
+De-duplication of retried payment requests.
+
+Requests are keyed on operation + merchant + client reference. A retry of a
+completed request gets the stored response back without calling the gateway,
+and a retry that arrives while the original is still running waits for it.
+Each key is stored with a fingerprint of the request body, so reusing a
+reference for a different request is refused rather than answered with the
+first request's response. The fingerprint is an HMAC keyed with
+IDEMPOTENCY_SECRET and leaves out the card's CVN, so the store holds nothing
+a card number could be recovered from.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, TypeVar, Union
+from uuid import UUID
+
+from sanic.exceptions import SanicException
+
+from service.business.containers import merchant_id
+from service.business.params import HeartlandParams
+from service.deadline import DeadlineExceeded
+from service.executor import ExecutorTimeout, on_submit
+from service.json_util import EnhancedJSONEncoder
+
+_T = TypeVar("_T")
+
+
+class IdempotencyConflict(SanicException):
+    """Another worker is still processing a request with this key."""
+    status_code = 409
+    quiet = True
+
+
+class IdempotencyMismatch(SanicException):
+    """The key was used for a request with a different body."""
+    status_code = 422
+    quiet = True
+
+
+# fields a retry may change without being a different request
+UNFINGERPRINTED = frozenset({"params", "deadline", "projection"})
+# card fields that must not be stored in any form
+UNFINGERPRINTED_CARD = frozenset({"cvn"})
+
+
+def idempotency_key(operation: str, params: HeartlandParams, reference: UUID) -> str:
+    return f"{operation}:{merchant_id(params)}:{reference}"
+
+
+def request_fingerprint(request_input: Any, secret: bytes) -> str:
+    body = {
+        name: value for name, value in request_input.__dict__.items()
+        if name not in UNFINGERPRINTED
+    }
+    card = body.get("credit_card_data")
+    if card is not None:
+        body["credit_card_data"] = {
+            name: value for name, value in vars(card).items()
+            if name not in UNFINGERPRINTED_CARD
+        }
+    message = json.dumps(body, sort_keys=True, cls=EnhancedJSONEncoder).encode()
+    return hmac.new(secret, message, hashlib.sha256).hexdigest()
+
+
+def _check(key: str, stored: str, fingerprint: str):
+    if stored != fingerprint:
+        raise IdempotencyMismatch(
+            f"Reference {key.rsplit(':', 1)[-1]} was already used for a different request"
+        )
+
+
+class MemoryIdempotencyStore:
+    """
+    Completed responses in an LRU with a time-to-live, for a single worker.
+    """
+
+    # never blocks, so it is called from the event loop
+    executor = None
+
+    def __init__(self, max_entries: int = 100000, ttl: float = 86400.0, pending_ttl: float = 120.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        # key -> (response, fingerprint, expires)
+        self._entries: OrderedDict[str, tuple[Any, str, float]] = OrderedDict()
+        # key -> (fingerprint, expires)
+        self._pending: dict[str, tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, fingerprint: str = "") -> Union[Any, None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            _check(key, stored, fingerprint)
+            self._entries.move_to_end(key)
+            return value
+
+    def claim(self, key: str, fingerprint: str = "") -> bool:
+        now = time.monotonic()
+        with self._lock:
+            stored, expires = self._pending.get(key, ("", 0.0))
+            if expires > now:
+                _check(key, stored, fingerprint)
+                return False
+            self._evict(now)
+            self._pending[key] = (fingerprint, now + self.pending_ttl)
+            return True
+
+    def complete(self, key: str, value: Any, fingerprint: str = ""):
+        now = time.monotonic()
+        with self._lock:
+            self._pending.pop(key, None)
+            self._entries[key] = (value, fingerprint, now + self.ttl)
+            self._entries.move_to_end(key)
+            self._evict(now)
+
+    def release(self, key: str):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def close(self):
+        pass
+
+    def _evict(self, now: float):
+        """
+        Drops the oldest entries past ``max_entries``, and the pending keys
+        whose call never completed or released them; call with the lock held.
+        """
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        # only calls in flight and the ones left behind, so this stays short
+        expired = [key for key, (_, expires) in self._pending.items() if expires <= now]
+        for key in expired:
+            del self._pending[key]
+
+
+class SQLiteIdempotencyStore:
+    """
+    Responses in a SQLite file shared by every worker on the host.
+
+    ``claim`` inserts a pending row, so a request in flight on one worker is
+    visible to the others; a pending row left behind by a crashed worker
+    expires after ``pending_ttl`` seconds.
+
+    Another worker's write can hold the file for up to the busy timeout, so
+    IdempotencyCache calls the store on its ``executor`` thread rather than
+    on the event loop.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400.0, pending_ttl: float = 120.0):
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="idempotency")
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT,"
+            " fingerprint TEXT NOT NULL DEFAULT '',"
+            " expires REAL NOT NULL)"
+        )
+
+    def get(self, key: str, fingerprint: str = "") -> Union[Any, None]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, fingerprint FROM idempotency"
+                " WHERE key = ? AND response IS NOT NULL AND expires > ?",
+                (key, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        _check(key, row[1], fingerprint)
+        return json.loads(row[0])
+
+    def claim(self, key: str, fingerprint: str = "") -> bool:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM idempotency WHERE key = ? AND expires <= ?", (key, now)
+            )
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO idempotency (key, response, fingerprint, expires)"
+                " VALUES (?, NULL, ?, ?)",
+                (key, fingerprint, now + self.pending_ttl),
+            )
+            if cursor.rowcount == 1:
+                return True
+            row = self._db.execute(
+                "SELECT fingerprint FROM idempotency WHERE key = ?", (key,)
+            ).fetchone()
+        if row is not None:
+            _check(key, row[0], fingerprint)
+        return False
+
+    def complete(self, key: str, value: Any, fingerprint: str = ""):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO idempotency (key, response, fingerprint, expires)"
+                " VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), fingerprint, now + self.ttl),
+            )
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self._db.execute("DELETE FROM idempotency WHERE expires <= ?", (now,))
+
+    def release(self, key: str):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM idempotency WHERE key = ? AND response IS NULL", (key,)
+            )
+
+    def close(self):
+        self.executor.shutdown()
+        with self._lock:
+            self._db.close()
+
+
+IdempotencyStore = Union[MemoryIdempotencyStore, SQLiteIdempotencyStore]
+
+
+class IdempotencyCache:
+    """
+    Coalesces duplicate requests onto one call and replays stored responses.
+    """
+
+    def __init__(
+        self,
+        store: IdempotencyStore,
+        wait_timeout: float = 75.0,
+        poll_interval: float = 0.05,
+        secret: Union[bytes, None] = None,
+    ):
+        self.store = store
+        # without a configured secret, fingerprints are only comparable
+        # within a worker, which is all the in-memory store needs
+        self.secret = secret or os.urandom(32)
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        # key -> (the call's outcome, its fingerprint)
+        self._inflight: dict[str, tuple[asyncio.Future, str]] = {}
+
+    @classmethod
+    def from_config(cls, config) -> Union["IdempotencyCache", None]:
+        kind = str(config.IDEMPOTENCY_STORE).lower()
+        secret = str(config.IDEMPOTENCY_SECRET).encode()
+        if kind == "memory":
+            store = MemoryIdempotencyStore(
+                max_entries=int(config.IDEMPOTENCY_MAX_ENTRIES),
+                ttl=float(config.IDEMPOTENCY_TTL),
+                pending_ttl=float(config.IDEMPOTENCY_PENDING_TTL),
+            )
+        elif kind == "sqlite":
+            if not secret:
+                raise ValueError("IDEMPOTENCY_SECRET is required with IDEMPOTENCY_STORE = sqlite")
+            store = SQLiteIdempotencyStore(
+                path=str(config.IDEMPOTENCY_PATH),
+                ttl=float(config.IDEMPOTENCY_TTL),
+                pending_ttl=float(config.IDEMPOTENCY_PENDING_TTL),
+            )
+        elif kind in ("none", "off", ""):
+            return None
+        else:
+            raise ValueError(f"Unknown IDEMPOTENCY_STORE: {config.IDEMPOTENCY_STORE}")
+        return cls(store, wait_timeout=float(config.IDEMPOTENCY_WAIT), secret=secret)
+
+    def fingerprint(self, request_input: Any) -> str:
+        return request_fingerprint(request_input, self.secret)
+
+    async def run(
+        self, key: str, call: Callable[[], Awaitable[Any]], fingerprint: str = ""
+    ) -> Any:
+        """
+        Returns the stored response for ``key``, or awaits ``call()`` once and
+        stores what it returns.
+
+        A failed call releases the key so the client can retry. When the
+        caller stops waiting instead (an executor timeout, its deadline, or
+        the request was cancelled), the gateway call may still complete: the
+        key stays pending until it does, and then stores its response or is
+        released (or until it expires, with no submitted call to watch),
+        rather than risking a second charge.
+
+        Raises:
+            IdempotencyMismatch: ``key`` was used with another ``fingerprint``
+        """
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            pending, stored = inflight
+            _check(key, stored, fingerprint)
+            return await asyncio.shield(pending)
+
+        cached = await self._store(self.store.get, key, fingerprint)
+        if cached is not None:
+            return cached
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (future, fingerprint)
+        try:
+            if await self._store(self.store.claim, key, fingerprint):
+                submitted: list[Union[Future, asyncio.Future]] = []
+                token = on_submit.set(submitted.append)
+                try:
+                    result = await call()
+                except (ExecutorTimeout, DeadlineExceeded, asyncio.CancelledError):
+                    self._settle_when_done(key, fingerprint, submitted)
+                    raise
+                except BaseException:
+                    await self._store(self.store.release, key)
+                    raise
+                finally:
+                    on_submit.reset(token)
+                await self._store(self.store.complete, key, result, fingerprint)
+            else:
+                result = await self._wait_for_other_worker(key, fingerprint)
+        except BaseException as e:
+            future.set_exception(e)
+            # waiters re-raise it; don't warn when there were none
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def _settle_when_done(
+        self, key: str, fingerprint: str, submitted: list[Union[Future, asyncio.Future]]
+    ):
+        """
+        Completes or releases ``key`` once the call its caller stopped
+        waiting for has finished.
+        """
+        if not submitted:
+            return
+
+        def done(future: Union[Future, asyncio.Future]):
+            # may run on the event loop, so only hand the write over
+            if future.cancelled() or future.exception() is not None:
+                self._store_later(self.store.release, key)
+            else:
+                self._store_later(self.store.complete, key, future.result(), fingerprint)
+
+        submitted[-1].add_done_callback(done)
+
+    async def _store(self, method: Callable[..., _T], *args: Any) -> _T:
+        """
+        Calls a store method off the event loop if the store can block.
+        """
+        if self.store.executor is None:
+            return method(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.store.executor, method, *args)
+
+    def _store_later(self, method: Callable[..., Any], *args: Any):
+        if self.store.executor is None:
+            method(*args)
+        else:
+            self.store.executor.submit(method, *args)
+
+    async def _wait_for_other_worker(self, key: str, fingerprint: str) -> Any:
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            cached = await self._store(self.store.get, key, fingerprint)
+            if cached is not None:
+                return cached
+        raise IdempotencyConflict("A request with this reference is still in progress")
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,582 @@
+"""
+Bulk refund / void / capture jobs with a durable journal.
+
+A job is created with the shared params (``POST /jobs``), then its operations
+are uploaded as CSV or NDJSON (``PUT /jobs/<job_id>/input``). The upload is
+parsed as it streams in and every row is written to a SQLite journal before
+it runs, with at most ``concurrency`` rows in flight, so neither the upload
+nor the results are ever held in memory. Progress is in ``GET /jobs/<job_id>``
+and the results stream from ``GET /jobs/<job_id>/results``.
+
+The journal does not hold the merchant's credentials, only a handle for the
+merchant (see service.business.containers.merchant_id): the params are
+presented again, and must be the same merchant's, with every upload (in the
+``X-Job-Params`` header, as JSON) and to resume a job
+(``POST /jobs/<job_id>/resume``).
+
+A job whose worker died resumes where it stopped: uploading the same input
+again skips the rows already journaled, and resuming runs the rows a complete
+upload left queued. Rows that were in flight when the worker died may have
+reached the gateway, so they are marked ``interrupted`` rather than sent
+again. Jobs untouched for ``ttl`` seconds are deleted with their rows.
+
+Each row is journaled with a fingerprint of its contents, so an upload whose
+rows differ from the journaled ones is refused rather than matched up by
+line. Each row without a ``reference`` of its own runs with one derived from
+the job and line, so a row sent twice is answered from the idempotency cache
+(see service.idempotency) instead of refunding twice.
+"""
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Union
+from uuid import NAMESPACE_URL, UUID, uuid4, uuid5
+
+from sanic.exceptions import SanicException
+
+from service.business.containers import merchant_id
+from service.business.params import HeartlandParams
+from service.json_util import EnhancedJSONEncoder, ignore_properties
+
+QUEUED = "queued"
+RUNNING = "running"
+OK = "ok"
+ERROR = "error"
+INTERRUPTED = "interrupted"
+
+ROW_STATUSES = (QUEUED, RUNNING, OK, ERROR, INTERRUPTED)
+
+# CSV columns; anything else in the header is passed through as well
+CSV_COLUMNS = (
+    "operation",
+    "heartland_transaction_id",
+    "payment_transaction_amount",
+    "amount",
+    "reference",
+)
+# CSV columns that aren't strings
+CSV_TYPES: dict[str, Callable[[str], Any]] = {"amount": float}
+# longest record an upload may have, in bytes
+MAX_LINE = 64 * 1024
+
+
+# the job's params on an upload, as JSON
+PARAMS_HEADER = "X-Job-Params"
+
+
+class JobBusy(SanicException):
+    """The job is already running, on this worker or another one."""
+    status_code = 409
+    quiet = True
+
+
+class WrongMerchant(SanicException):
+    """The params presented are not those of the job's merchant."""
+    status_code = 403
+    quiet = True
+
+
+class RowMismatch(SanicException):
+    """An uploaded row is not the one journaled for its line."""
+    status_code = 409
+    quiet = True
+
+
+@dataclass
+class JobRequestInput:
+    params: HeartlandParams
+    qa: bool = False
+    projection: Union[str, None] = None
+    concurrency: Union[int, None] = None
+
+    def __post_init__(self):
+        if not isinstance(self.params, HeartlandParams):
+            self.params = ignore_properties(HeartlandParams, self.params)
+
+
+@dataclass
+class JobParamsInput:
+    params: HeartlandParams
+
+    def __post_init__(self):
+        if not isinstance(self.params, HeartlandParams):
+            self.params = ignore_properties(HeartlandParams, self.params)
+
+
+@dataclass
+class Job:
+    job_id: str
+    merchant: str
+    qa: bool
+    projection: Union[str, None]
+    concurrency: int
+    input_complete: bool
+    created: float
+    updated: float
+
+    def item(
+        self, params: HeartlandParams, line: int, row: dict[str, Any]
+    ) -> dict[str, Any]:
+        """
+        A row with the job's shared fields filled in, as for /batch.
+        """
+        shared = {"params": params, "qa": self.qa}
+        if self.projection is not None:
+            shared["projection"] = self.projection
+        item = {**shared, **row}
+        if item.get("reference") is None:
+            item["reference"] = row_reference(self.job_id, line)
+        return item
+
+
+def row_reference(job_id: str, line: int) -> UUID:
+    """
+    The reference a row without one runs with, the same on every run.
+    """
+    return uuid5(NAMESPACE_URL, f"jobs/{job_id}/{line}")
+
+
+def row_fingerprint(row: dict[str, Any]) -> str:
+    return hashlib.sha256(
+        json.dumps(row, sort_keys=True, cls=EnhancedJSONEncoder).encode()
+    ).hexdigest()
+
+
+class JobJournal:
+    """
+    Jobs and their rows in a SQLite file shared by every worker on the host.
+
+    A worker running a job holds a lease on it and renews it as rows finish;
+    a job whose lease has run out is free for another worker to take over.
+    """
+
+    def __init__(self, path: str, lease: float = 30.0, ttl: float = 7 * 86400.0):
+        self.lease = lease
+        self.ttl = ttl
+        self.owner = f"{os.getpid()}:{uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, timeout=5.0, check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " merchant TEXT NOT NULL,"
+            " qa INTEGER NOT NULL,"
+            " projection TEXT,"
+            " concurrency INTEGER NOT NULL,"
+            " input_complete INTEGER NOT NULL DEFAULT 0,"
+            " owner TEXT,"
+            " lease_until REAL NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS job_rows ("
+            " job_id TEXT NOT NULL,"
+            " line INTEGER NOT NULL,"
+            " operation TEXT,"
+            " input TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " outcome TEXT,"
+            " PRIMARY KEY (job_id, line))"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS job_rows_status ON job_rows (job_id, status, line)"
+        )
+
+    def create(self, request_input: JobRequestInput, concurrency: int) -> Job:
+        now = time.time()
+        job_id = uuid4().hex
+        with self._lock:
+            self._purge(now)
+            self._db.execute(
+                "INSERT INTO jobs"
+                " (job_id, merchant, qa, projection, concurrency, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, merchant_id(request_input.params), int(request_input.qa),
+                 request_input.projection, concurrency, now, now),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Union[Job, None]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT job_id, merchant, qa, projection, concurrency, input_complete,"
+                " created, updated FROM jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, merchant, qa, projection, concurrency, input_complete, created, updated = row
+        return Job(job_id, merchant, bool(qa), projection, concurrency,
+                   bool(input_complete), created, updated)
+
+    def claim(self, job_id: str) -> bool:
+        """
+        Takes or renews the lease on a job. Taking it over from a worker that
+        died, or that stopped without releasing it, marks the rows it had in
+        flight interrupted.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT owner, lease_until FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            owner, lease_until = row
+            if owner not in (None, self.owner) and lease_until > now:
+                return False
+            self._db.execute(
+                "UPDATE jobs SET owner = ?, lease_until = ?, updated = ? WHERE job_id = ?",
+                (self.owner, now + self.lease, now, job_id),
+            )
+            if owner != self.owner:
+                self._db.execute(
+                    "UPDATE job_rows SET status = ? WHERE job_id = ? AND status = ?",
+                    (INTERRUPTED, job_id, RUNNING),
+                )
+        return True
+
+    def release(self, job_id: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET owner = NULL, lease_until = 0 WHERE job_id = ? AND owner = ?",
+                (job_id, self.owner),
+            )
+
+    def add(self, job_id: str, line: int, row: dict[str, Any]) -> bool:
+        """
+        Journals an uploaded row and marks it running.
+
+        Returns:
+            False if the row was journaled by an earlier upload and is not
+            waiting to run
+
+        Raises:
+            RowMismatch: an earlier upload journaled a different row on this line
+        """
+        fingerprint = row_fingerprint(row)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO job_rows"
+                " (job_id, line, operation, input, fingerprint, status)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, line, row.get("operation"), json.dumps(row), fingerprint,
+                 QUEUED),
+            )
+            journaled, = self._db.execute(
+                "SELECT fingerprint FROM job_rows WHERE job_id = ? AND line = ?",
+                (job_id, line),
+            ).fetchone()
+            if journaled != fingerprint:
+                raise RowMismatch(
+                    f"Line {line} is not the row an earlier upload of job {job_id} had"
+                )
+            cursor = self._db.execute(
+                "UPDATE job_rows SET status = ? WHERE job_id = ? AND line = ? AND status = ?",
+                (RUNNING, job_id, line, QUEUED),
+            )
+            return cursor.rowcount == 1
+
+    def next_queued(self, job_id: str, limit: int = 100) -> list[tuple[int, dict[str, Any]]]:
+        """
+        Marks up to ``limit`` queued rows running and returns them.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "UPDATE job_rows SET status = ? WHERE rowid IN ("
+                " SELECT rowid FROM job_rows WHERE job_id = ? AND status = ?"
+                " ORDER BY line LIMIT ?)"
+                " RETURNING line, input",
+                (RUNNING, job_id, QUEUED, limit),
+            ).fetchall()
+        return sorted((line, json.loads(row)) for line, row in rows)
+
+    def finish(self, job_id: str, line: int, outcome: dict[str, Any]):
+        status = OK if outcome.get("status") == "ok" else ERROR
+        with self._lock:
+            self._db.execute(
+                "UPDATE job_rows SET status = ?, outcome = ? WHERE job_id = ? AND line = ?",
+                (status, json.dumps(outcome, cls=EnhancedJSONEncoder), job_id, line),
+            )
+
+    def complete_input(self, job_id: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET input_complete = 1, updated = ? WHERE job_id = ?",
+                (time.time(), job_id),
+            )
+
+    def status(self, job: Job) -> dict[str, Any]:
+        """
+        A job's progress.
+        """
+        counts = self.counts(job.job_id)
+        return {
+            "job_id": job.job_id,
+            "input_complete": job.input_complete,
+            "done": job.input_complete and not counts[QUEUED] and not counts[RUNNING],
+            "rows": counts,
+            "created": job.created,
+            "updated": job.updated,
+        }
+
+    def counts(self, job_id: str) -> dict[str, int]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) FROM job_rows WHERE job_id = ? GROUP BY status",
+                (job_id,),
+            ).fetchall()
+        return {**dict.fromkeys(ROW_STATUSES, 0), **dict(rows)}
+
+    def outcomes(self, job_id: str, page: int = 500) -> Iterator[list[dict[str, Any]]]:
+        """
+        Finished rows in line order, a page at a time.
+        """
+        after = -1
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT line, operation, status, outcome FROM job_rows"
+                    " WHERE job_id = ? AND line > ? AND status IN (?, ?, ?)"
+                    " ORDER BY line LIMIT ?",
+                    (job_id, after, OK, ERROR, INTERRUPTED, page),
+                ).fetchall()
+            if not rows:
+                return
+            yield [
+                json.loads(outcome) if outcome is not None
+                else {"line": line, "operation": operation, "status": status}
+                for line, operation, status, outcome in rows
+            ]
+            after = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _purge(self, now: float):
+        """
+        Deletes jobs nobody has touched for ``ttl`` seconds, with their rows.
+        """
+        expired = "SELECT job_id FROM jobs WHERE updated <= ? AND lease_until <= ?"
+        self._db.execute(
+            f"DELETE FROM job_rows WHERE job_id IN ({expired})", (now - self.ttl, now)
+        )
+        self._db.execute(
+            f"DELETE FROM jobs WHERE job_id IN ({expired})", (now - self.ttl, now)
+        )
+
+
+def job_params(value: Union[str, None]) -> HeartlandParams:
+    """
+    The params presented with an upload, see PARAMS_HEADER.
+
+    Raises:
+        ValueError: missing or not a params object
+    """
+    if not value:
+        raise ValueError(f"{PARAMS_HEADER} is required")
+    params = json.loads(value)
+    if not isinstance(params, dict):
+        raise ValueError(f"{PARAMS_HEADER} must be a JSON object")
+    return ignore_properties(HeartlandParams, params)
+
+
+async def parse_rows(
+    chunks: AsyncIterator[bytes], content_type: str, max_line: int = MAX_LINE
+) -> AsyncIterator[tuple[int, dict[str, Any]]]:
+    """
+    Parses an upload as it arrives into (line, row) pairs, where line counts
+    records from 0. CSV needs a header row and no newlines inside fields;
+    anything else is read as NDJSON. At most ``max_line`` bytes of a record
+    are buffered.
+
+    Raises:
+        ValueError: a record is malformed or longer than ``max_line``
+    """
+    is_csv = content_type.split(";", 1)[0].strip().lower() in ("text/csv", "application/csv")
+    header: Union[list[str], None] = None
+    line = 0
+    buffer = b""
+
+    def records(lines: list[bytes]) -> Iterator[dict[str, Any]]:
+        nonlocal header
+        for raw in lines:
+            if len(raw) > max_line:
+                raise ValueError(f"Record {line} is longer than {max_line} bytes")
+            text = raw.decode("utf-8").strip()
+            if not text:
+                continue
+            if not is_csv:
+                row = json.loads(text)
+                if not isinstance(row, dict):
+                    raise ValueError(f"Expected a JSON object on record {line}")
+                yield row
+                continue
+            values = next(csv.reader([text]))
+            if header is None:
+                header = [value.strip() for value in values]
+                if "operation" not in header:
+                    raise ValueError(
+                        f"CSV header needs an operation column, e.g. {','.join(CSV_COLUMNS)}"
+                    )
+                continue
+            yield {
+                key: None if value == "" else CSV_TYPES.get(key, str)(value)
+                for key, value in zip(header, values)
+            }
+
+    async for chunk in chunks:
+        buffer += chunk
+        *complete, buffer = buffer.split(b"\n")
+        for row in records(complete):
+            yield line, row
+            line += 1
+        if len(buffer) > max_line:
+            raise ValueError(f"Record {line} is longer than {max_line} bytes")
+    for row in records([buffer]):
+        yield line, row
+        line += 1
+
+
+class JobRunner:
+    """
+    Runs journaled rows through ``call(job, params, line, row)`` with at most
+    ``job.concurrency`` in flight.
+    """
+
+    def __init__(
+        self,
+        journal: JobJournal,
+        call: Callable[
+            [Job, HeartlandParams, int, dict[str, Any]], Awaitable[dict[str, Any]]
+        ],
+    ):
+        self.journal = journal
+        self.call = call
+        self._active: set[str] = set()
+
+    async def close(self):
+        self.journal.close()
+
+    async def run_upload(
+        self,
+        job: Job,
+        params: HeartlandParams,
+        rows: AsyncIterator[tuple[int, dict[str, Any]]],
+    ) -> int:
+        """
+        Journals and runs the rows of an upload, reading the next row only
+        when a slot is free; returns how many rows ran.
+
+        Raises:
+            WrongMerchant: ``params`` are not the job's merchant's
+            JobBusy: the job is running elsewhere
+            RowMismatch: a row is not the one an earlier upload had
+        """
+        _check_merchant(job, params)
+        if job.job_id in self._active or not self.journal.claim(job.job_id):
+            raise JobBusy(f"Job {job.job_id} is already running")
+
+        async def pending():
+            async for line, row in rows:
+                if self.journal.add(job.job_id, line, row):
+                    yield line, row
+            self.journal.complete_input(job.job_id)
+            # rows queued by an earlier upload that stopped before running them
+            async for line, row in self._queued(job):
+                yield line, row
+
+        self._active.add(job.job_id)
+        try:
+            return await self._run(job, params, pending())
+        finally:
+            self._active.discard(job.job_id)
+            self.journal.release(job.job_id)
+
+    async def resume(self, job: Job, params: HeartlandParams) -> int:
+        """
+        Runs the rows an earlier upload left queued; returns how many ran.
+
+        Raises:
+            WrongMerchant: ``params`` are not the job's merchant's
+            JobBusy: the job is running elsewhere
+        """
+        _check_merchant(job, params)
+        if job.job_id in self._active or not self.journal.claim(job.job_id):
+            raise JobBusy(f"Job {job.job_id} is already running")
+        self._active.add(job.job_id)
+        try:
+            return await self._run(job, params, self._queued(job))
+        finally:
+            self._active.discard(job.job_id)
+            self.journal.release(job.job_id)
+
+    async def _queued(self, job: Job) -> AsyncIterator[tuple[int, dict[str, Any]]]:
+        while True:
+            rows = self.journal.next_queued(job.job_id)
+            if not rows:
+                return
+            for line, row in rows:
+                yield line, row
+
+    async def _run(
+        self,
+        job: Job,
+        params: HeartlandParams,
+        rows: AsyncIterator[tuple[int, dict[str, Any]]],
+    ) -> int:
+        semaphore = asyncio.Semaphore(max(1, job.concurrency))
+        tasks: set[asyncio.Task] = set()
+        # renewed on a timer, not per row read, so a stalled upload or rows
+        # slower than the lease don't let another worker take the job over
+        # while its rows are still at the gateway
+        renewing = asyncio.ensure_future(self._renew(job))
+        ran = 0
+
+        async def one(line: int, row: dict[str, Any]):
+            try:
+                outcome = await self.call(job, params, line, row)
+            except Exception as e:
+                outcome = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+            self.journal.finish(
+                job.job_id, line, {"line": line, "operation": row.get("operation"), **outcome}
+            )
+            semaphore.release()
+
+        try:
+            async for line, row in rows:
+                await semaphore.acquire()
+                task = asyncio.ensure_future(one(line, row))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                ran += 1
+        finally:
+            try:
+                if tasks:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+            finally:
+                renewing.cancel()
+        return ran
+
+    async def _renew(self, job: Job):
+        while True:
+            await asyncio.sleep(self.journal.lease / 3)
+            self.journal.claim(job.job_id)
+
+
+def _check_merchant(job: Job, params: HeartlandParams):
+    if merchant_id(params) != job.merchant:
+        raise WrongMerchant(f"The params are not those of job {job.job_id}'s merchant")
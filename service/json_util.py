@@ -1,24 +1,161 @@
-from dataclasses import fields, is_dataclass, asdict
+import json
+from contextlib import suppress
+from dataclasses import fields, is_dataclass
 from json import JSONEncoder
-from typing import TypeVar, Type, Any
+from types import NoneType, UnionType
+from typing import TypeVar, Type, Any, Callable, Union, get_args, get_origin, get_type_hints
 from uuid import UUID
 
+try:
+    import msgspec
+except ImportError:  # optional fast path, see decode_json
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:  # optional fast path, see serializer
+    orjson = None
+
 _T = TypeVar("_T")
 
+Decoder = Callable[[Any], _T]
+Serializer = Callable[[Any], bytes]
+
+_decoders: dict[type, Decoder] = {}
+_msgspec_decoders: dict[type, Any] = {}
+
 
 def ignore_properties(cls: Type[_T], dict_: Any) -> _T:
     """omits extra fields like @JsonIgnoreProperties(ignoreUnknown = true)"""
-    if isinstance(dict_, cls):
-        return dict_  # noqa
-    class_fields = {f.name for f in fields(cls)}
-    filtered = {k: v for k, v in dict_.items() if k in class_fields}
-    return cls(**filtered)
+    return decoder_for(cls)(dict_)
+
+
+def decoder_for(cls: Type[_T]) -> Decoder[_T]:
+    """
+    Returns the decode function for a dataclass, compiling it on first use.
+
+    The decoder drops unknown keys, decodes nested dataclass fields
+    (including optional ones) and coerces UUID fields from strings.
+    """
+    decoder = _decoders.get(cls)
+    if decoder is None:
+        decoder = _decoders[cls] = _compile_decoder(cls)
+    return decoder
+
+
+def decode_json(cls: Type[_T], body: Union[bytes, str]) -> _T:
+    """
+    Parses a JSON document straight into a dataclass.
+
+    msgspec, when installed, decodes and validates the bytes into ``cls`` in
+    one step. Bodies it rejects (e.g. a number where a string is declared)
+    go through the lenient ``decoder_for`` path instead, like before.
+
+    Raises:
+        ValueError: the body is not valid JSON
+    """
+    if msgspec is not None:
+        try:
+            return _msgspec_decoder(cls).decode(body)
+        except msgspec.ValidationError:
+            pass
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+    return decoder_for(cls)(json.loads(body))
+
+
+def warm_decoders(*classes: type):
+    """
+    Builds the decoders for ``classes`` ahead of the first request.
+    """
+    for cls in classes:
+        decoder_for(cls)
+        if msgspec is not None:
+            _msgspec_decoder(cls)
+
+
+def _msgspec_decoder(cls: type) -> Any:
+    decoder = _msgspec_decoders.get(cls)
+    if decoder is None:
+        decoder = _msgspec_decoders[cls] = msgspec.json.Decoder(cls)
+    return decoder
+
+
+def _compile_decoder(cls: Type[_T]) -> Decoder[_T]:
+    hints = get_type_hints(cls)
+    names = frozenset(f.name for f in fields(cls) if f.init)
+    converters = tuple(
+        (f.name, converter)
+        for f in fields(cls)
+        if f.init and (converter := _converter(hints[f.name])) is not None
+    )
+
+    def decode(dict_: Any) -> _T:
+        if isinstance(dict_, cls):
+            return dict_  # noqa
+        filtered = {k: v for k, v in dict_.items() if k in names}
+        for name, convert in converters:
+            value = filtered.get(name)
+            if value is not None:
+                filtered[name] = convert(value)
+        return cls(**filtered)
+
+    decode.__qualname__ = f"decode_{cls.__name__}"
+    return decode
+
+
+def _converter(type_: Any) -> Union[Callable[[Any], Any], None]:
+    if get_origin(type_) in (Union, UnionType):
+        args = [arg for arg in get_args(type_) if arg is not NoneType]
+        if len(args) != 1:
+            return None
+        type_ = args[0]
+    if type_ is UUID:
+        return _to_uuid
+    if isinstance(type_, type) and is_dataclass(type_):
+        return decoder_for(type_)
+    return None
+
+
+def _to_uuid(value: Any) -> Any:
+    if not isinstance(value, UUID):
+        with suppress(ValueError, TypeError, AttributeError):
+            return UUID(value)
+    return value
 
 
 class EnhancedJSONEncoder(JSONEncoder):
     def default(self, o):
         if is_dataclass(o):
-            return asdict(o)
+            # one level at a time; the encoder recurses into nested values,
+            # so there is no need for asdict's deep copy
+            return {f.name: getattr(o, f.name) for f in fields(o)}
         if isinstance(o, UUID):
             return str(o)
         return super().default(o)
+
+
+def stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, cls=EnhancedJSONEncoder).encode()
+
+
+def orjson_dumps(obj: Any) -> bytes:
+    # dataclasses and UUIDs are encoded natively
+    return orjson.dumps(obj)
+
+
+def serializer(name: str = "auto") -> Serializer:
+    """
+    The response serializer for a JSON_SERIALIZER setting: "orjson",
+    "stdlib", or "auto" for orjson when it is installed.
+    """
+    name = name.lower()
+    if name == "auto":
+        name = "stdlib" if orjson is None else "orjson"
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("JSON_SERIALIZER is orjson but orjson is not installed")
+        return orjson_dumps
+    if name == "stdlib":
+        return stdlib_dumps
+    raise ValueError(f"Unknown JSON_SERIALIZER: {name}")
@@ -0,0 +1,129 @@
+"""
+Production entry point settings, read from the environment.
+
+    WORKERS       worker processes, defaults to the CPUs this process may use
+    HOST, PORT    listen address, defaults to 0.0.0.0:8000
+    REUSE_PORT    bind with SO_REUSEPORT, so a new instance can start on the
+                  same port while the old one drains
+    BACKLOG       listen backlog, defaults to 1024
+    ACCESS_LOG    per-request access log, off by default
+    GRACEFUL_SHUTDOWN_TIMEOUT
+                  seconds to let in-flight requests finish after SIGTERM,
+                  defaults to the payments executor timeout plus 5
+    START_METHOD  how worker processes start: "fork" (the default on Linux)
+                  or "spawn", which re-imports the service in every worker
+
+Anything else is Sanic configuration and can be set with SANIC_-prefixed
+variables, e.g. SANIC_KEEP_ALIVE_TIMEOUT.
+"""
+import os
+import socket
+import sys
+from dataclasses import dataclass
+from typing import Mapping, Union
+
+TRUTHY = ("1", "true", "yes", "on")
+
+
+def default_start_method() -> str:
+    """
+    Forked workers inherit the imported service and start in milliseconds;
+    elsewhere fork is unsafe, so spawn.
+    """
+    return "fork" if sys.platform.startswith("linux") else "spawn"
+
+
+def available_cpus() -> int:
+    """
+    CPUs this process may run on, which respects container CPU sets unlike
+    ``os.cpu_count()``.
+    """
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:  # not available on macOS
+        return os.cpu_count() or 1
+
+
+@dataclass
+class LaunchSettings:
+    workers: int
+    host: str = "0.0.0.0"
+    port: int = 8000
+    reuse_port: bool = False
+    backlog: int = 1024
+    access_log: bool = False
+    graceful_timeout: Union[float, None] = None
+    start_method: str = "spawn"
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> "LaunchSettings":
+        return cls(
+            workers=int(environ.get("WORKERS") or available_cpus()),
+            host=environ.get("HOST", "0.0.0.0"),
+            port=int(environ.get("PORT", 8000)),
+            reuse_port=environ.get("REUSE_PORT", "").lower() in TRUTHY,
+            backlog=int(environ.get("BACKLOG", 1024)),
+            access_log=environ.get("ACCESS_LOG", "").lower() in TRUTHY,
+            graceful_timeout=float(environ["GRACEFUL_SHUTDOWN_TIMEOUT"])
+            if environ.get("GRACEFUL_SHUTDOWN_TIMEOUT") else None,
+            start_method=environ.get("START_METHOD") or default_start_method(),
+        )
+
+
+def bind_reuseport(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    """
+    A listening TCP socket with SO_REUSEPORT set, inheritable by the workers.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def extend(app):
+    """
+    Sets up the Sanic Extensions the service uses, the health monitor and the
+    ``/__health__`` endpoint, instead of letting every worker load all of them
+    (OpenAPI, templating, injection...) at start-up. Call it at import time of
+    the entry point, so spawned workers set it up too.
+    """
+    if app.config.HEALTH:
+        from sanic_ext.extensions.health.extension import HealthExtension
+
+        app.extend(built_in_extensions=False, extensions=[HealthExtension])
+    else:
+        app.config.AUTO_EXTEND = False
+
+
+def prepare(app, settings: LaunchSettings):
+    """
+    Calls ``app.prepare`` for a production run.
+
+    On SIGTERM Sanic stops accepting connections and waits up to
+    GRACEFUL_SHUTDOWN_TIMEOUT for in-flight requests; a payment can take up
+    to the executor timeout, so the default drain window covers it.
+    """
+    app.config.GRACEFUL_SHUTDOWN_TIMEOUT = (
+        settings.graceful_timeout
+        if settings.graceful_timeout is not None
+        else float(app.config.PAYMENTS_EXECUTOR_TIMEOUT) + 5.0
+    )
+    type(app).start_method = settings.start_method
+    sock: Union[socket.socket, None] = None
+    if settings.reuse_port:
+        sock = bind_reuseport(settings.host, settings.port, settings.backlog)
+    app.prepare(
+        host=None if sock else settings.host,
+        port=None if sock else settings.port,
+        sock=sock,
+        workers=settings.workers,
+        backlog=settings.backlog,
+        access_log=settings.access_log,
+        motd=False,
+        debug=False,
+        auto_reload=False,
+    )
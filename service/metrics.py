@@ -0,0 +1,189 @@
+"""
+The service's metrics and the ``/metrics`` endpoint.
+
+Labels only ever carry route and operation names, stage names and response
+codes; never card data, amounts, references or merchant credentials.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+from sanic import HTTPResponse, Request
+from sanic.blueprints import Blueprint
+
+from service.packages.metrics import CONTENT_TYPE, Registry
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "payments_request_seconds",
+    "Time spent handling a request, by route and HTTP status.",
+    ("route", "status"),
+)
+STAGE_SECONDS = registry.histogram(
+    "payments_stage_seconds",
+    "Time spent in each stage of a request: decode, configure, execute"
+    " (the whole SDK operation), gateway (the HTTP round trip), extract and encode.",
+    ("route", "stage"),
+)
+GATEWAY_RESPONSES = registry.counter(
+    "payments_gateway_responses_total",
+    "Gateway response codes by operation; errors are counted by exception type.",
+    ("operation", "response_code"),
+)
+OPERATION_SECONDS = registry.histogram(
+    "payments_operation_seconds",
+    "Time spent on each payment operation, whether called by a route, a batch,"
+    " a job or the settlement scheduler.",
+    ("operation",),
+)
+GATEWAY_HTTP_RESPONSES = registry.counter(
+    "payments_gateway_http_responses_total",
+    "HTTP status codes returned by the gateway.",
+    ("status",),
+)
+CONTAINER_LOOKUPS = registry.counter(
+    "payments_container_lookups_total",
+    "Per-merchant SDK container lookups, by cache result.",
+    ("result",),
+)
+EXECUTOR_WAIT_SECONDS = registry.histogram(
+    "payments_executor_wait_seconds",
+    "Time a call waited in the executor queue before a thread picked it up.",
+)
+EXECUTOR_REJECTED = registry.counter(
+    "payments_executor_rejected_total",
+    "Calls rejected because the executor and its queue were full.",
+)
+EXECUTOR_TIMEOUTS = registry.counter(
+    "payments_executor_timeouts_total",
+    "Calls that did not finish within the executor timeout.",
+)
+EXECUTOR_QUEUED = registry.gauge(
+    "payments_executor_queued",
+    "Calls waiting for an executor thread.",
+)
+EXECUTOR_RUNNING = registry.gauge(
+    "payments_executor_running",
+    "Calls running on an executor thread.",
+)
+POOL_IDLE_CONNECTIONS = registry.gauge(
+    "payments_gateway_pool_idle_connections",
+    "Idle keep-alive connections per gateway host.",
+    ("host",),
+)
+POOL_CONNECTIONS_OPENED = registry.gauge(
+    "payments_gateway_pool_connections_opened",
+    "Connections opened per gateway host since the pool was created.",
+    ("host",),
+)
+SETTLE_JOBS = registry.counter(
+    "payments_settle_jobs_total",
+    "Batch close jobs by trigger (request or schedule) and outcome; deduplicated"
+    " counts settle requests that joined a close already running.",
+    ("trigger", "status"),
+)
+REFUND_BATCH_STATE = registry.counter(
+    "payments_refund_batch_state_total",
+    "Full refunds by what was known of the transaction's batch: open (voided),"
+    " closed (refunded straight away) or unknown (void, then refund if it fails).",
+    ("batch",),
+)
+REFUND_VOID_FALLBACKS = registry.counter(
+    "payments_refund_void_fallbacks_total",
+    "Full refunds whose void failed and were refunded instead, by batch state.",
+    ("batch",),
+)
+DEADLINE_EXCEEDED = registry.counter(
+    "payments_deadline_exceeded_total",
+    "Calls dropped because the caller's deadline had passed, by where: dispatch,"
+    " queue (waited for an executor thread), gateway (before sending), response"
+    " (waiting for the gateway's answer) or wait (the caller stopped waiting for"
+    " the result).",
+    ("stage",),
+)
+ORPHANED_RESULTS = registry.counter(
+    "payments_orphaned_results_total",
+    "Calls that finished after their caller stopped waiting, by operation and"
+    " outcome (ok or error); each one is logged for reconciliation.",
+    ("operation", "outcome"),
+)
+CIRCUIT_REJECTED = registry.counter(
+    "payments_gateway_rejected_total",
+    "Calls rejected without contacting the gateway: circuit open, half_open"
+    " (probes in flight) or concurrency (limit reached).",
+    ("reason",),
+)
+CIRCUIT_STATE = registry.gauge(
+    "payments_gateway_circuit_state",
+    "Circuit state per gateway: 0 closed, 1 half-open, 2 open.",
+    ("gateway",),
+)
+CONCURRENCY_LIMIT = registry.gauge(
+    "payments_gateway_concurrency_limit",
+    "Adaptive limit on calls in flight per gateway.",
+    ("gateway",),
+)
+GATEWAY_IN_FLIGHT = registry.gauge(
+    "payments_gateway_in_flight",
+    "Calls in flight per gateway.",
+    ("gateway",),
+)
+
+# the route being handled; copied into executor threads with the context
+current_route: ContextVar[str] = ContextVar("metrics_route", default="")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Records the time spent in the block as stage ``name`` of the current route.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(
+            time.perf_counter() - start, route=current_route.get(), stage=name
+        )
+
+
+def record_result(operation: str, result: Any):
+    if isinstance(result, dict):
+        GATEWAY_RESPONSES.inc(
+            operation=operation, response_code=result.get("response_code") or "none"
+        )
+
+
+def record_error(operation: str, error: BaseException):
+    GATEWAY_RESPONSES.inc(operation=operation, response_code=type(error).__name__)
+
+
+def route_name(request: Request) -> str:
+    if request.route is None:
+        return "unmatched"
+    return request.route.name.rsplit(".", 1)[-1]
+
+
+async def start_timer(request: Request):
+    request.ctx.metrics_start = time.perf_counter()
+    current_route.set(route_name(request))
+
+
+async def stop_timer(request: Request, response: HTTPResponse):
+    start = getattr(request.ctx, "metrics_start", None)
+    if start is not None:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            route=route_name(request),
+            status=response.status if response is not None else 0,
+        )
+
+
+bp = Blueprint("Metrics")
+
+
+@bp.get("/metrics")
+async def metrics(request: Request):
+    return HTTPResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,220 @@
+import queue
+import logging
+import threading
+from logging import Handler, LogRecord, StreamHandler
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Union
+
+
+class BatchingQueueListener(QueueListener):
+    """
+    A QueueListener that drains records in batches.
+
+    Filters and formatters of the target handlers run on the listener thread.
+    Plain stream handlers get each batch as a single write and flush.
+    """
+
+    def __init__(
+        self,
+        record_queue: queue.Queue,
+        *handlers: Handler,
+        batch_size: int = 256,
+        on_batch: Union[Callable[[], Union[LogRecord, None]], None] = None,
+    ):
+        super().__init__(record_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+
+    def enqueue_sentinel(self):
+        # the queue may be full; stopping must still get through
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        q = self.queue
+        has_task_done = hasattr(q, "task_done")
+        stopping = False
+        while not stopping:
+            batch = []
+            record = self.dequeue(True)
+            while record is not self._sentinel:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self.dequeue(False)
+                except queue.Empty:
+                    break
+            else:
+                stopping = True
+            dequeued = len(batch) + stopping
+            if self.on_batch is not None:
+                extra = self.on_batch()
+                if extra is not None:
+                    batch.append(extra)
+            if batch:
+                self.handle_batch(batch)
+            if has_task_done:
+                for _ in range(dequeued):
+                    q.task_done()
+
+    def handle_batch(self, batch: list[LogRecord]):
+        for handler in self.handlers:
+            if type(handler).emit is StreamHandler.emit and handler.stream is not None:
+                self._write_batch(handler, batch)
+                continue
+            for record in batch:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    @staticmethod
+    def _write_batch(handler: StreamHandler, batch: list[LogRecord]):
+        chunks = []
+        for record in batch:
+            if record.levelno < handler.level or not handler.filter(record):
+                continue
+            try:
+                chunks.append(handler.format(record) + handler.terminator)
+            except Exception:
+                handler.handleError(record)
+        if not chunks:
+            return
+        with handler.lock:
+            try:
+                handler.stream.write("".join(chunks))
+                handler.flush()
+            except Exception:
+                handler.handleError(batch[-1])
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    Hands records to a bounded queue served by a BatchingQueueListener.
+
+    The calling thread only merges the message with its args; masking, JSON
+    formatting and writing happen on the listener thread. When the queue is
+    full, records below ``overflow_level`` are dropped (``overflow="drop"``)
+    or one in every ``sample_rate`` of them replaces the oldest of the least
+    severe queued records, if that is not more severe than itself
+    (``overflow="sample"``). Records at or above ``overflow_level`` wait up to
+    ``overflow_timeout`` seconds for room before being dropped, or before
+    replacing a less severe record when sampling. The listener
+    logs how many records were dropped.
+    """
+
+    def __init__(
+        self,
+        handlers: list[Handler],
+        maxsize: int = 10000,
+        batch_size: int = 256,
+        overflow: str = "drop",
+        sample_rate: int = 10,
+        overflow_level: Union[int, str] = logging.WARNING,
+        overflow_timeout: float = 0.05,
+    ):
+        if overflow not in ("drop", "sample"):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        super().__init__(queue.Queue(maxsize))
+        self.overflow = overflow
+        self.sample_rate = max(1, sample_rate)
+        if isinstance(overflow_level, str):
+            overflow_level = logging.getLevelName(overflow_level)
+        self.overflow_level = overflow_level
+        self.overflow_timeout = overflow_timeout
+        self.dropped = 0
+        self._overflowed = 0
+        self._reported = 0
+        self._lock = threading.Lock()
+        self._started = False
+        self.listener = BatchingQueueListener(
+            self.queue, *handlers, batch_size=batch_size, on_batch=self._dropped_record
+        )
+
+    def start(self):
+        if not self._started:
+            self.listener.start()
+            self._started = True
+
+    def stop(self):
+        if self._started:
+            self.listener.stop()
+            self._started = False
+
+    def flush(self):
+        if self._started:
+            self.queue.join()
+
+    def close(self):
+        # dictConfig() (Sanic runs its own) and logging.shutdown() close every
+        # existing handler; this one keeps serving its loggers until stop().
+        self.flush()
+        super().close()
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        # Resolve the args now, they may change once the caller moves on.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        if record.levelno >= self.overflow_level:
+            try:
+                self.queue.put(record, timeout=self.overflow_timeout)
+                return
+            except queue.Full:
+                pass
+            if self.overflow == "sample" and self._make_room(record.levelno):
+                try:
+                    self.queue.put_nowait(record)
+                except queue.Full:
+                    pass
+        elif self.overflow == "sample":
+            with self._lock:
+                self._overflowed += 1
+                keep = self._overflowed % self.sample_rate == 0
+            if keep and self._make_room(record.levelno):
+                # dropped the oldest record at this level or below instead
+                try:
+                    self.queue.put_nowait(record)
+                except queue.Full:
+                    pass
+        with self._lock:
+            self.dropped += 1
+
+    def _make_room(self, levelno: int) -> bool:
+        """
+        Drops the oldest of the least severe queued records if it is at or
+        below ``levelno``; False if every queued record is more severe.
+        """
+        q = self.queue
+        with q.mutex:
+            lowest, lowest_level = None, levelno + 1
+            for index, queued in enumerate(q.queue):
+                if isinstance(queued, LogRecord) and queued.levelno < lowest_level:
+                    lowest, lowest_level = index, queued.levelno
+            if lowest is None:
+                return False
+            del q.queue[lowest]
+            q.unfinished_tasks -= 1
+            if not q.unfinished_tasks:
+                q.all_tasks_done.notify_all()
+            q.not_full.notify()
+            return True
+
+    def _dropped_record(self) -> Union[LogRecord, None]:
+        dropped = self.dropped
+        if dropped == self._reported:
+            return None
+        record = logging.makeLogRecord({
+            "name": __name__,
+            "levelno": logging.WARNING,
+            "levelname": "WARNING",
+            "msg": f"Log queue overflowed, {dropped - self._reported} records dropped",
+        })
+        self._reported = dropped
+        return record
@@ -1,6 +1,14 @@
 import re
 import logging
 from logging import LogRecord
+from typing import Any
+
+# Attributes every LogRecord has; anything else on a record came from `extra`.
+_RECORD_ATTRIBUTES = frozenset(
+    vars(LogRecord("", 0, "", 0, "", None, None)).keys()
+) | {"message", "asctime"}
+
+_FORMATTER = logging.Formatter()
 
 
 class SensitiveDataFilter(logging.Filter):
@@ -8,71 +16,103 @@ class SensitiveDataFilter(logging.Filter):
     This is a class dedicated to removing sensitive information from logs.
     """
 
+    # Combined into a single alternation, so the order matters: at any given
+    # position the first pattern that matches wins, which means longer and
+    # more specific patterns have to come before the short ones.
     FILTERS = [
-        r"\b\d{3}\b",  # CVV
-        r"\b\d{4}\b",  # CVV
-        r"\b\d{16}\b",  # credit card
-        r"\b\d{15}\b",  # credit card
-        r"\b\d{9}\b",  # SSN
-        r"\b\d{3}-\d{2}-\d{4}\b",  # SSN
         r"\b\d{4}-\d{4}-\d{4}-\d{4}\b",  # credit card
         r"\d{4}-\d{4}-\d{4}-\d{4}",  # credit card
         r"\b\d{4} \d{4} \d{4} \d{4}\b",  # credit card
         r"\d{4} \d{4} \d{4} \d{4}",  # credit card
-        r"\b\d{4}\d{4}\d{4}\d{4}\b",  # credit card
-        r"\d{4}\d{4}\d{4}\d{4}",  # credit card
         r"\b^3[47][0-9]{13}$\b",  # AMEX
         r"\b^4[0-9]{12}(?:[0-9]{3})?$\b",  # VISA
         r"\b^5[1-5][0-9]{14}$\b",  # MC
         r"\b^6(?:011|5[0-9]{2})[0-9]{12}$\b",  # Discover
         r"\b^(?:5[0678]\d\d|6304|6390|67\d\d)\d{8,15}$\b",  # maestro card
+        r"\b\d{4}\d{4}\d{4}\d{4}\b",  # credit card
+        r"\d{4}\d{4}\d{4}\d{4}",  # credit card
+        r"\b\d{16}\b",  # credit card
+        r"\b\d{15}\b",  # credit card
+        r"\b\d{3}-\d{2}-\d{4}\b",  # SSN
+        r"\b\d{9}\b",  # SSN
+        r"\b\d{4}\b",  # CVV
+        r"\b\d{3}\b",  # CVV
     ]
 
+    # Every pattern starts on a digit, so the lookahead lets the engine skip
+    # other positions without trying each alternative.
+    PATTERN = re.compile(
+        r"(?=\d)(?:" + "|".join(f"(?:{a_filter})" for a_filter in FILTERS) + ")"
+    )
+
+    REPLACEMENT = "[REDACTED]"
+
+    # An `extra` field left unmasked, for ids the caller logs on purpose
+    # (references, gateway transaction ids) that look like the numbers above.
+    # Only ever put ids in it.
+    IDENTIFIERS = "identifiers"
+
     def filter(self, record: LogRecord) -> bool:
         """
         Modify the log record to mask sensitive data
 
+        The message is merged with its args first so that both are masked,
+        then any `extra` fields except IDENTIFIERS, the exception text and the
+        stack info.
+
         Args:
             record: LogRecord
 
         Returns:
             bool
         """
-        record.msg = self.mask_sensitive_data(record.msg)
+        try:
+            message = record.getMessage()
+        except Exception:
+            # leave the args alone so the handler can report the bad format
+            message = record.msg
+        else:
+            record.args = None
+        record.msg = self.mask_sensitive_data(message)
+
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key != self.IDENTIFIERS:
+                record.__dict__[key] = self._mask_value(value)
+
+        if record.exc_info:
+            # formatters only render exc_info when exc_text is empty
+            record.exc_text = self.mask_sensitive_data(
+                _FORMATTER.formatException(record.exc_info)
+            )
+            record.exc_info = None
+        elif record.exc_text:
+            record.exc_text = self.mask_sensitive_data(record.exc_text)
+        if record.stack_info:
+            record.stack_info = self.mask_sensitive_data(record.stack_info)
         return True
 
-    def mask_sensitive_data(self, message: str) -> str:
+    def mask_sensitive_data(self, message: Any) -> str:
         """
         Implementation of logic to mask or modify sensitive data.
 
         Args:
-            message: str
+            message: Any
 
         Returns:
             str
         """
-        r = str(message)
-        for a_filter in self.FILTERS:
-            result = self.replace_if_pattern_exists_in_message(a_filter, str(r))
-            if result:
-                r = result
+        return self.PATTERN.sub(self.REPLACEMENT, str(message))
 
-        return r
-
-    @staticmethod
-    def replace_if_pattern_exists_in_message(pattern: str, message: str) -> str | None:
-        """
-        Determines if a given message contains a regular expression pattern.
-
-        Args:
-            pattern: str
-            message: str
-
-        Returns:
-            str | None
-        """
-        compiled_pattern = re.compile(pattern)
-        if bool(re.search(compiled_pattern, message)):
-            return compiled_pattern.sub("[REDACTED]", message)
-        else:
-            return None
+    def _mask_value(self, value: Any) -> Any:
+        if isinstance(value, str):
+            return self.mask_sensitive_data(value)
+        if isinstance(value, dict):
+            return {k: self._mask_value(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._mask_value(v) for v in value]
+        if isinstance(value, tuple):
+            return tuple(self._mask_value(v) for v in value)
+        if isinstance(value, int) and not isinstance(value, bool):
+            masked = self.mask_sensitive_data(value)
+            return value if masked == str(value) else masked
+        return value
@@ -2,10 +2,15 @@
 A lumberjack deals with logs.
 """
 import os
+import atexit
 import logging
 import logging.config
+import threading
+from functools import lru_cache
 from logging import Logger
+from typing import Union
 
+from service.packages.lumberjack.AsyncQueueHandler import AsyncQueueHandler
 from service.packages.lumberjack.SensitiveDataFilter import SensitiveDataFilter
 
 LOGGER_DEFAULT_NAME = "AppLogger"
@@ -47,15 +52,110 @@ LOGGING = {
             "level": "INFO",
         },
     },
+    # Not part of the dictConfig schema. When enabled, the loggers above hand
+    # their records to an AsyncQueueHandler and their handlers (with filters
+    # and formatters) run on a listener thread instead of the caller's.
+    "queue": {
+        "enabled": os.getenv("LOG_ASYNC", "false").lower() in ("1", "true", "yes"),
+        "maxsize": int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+        "batch_size": 256,
+        "overflow": os.getenv("LOG_QUEUE_OVERFLOW", "drop"),
+        "sample_rate": 10,
+        "overflow_level": "WARNING",
+    },
 }
 
+_queue_handlers: list[AsyncQueueHandler] = []
+
+
+def _install_queue(config: dict):
+    """
+    Moves the configured loggers' handlers behind queue handlers, one per
+    distinct set of handlers.
+    """
+    options = dict(config.get("queue") or {})
+    if not options.pop("enabled", False):
+        return
+    by_targets: dict[tuple, AsyncQueueHandler] = {}
+    for name in config.get("loggers", {}):
+        logger = logging.getLogger(name)
+        targets = tuple(logger.handlers)
+        if not targets:
+            continue
+        handler = by_targets.get(targets)
+        if handler is None:
+            handler = AsyncQueueHandler(list(targets), **options)
+            handler.start()
+            by_targets[targets] = handler
+            _queue_handlers.append(handler)
+        for target in targets:
+            logger.removeHandler(target)
+        logger.addHandler(handler)
+
+
+def _stop_queue():
+    while _queue_handlers:
+        _queue_handlers.pop().stop()
+
+
+atexit.register(_stop_queue)
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure(force: bool = False):
+    """
+    Applies LOGGING once per process; later calls are no-ops unless forced.
+
+    Args:
+        force: rebuild handlers, filters and formatters even if configured
+    """
+    global _configured
+    with _configure_lock:
+        if _configured and not force:
+            return
+        _stop_queue()
+        logging.config.dictConfig(LOGGING)
+        _install_queue(LOGGING)
+        _configured = True
+
 
-def get_logger() -> Logger:
+def set_level(new_level: Union[int, str]):
     """
-    Returns our default AppLogger class.
+    Changes the AppLogger level at runtime without reconfiguring handlers.
+
+    Args:
+        new_level: a level number (as in LOG_LEVEL) or name
+    """
+    if isinstance(new_level, str) and new_level.isdigit():
+        new_level = int(new_level)
+    if isinstance(new_level, int):
+        new_level = logging.getLevelName(new_level)
+    LOGGING["loggers"][LOGGER_DEFAULT_NAME]["level"] = new_level
+    logging.getLogger(LOGGER_DEFAULT_NAME).setLevel(new_level)
+
+
+@lru_cache(maxsize=None)
+def _logger(name: Union[str, None]) -> Logger:
+    if name is None:
+        return logging.getLogger(LOGGER_DEFAULT_NAME)
+    return logging.getLogger(LOGGER_DEFAULT_NAME).getChild(name)
+
+
+def get_logger(name: Union[str, None] = None) -> Logger:
+    """
+    Returns our default AppLogger class, or a child of it.
+
+    Logging is configured on the first call only.
+
+    Args:
+        name: optional child logger name, e.g. "settlement"
 
     Returns:
         Logger
     """
-    logging.config.dictConfig(LOGGING)
-    return logging.getLogger(LOGGER_DEFAULT_NAME)
+    if not _configured:
+        configure()
+    return _logger(name)
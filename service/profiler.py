@@ -0,0 +1,260 @@
+"""
+On-demand sampling profiler and the ``/admin/profile`` endpoint.
+
+    curl -H "Authorization: Bearer $ADMIN_TOKEN" \\
+        "http://service/admin/profile?seconds=30&route=sale&format=speedscope"
+
+While a profile runs, a thread samples the stacks of the worker's threads
+every ``interval`` seconds with ``sys._current_frames()``, so the code being
+profiled is not instrumented and nothing is paid when no profile runs beyond
+one flag check per request and per executor call.
+
+Only threads doing request work are sampled: the event loop while a
+request's task is running on it, and executor threads while they run a call.
+Each sample is attributed to the route the work is for (``background`` for
+work no request started, such as scheduled batch closes), which is the root
+frame of every stack, and ``route=`` keeps only one route's samples. The
+sampler needs the GIL to take a sample, so it sees the event loop when the
+loop lets go of it: stretches of loop work shorter than the interpreter's
+switch interval (5 ms) between two waits for I/O are under-sampled.
+
+The answer is collapsed stacks (``route;frame;frame count`` lines, for
+flamegraph.pl and most flame graph tools) or, with ``format=speedscope``, a
+speedscope profile. A request profiles the worker that serves it; with
+several workers, each profile covers one of them, named by ``pid``.
+"""
+import asyncio
+import hmac
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from types import CodeType, FrameType
+from typing import Any, Iterator, Union
+from weakref import WeakKeyDictionary
+
+from sanic import HTTPResponse, Request
+from sanic.blueprints import Blueprint
+from sanic.exceptions import BadRequest, NotFound, SanicException, Unauthorized
+
+from service.metrics import current_route, route_name
+
+BACKGROUND = "background"
+
+Stack = tuple[str, ...]
+
+# request task -> route, and executor thread id -> route, while a profile runs
+_task_routes: "WeakKeyDictionary[asyncio.Task, str]" = WeakKeyDictionary()
+_thread_routes: dict[int, str] = {}
+
+
+class ProfileRunning(SanicException):
+    """Only one profile runs in a worker at a time."""
+    status_code = 409
+    quiet = True
+
+
+class Sampler:
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        loop_thread: int,
+        interval: float = 0.01,
+        route: Union[str, None] = None,
+    ):
+        self.loop = loop
+        self.loop_thread = loop_thread
+        self.interval = interval
+        self.route = route
+        self.stacks: Counter[Stack] = Counter()
+        self.samples = 0
+        self._labels: dict[CodeType, str] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                route = self._route_of(thread_id)
+                if route is None or (self.route is not None and route != self.route):
+                    continue
+                self.stacks[(route,) + self._stack(frame)] += 1
+                self.samples += 1
+
+    def _route_of(self, thread_id: int) -> Union[str, None]:
+        if thread_id == self.loop_thread:
+            task = asyncio.current_task(self.loop)
+            if task is None:
+                return None  # waiting for I/O
+            return _task_routes.get(task, BACKGROUND)
+        route = _thread_routes.get(thread_id)
+        if route is None:
+            return None  # not running a call
+        return route or BACKGROUND
+
+    def _stack(self, frame: Union[FrameType, None]) -> Stack:
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = f"{code.co_name} ({_short(code.co_filename)}:{code.co_firstlineno})"
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        return tuple(labels)
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def speedscope(self, name: str) -> dict[str, Any]:
+        frames: list[dict[str, Any]] = []
+        index: dict[str, int] = {}
+        samples, weights = [], []
+        for stack, count in self.stacks.items():
+            sample = []
+            for label in stack:
+                if label not in index:
+                    index[label] = len(frames)
+                    frames.append({"name": label})
+                sample.append(index[label])
+            samples.append(sample)
+            weights.append(count * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "globalpayments-service",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+_sampler: Union[Sampler, None] = None
+
+
+def _short(filename: str) -> str:
+    """
+    ``filename`` relative to site-packages or the working directory.
+    """
+    _, found, tail = filename.rpartition("site-packages/")
+    if found:
+        return tail
+    cwd = os.getcwd() + os.sep
+    return filename[len(cwd):] if filename.startswith(cwd) else filename
+
+
+async def track(request: Request):
+    """
+    Request middleware: attributes the request's task to its route.
+    """
+    if _sampler is not None:
+        task = asyncio.current_task()
+        if task is not None:
+            _task_routes[task] = route_name(request)
+
+
+@contextmanager
+def attributed() -> Iterator[None]:
+    """
+    Attributes the calling (executor) thread to the current route.
+    """
+    if _sampler is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    _thread_routes[thread_id] = current_route.get()
+    try:
+        yield
+    finally:
+        _thread_routes.pop(thread_id, None)
+
+
+async def profile(
+    seconds: float, interval: float = 0.01, route: Union[str, None] = None
+) -> Sampler:
+    """
+    Samples this worker for ``seconds``; call from the event loop.
+
+    Raises:
+        ProfileRunning: a profile is already running in this worker
+    """
+    global _sampler
+    if _sampler is not None:
+        raise ProfileRunning("A profile is already running in this worker")
+    sampler = Sampler(asyncio.get_running_loop(), threading.get_ident(), interval, route)
+    _sampler = sampler
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        _sampler = None
+        sampler.stop()
+        _task_routes.clear()
+        _thread_routes.clear()
+    return sampler
+
+
+bp = Blueprint("Admin", url_prefix="/admin")
+
+
+def _authorize(request: Request):
+    token = str(request.app.config.ADMIN_TOKEN)
+    if not token:
+        raise NotFound("Not found")
+    given = request.headers.get("authorization", "")
+    if not hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+        raise Unauthorized("Admin token required", scheme="Bearer")
+
+
+@bp.get("/profile")
+async def profile_worker(request: Request):
+    """
+    Profiles this worker for ``seconds`` (default 10) and answers with its
+    samples; ``route`` keeps one route's, ``interval`` is the sampling
+    period and ``format`` is ``collapsed`` (default) or ``speedscope``.
+    """
+    _authorize(request)
+    try:
+        seconds = float(request.args.get("seconds", 10.0))
+        interval = max(float(request.args.get("interval", request.app.config.PROFILE_INTERVAL)), 0.001)
+    except ValueError as e:
+        raise BadRequest(f"Invalid profile parameter: {e}")
+    seconds = min(max(seconds, 0.0), float(request.app.config.PROFILE_MAX_SECONDS))
+    output = request.args.get("format", "collapsed")
+    if output not in ("collapsed", "speedscope"):
+        raise BadRequest(f"Unknown profile format: {output}")
+    route = request.args.get("route") or None
+
+    sampler = await profile(seconds, interval, route)
+    name = f"pid {os.getpid()} {route or 'all routes'} {seconds:g}s"
+    headers = {"X-Profile-Samples": str(sampler.samples), "X-Profile-Pid": str(os.getpid())}
+    if output == "speedscope":
+        return HTTPResponse(
+            json.dumps(sampler.speedscope(name)),
+            headers=headers,
+            content_type="application/json",
+        )
+    return HTTPResponse(sampler.collapsed(), headers=headers, content_type="text/plain")
@@ -0,0 +1,371 @@
+"""
+Batch closes as background jobs.
+
+``/settle`` used to close the batch inside the request, and several callers
+settling the same merchant at once each closed it again. Now a close is a job:
+jobs live in a SQLite file shared by every worker on the host, and at most one
+job per merchant runs at a time, so a second ``/settle`` for that merchant
+gets the running job back instead of starting another close. Callers can wait
+for the result or poll ``/settle/<job_id>``.
+
+Merchants can also be settled on a daily schedule (SETTLE_SCHEDULE_PATH);
+only the worker holding SETTLE_LOCK_PATH runs it.
+"""
+import asyncio
+import fcntl
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, IO, Union
+from uuid import uuid4
+
+from sanic.exceptions import SanicException
+
+from service.business.containers import merchant_id
+from service.business.params import HeartlandParams
+from service.business.results import batch_summary
+from service.json_util import ignore_properties
+from service.metrics import SETTLE_JOBS
+from service.packages.lumberjack import get_logger
+
+logger = get_logger()
+
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class SettlementFailed(SanicException):
+    """A batch close started by another worker failed."""
+    status_code = 502
+    quiet = True
+
+
+@dataclass
+class SettleJob:
+    job_id: str
+    merchant: str
+    trigger: str
+    status: str
+    created: float
+    finished: Union[float, None] = None
+    result: Union[dict[str, str], None] = None
+    error: Union[str, None] = None
+
+
+class SettlementJobs:
+    """
+    Settle jobs in a SQLite file. A unique index on the merchant of running
+    jobs makes ``create`` single-flight across workers; a running job older
+    than ``stale_after`` seconds was left by a worker that died and is marked
+    failed.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 86400.0, stale_after: float = 140.0):
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS settle_jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " merchant TEXT NOT NULL,"
+            " trigger TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " finished REAL,"
+            " result TEXT,"
+            " error TEXT)"
+        )
+        self._db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS settle_jobs_running"
+            f" ON settle_jobs (merchant) WHERE status = '{RUNNING}'"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS settle_jobs_merchant ON settle_jobs (merchant, created)"
+        )
+
+    def create(self, merchant: str, trigger: str) -> tuple[SettleJob, bool]:
+        """
+        Starts a job for ``merchant``, or returns the one already running.
+
+        Returns:
+            the job, and whether it was created by this call
+        """
+        job_id = uuid4().hex
+        while True:
+            now = time.time()
+            with self._lock:
+                self._db.execute(
+                    "UPDATE settle_jobs SET status = ?, finished = ?, error = ?"
+                    " WHERE merchant = ? AND status = ? AND created <= ?",
+                    (FAILED, now, "abandoned", merchant, RUNNING, now - self.stale_after),
+                )
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO settle_jobs (job_id, merchant, trigger, status, created)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (job_id, merchant, trigger, RUNNING, now),
+                )
+                row = self._db.execute(
+                    "SELECT * FROM settle_jobs WHERE merchant = ? AND status = ?",
+                    (merchant, RUNNING),
+                ).fetchone()
+            # None: the running job finished in between, so try again
+            if row is not None:
+                return self._job(row), cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Union[SettleJob, None]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM settle_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return None if row is None else self._job(row)
+
+    def last_settled(self, merchant: str) -> Union[tuple[float, float], None]:
+        """
+        When the merchant's last successful close started and finished.
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT created, finished FROM settle_jobs"
+                " WHERE merchant = ? AND status = ? ORDER BY created DESC LIMIT 1",
+                (merchant, SUCCEEDED),
+            ).fetchone()
+
+    def finish(self, job_id: str, result: dict[str, str]):
+        self._update(job_id, SUCCEEDED, json.dumps(result), None)
+
+    def fail(self, job_id: str, error: str):
+        self._update(job_id, FAILED, None, error)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _update(self, job_id: str, status: str, result: Union[str, None], error: Union[str, None]):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE settle_jobs SET status = ?, finished = ?, result = ?, error = ?"
+                " WHERE job_id = ? AND status = ?",
+                (status, now, result, error, job_id, RUNNING),
+            )
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self._db.execute(
+                    "DELETE FROM settle_jobs WHERE status != ? AND finished <= ?",
+                    (RUNNING, now - self.ttl),
+                )
+
+    @staticmethod
+    def _job(row: tuple) -> SettleJob:
+        job_id, merchant, trigger, status, created, finished, result, error = row
+        return SettleJob(
+            job_id=job_id,
+            merchant=merchant,
+            trigger=trigger,
+            status=status,
+            created=created,
+            finished=finished,
+            result=None if result is None else json.loads(result),
+            error=error,
+        )
+
+
+@dataclass(frozen=True)
+class ScheduledSettle:
+    """A merchant settled every day at ``hour``:``minute`` UTC."""
+    params: HeartlandParams
+    hour: int
+    minute: int
+
+    def next_due(self, now: float) -> float:
+        """
+        The first time after ``now`` this merchant is due.
+        """
+        today = datetime.fromtimestamp(now, timezone.utc).replace(
+            hour=self.hour, minute=self.minute, second=0, microsecond=0
+        )
+        due = today.timestamp()
+        return due if due > now else (today + timedelta(days=1)).timestamp()
+
+
+def load_schedule(path: str) -> list[ScheduledSettle]:
+    """
+    Reads a JSON list of ``{"params": {...}, "at": "HH:MM"}`` entries. The
+    file holds merchant credentials: keep it readable by the service only.
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    schedule = []
+    for entry in entries:
+        hour, minute = (int(part) for part in str(entry["at"]).split(":"))
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f"Invalid settle time: {entry['at']}")
+        schedule.append(ScheduledSettle(ignore_properties(HeartlandParams, entry["params"]), hour, minute))
+    return schedule
+
+
+class SettlementScheduler:
+    """
+    Runs batch closes as jobs, on request and on the schedule.
+
+    ``close_batch(params)`` closes the merchant's batch and returns the SDK
+    result; it is awaited on the event loop, so it should hand the blocking
+    work to the payments executor.
+    """
+
+    def __init__(
+        self,
+        jobs: SettlementJobs,
+        close_batch: Callable[[HeartlandParams], Awaitable[Any]],
+        schedule: Union[list[ScheduledSettle], None] = None,
+        lock_path: Union[str, None] = None,
+        poll_interval: float = 0.5,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.jobs = jobs
+        self.close_batch = close_batch
+        self.schedule = schedule or []
+        self.lock_path = lock_path
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._schedule_task: Union[asyncio.Task, None] = None
+        self._lock_file: Union[IO, None] = None
+
+    @classmethod
+    def from_config(
+        cls, config, close_batch: Callable[[HeartlandParams], Awaitable[Any]]
+    ) -> "SettlementScheduler":
+        path = str(config.SETTLE_SCHEDULE_PATH)
+        return cls(
+            SettlementJobs(
+                str(config.SETTLE_JOBS_PATH),
+                ttl=float(config.SETTLE_JOB_TTL),
+                # long enough for the executor timeout plus the queue wait
+                stale_after=2 * float(config.PAYMENTS_EXECUTOR_TIMEOUT),
+            ),
+            close_batch,
+            schedule=load_schedule(path) if path else None,
+            lock_path=str(config.SETTLE_LOCK_PATH),
+        )
+
+    def start(self):
+        """
+        Starts the schedule, if there is one; call from a running loop.
+        """
+        if self.schedule:
+            self._schedule_task = asyncio.ensure_future(self._run_schedule())
+
+    async def close(self):
+        if self._schedule_task is not None:
+            self._schedule_task.cancel()
+            self._schedule_task = None
+        # let closes in flight record their outcome
+        if self._tasks:
+            await asyncio.wait(list(self._tasks.values()))
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.jobs.close()
+
+    def submit(self, params: HeartlandParams, trigger: str = "request") -> SettleJob:
+        """
+        Starts closing the merchant's batch, unless a close for that merchant
+        is already running on any worker, in which case that job is returned.
+        """
+        job, created = self.jobs.create(merchant_id(params), trigger)
+        if created:
+            task = asyncio.ensure_future(self._execute(job, params))
+            self._tasks[job.job_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+            # the failure is recorded on the job even if nobody waits for it
+            task.add_done_callback(_log_failure)
+        else:
+            SETTLE_JOBS.inc(trigger=trigger, status="deduplicated")
+        return job
+
+    def get(self, job_id: str) -> Union[SettleJob, None]:
+        return self.jobs.get(job_id)
+
+    async def wait(self, job: SettleJob, timeout: float) -> SettleJob:
+        """
+        Waits up to ``timeout`` seconds for the job to finish and returns it,
+        still running if it did not.
+
+        Raises:
+            Exception: the close, if it ran on this worker and failed
+            SettlementFailed: the close ran on another worker and failed
+        """
+        task = self._tasks.get(job.job_id)
+        if task is not None:
+            done, _ = await asyncio.wait([task], timeout=timeout)
+            if done:
+                task.result()
+        else:
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                current = self.jobs.get(job.job_id)
+                if current is None or current.status != RUNNING:
+                    break
+                await asyncio.sleep(self.poll_interval)
+        job = self.jobs.get(job.job_id) or job
+        if job.status == FAILED and task is None:
+            raise SettlementFailed(f"Batch close failed: {job.error}")
+        return job
+
+    async def _execute(self, job: SettleJob, params: HeartlandParams):
+        try:
+            result = await self.close_batch(params)
+        except BaseException as e:
+            self.jobs.fail(job.job_id, f"{type(e).__name__}: {e}")
+            SETTLE_JOBS.inc(trigger=job.trigger, status=FAILED)
+            raise
+        self.jobs.finish(job.job_id, batch_summary(result))
+        SETTLE_JOBS.inc(trigger=job.trigger, status=SUCCEEDED)
+
+    def _lead(self) -> bool:
+        """
+        Whether this worker runs the schedule: the first to lock
+        SETTLE_LOCK_PATH does, until it exits.
+        """
+        if self._lock_file is not None:
+            return True
+        if self.lock_path is None:
+            return True
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def _run_schedule(self):
+        due = [entry.next_due(self.clock()) for entry in self.schedule]
+        while True:
+            now = self.clock()
+            for i, entry in enumerate(self.schedule):
+                if due[i] > now:
+                    continue
+                due[i] = entry.next_due(now)
+                if not self._lead():
+                    continue
+                try:
+                    self.submit(entry.params, trigger="schedule")
+                except Exception:
+                    logger.exception("Could not start a scheduled batch close")
+            await asyncio.sleep(min(60.0, max(0.0, min(due) - self.clock())))
+
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Batch close failed: {task.exception()!r}")
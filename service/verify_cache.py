@@ -0,0 +1,71 @@
+"""
+Short-lived cache of /verify results.
+
+Onboarding flows often verify the same card and address several times within
+seconds. Identical verifies in flight share one gateway call and the result is
+kept for a short TTL. The cache key is an HMAC of the card and address fields,
+so no card data is kept in memory beyond the request itself.
+"""
+import hashlib
+import hmac
+import os
+from typing import Any, Awaitable, Callable, Union
+
+from service.business.containers import merchant_id
+from service.business.functions import CreditCardDataDataclass, VerifyAddressDataClass
+from service.business.params import HeartlandParams
+from service.idempotency import IdempotencyCache, MemoryIdempotencyStore
+
+
+class VerifyCache:
+    def __init__(self, cache: IdempotencyCache, salt: bytes):
+        self.cache = cache
+        self.salt = salt
+
+    @classmethod
+    def from_config(cls, config) -> Union["VerifyCache", None]:
+        if not config.VERIFY_CACHE:
+            return None
+        # a verify moves no money, so unlike a sale a timed-out one can be
+        # retried straight away: nothing is held pending
+        store = MemoryIdempotencyStore(
+            max_entries=int(config.VERIFY_CACHE_MAX_ENTRIES),
+            ttl=float(config.VERIFY_CACHE_TTL),
+            pending_ttl=0.0,
+        )
+        # without a configured salt, keys are only comparable within a worker,
+        # which is all the in-memory store needs
+        salt = str(config.VERIFY_CACHE_SALT).encode() or os.urandom(32)
+        return cls(IdempotencyCache(store), salt)
+
+    def key(
+        self,
+        params: HeartlandParams,
+        card: CreditCardDataDataclass,
+        address: Union[VerifyAddressDataClass, None],
+    ) -> str:
+        fields = [
+            card.number, card.exp_month, card.exp_year, card.cvn, card.zip_code,
+        ]
+        if address is not None:
+            fields += [
+                address.street_address_1,
+                address.street_address_2,
+                address.street_address_3,
+                address.city,
+                address.province,
+                address.postal_code,
+            ]
+        message = "\0".join("" if field is None else str(field) for field in fields)
+        digest = hmac.new(self.salt, message.encode(), hashlib.sha256).hexdigest()
+        return f"verify:{merchant_id(params)}:{digest}"
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the cached result for ``key``, or awaits ``call()`` once for
+        every identical verify in flight and caches what it returns.
+        """
+        return await self.cache.run(key, call)
+
+    def close(self):
+        self.cache.close()
@@ -1,4 +1,4 @@
-from json import dumps
+from json import dumps, loads
 from uuid import uuid4
 
 import pytest
@@ -49,6 +49,7 @@ async def test_app_home_route(testing_app):
 async def test_sale(testing_app):
     request_body: str = dumps(SaleRequestInput(
         amount=float("3.33"),
+        zip_code=None,
         credit_card_data=CREDIT_CARD_DATA,
         params=HEARTLAND_PARAMS,
         reference=uuid4(),
@@ -66,6 +67,7 @@ async def test_sale(testing_app):
 async def test_authorize(testing_app):
     request_body: str = dumps(SaleRequestInput(
         amount=float("3.33"),
+        zip_code=None,
         credit_card_data=CREDIT_CARD_DATA,
         params=HEARTLAND_PARAMS,
         reference=uuid4(),
@@ -83,6 +85,7 @@ async def test_authorize(testing_app):
 async def test_settle(testing_app):
     request_body: str = dumps(SaleRequestInput(
         amount=float("3.33"),
+        zip_code=None,
         credit_card_data=CREDIT_CARD_DATA,
         params=HEARTLAND_PARAMS,
         reference=uuid4(),
@@ -113,3 +116,126 @@ async def test_refund(testing_app):
         content=request_body.encode("utf-8")
     )
     assert sanic[1].status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_batch(testing_app):
+    request_body: str = dumps({
+        "params": HEARTLAND_PARAMS,
+        "qa": True,
+        "operations": [
+            {"operation": "sale", "amount": 3.33, "zip_code": None,
+             "credit_card_data": CREDIT_CARD_DATA, "reference": uuid4()},
+            {"operation": "settle"},
+            {"operation": "refund", "heartland_transaction_id": "None",
+             "payment_transaction_amount": "None", "amount": 3.33},
+        ],
+    }, cls=EnhancedJSONEncoder)
+
+    sanic: SanicTuple = await testing_app.asgi_client.post(
+        "/api/heartland/batch",
+        content=request_body.encode("utf-8")
+    )
+    assert sanic[1].status_code == 200
+    results = sanic[1].json["results"]
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert [r["status"] for r in results] == ["ok", "error", "ok"]
+    assert results[0]["result"]["params"]["url"] == HEARTLAND_PARAMS.url
+
+
+@pytest.mark.asyncio
+async def test_batch_stream(testing_app):
+    request_body: str = dumps({
+        "params": HEARTLAND_PARAMS,
+        "operations": [
+            {"operation": "void", "heartland_transaction_id": str(i),
+             "payment_transaction_amount": "1.00"}
+            for i in range(5)
+        ],
+    }, cls=EnhancedJSONEncoder)
+
+    sanic: SanicTuple = await testing_app.asgi_client.post(
+        "/api/heartland/batch?stream=true",
+        content=request_body.encode("utf-8")
+    )
+    assert sanic[1].status_code == 200
+    lines = [loads(line) for line in sanic[1].text.splitlines()]
+    assert sorted(line["index"] for line in lines) == list(range(5))
+    assert all(line["status"] == "ok" for line in lines)
+
+
+@pytest.mark.asyncio
+async def test_echo_returns_the_request_as_an_object(testing_app):
+    reference = uuid4()
+    request_body: str = dumps(SaleRequestInput(
+        amount=float("3.33"),
+        zip_code="75024",
+        credit_card_data=CREDIT_CARD_DATA,
+        params=HEARTLAND_PARAMS,
+        reference=reference,
+        qa=True,
+    ), cls=EnhancedJSONEncoder)
+
+    sanic: SanicTuple = await testing_app.asgi_client.post(
+        "/api/heartland/sale",
+        content=request_body.encode("utf-8")
+    )
+    assert sanic[1].status_code == 200
+    assert sanic[1].json["reference"] == str(reference)
+    assert sanic[1].json["params"]["constants"] == {"default_currency": "USD"}
+
+
+@pytest.mark.asyncio
+async def test_job_upload_and_results(testing_app):
+    request_body: str = dumps({"params": HEARTLAND_PARAMS, "concurrency": 2}, cls=EnhancedJSONEncoder)
+    sanic: SanicTuple = await testing_app.asgi_client.post(
+        "/api/heartland/jobs", content=request_body.encode("utf-8")
+    )
+    assert sanic[1].status_code == 201
+    job_id = sanic[1].json["job_id"]
+
+    rows = "operation,heartland_transaction_id,payment_transaction_amount\n" + "".join(
+        f"void,{i},1.00\n" for i in range(4)
+    ) + "bounce,4,1.00\n"
+    sanic = await testing_app.asgi_client.put(
+        f"/api/heartland/jobs/{job_id}/input",
+        content=rows.encode("utf-8"),
+        headers={"content-type": "text/csv"},
+    )
+    # the params are not kept with the job, so they come with the upload
+    assert sanic[1].status_code == 400
+
+    sanic = await testing_app.asgi_client.put(
+        f"/api/heartland/jobs/{job_id}/input",
+        content=rows.encode("utf-8"),
+        headers={
+            "content-type": "text/csv",
+            "x-job-params": dumps(HEARTLAND_PARAMS, cls=EnhancedJSONEncoder),
+        },
+    )
+    assert sanic[1].status_code == 200
+    assert sanic[1].json["done"]
+
+    sanic = await testing_app.asgi_client.get(f"/api/heartland/jobs/{job_id}/results")
+    lines = [loads(line) for line in sanic[1].text.splitlines()]
+    assert [line["line"] for line in lines] == list(range(5))
+    assert [line["status"] for line in lines] == ["ok"] * 4 + ["error"]
+
+
+@pytest.mark.asyncio
+async def test_invalid_deadline_header_is_rejected(testing_app):
+    request_body: str = dumps(SaleRequestInput(
+        amount=float("3.33"),
+        zip_code="75024",
+        credit_card_data=CREDIT_CARD_DATA,
+        params=HEARTLAND_PARAMS,
+        reference=uuid4(),
+        qa=True,
+    ), cls=EnhancedJSONEncoder)
+
+    sanic: SanicTuple = await testing_app.asgi_client.post(
+        "/api/heartland/sale",
+        content=request_body.encode("utf-8"),
+        headers={"X-Request-Deadline": "soon", "accept": "application/json"},
+    )
+    assert sanic[1].status_code == 400
@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from python_sdk.globalpayments.api.entities.exceptions import GatewayException
+
+from service.business import exchange
+from service.business.async_transport import AsyncTransport
+from service.business.transport import PooledTransport
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        reply = b"<PosResponse>" + body + b"</PosResponse>"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Gateway:
+    content_type = "text/xml; charset=UTF-8"
+    headers = {}
+
+    def __init__(self, service_url):
+        self.service_url = service_url
+
+
+@pytest.fixture
+def gateway_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _operation(gateway):
+    """Two round trips, like a void that falls back to a refund."""
+    first = gateway.send_request("POST", "", "<Void/>")
+    second = gateway.send_request("POST", "", "<Refund/>")
+    return first.status_code, first.response_text, second.response_text
+
+
+@pytest.mark.asyncio
+async def test_async_transport_matches_sync(gateway_url):
+    sync = PooledTransport()
+    gateway = sync.install(_Gateway(gateway_url))
+    expected = _operation(gateway)
+
+    async_transport = AsyncTransport()
+    await async_transport.start()
+    try:
+        assert await async_transport.run(lambda: _operation(gateway)) == expected
+    finally:
+        await async_transport.close()
+    assert expected[1] == "<PosResponse><Void/></PosResponse>"
+
+
+@pytest.mark.asyncio
+async def test_send_errors_are_raised_inside_the_operation():
+    gateway = PooledTransport().install(_Gateway("http://127.0.0.1:9"))
+    async_transport = AsyncTransport(retries=0)
+    await async_transport.start()
+
+    def operation():
+        try:
+            gateway.send_request("POST", "", "<Void/>")
+        except GatewayException:
+            return "fell back"
+
+    try:
+        assert await async_transport.run(operation) == "fell back"
+    finally:
+        await async_transport.close()
+
+
+@pytest.mark.asyncio
+async def test_exchange_limits_requests():
+    unwound = []
+
+    def operation():
+        try:
+            while True:
+                exchange.current_exchange().send(exchange.GatewayRequest("POST", "x", {}, None))
+        finally:
+            unwound.append(True)
+
+    async def send(request):
+        return None
+
+    with pytest.raises(RuntimeError):
+        await exchange.run(operation, send, max_requests=2)
+    assert unwound == [True]
+
+
+@pytest.mark.asyncio
+async def test_operations_run_once_around_their_requests():
+    steps = []
+    route = contextvars.ContextVar("route", default=None)
+
+    def operation():
+        steps.append(("before", route.get()))
+        first = exchange.current_exchange().send(exchange.GatewayRequest("POST", "void", {}, None))
+        steps.append(("between", first))
+        second = exchange.current_exchange().send(exchange.GatewayRequest("POST", "refund", {}, None))
+        steps.append(("after", second))
+        return "done"
+
+    async def send(request):
+        await asyncio.sleep(0)
+        return request.url
+
+    route.set("refund")
+    assert await exchange.run(operation, send) == "done"
+    assert steps == [("before", "refund"), ("between", "void"), ("after", "refund")]
+    assert exchange.current_exchange() is None
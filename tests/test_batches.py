@@ -0,0 +1,170 @@
+import time
+
+import pytest
+
+from python_sdk.globalpayments.api.entities.exceptions import GatewayException
+
+from service.business import functions
+from service.business.batches import CLOSED, OPEN, UNKNOWN, BatchTracker, batches
+from service.business.containers import merchant_id
+from service.business.functions import OnlinePayments
+from service.business.params import Constants, HeartlandParams
+
+PARAMS = HeartlandParams(
+    url="https://cert.api2.heartlandportico.com",
+    public_key="None",
+    private_key="skapi_cert_batches",
+    term_id="None",
+    cert_str="None",
+    account_num="None",
+    developer_id="000000",
+    version_number="None",
+    username="None",
+    password="None",
+    constants=Constants(default_currency="USD"),
+)
+
+
+def test_state_follows_batch_closes():
+    tracker = BatchTracker()
+    tracker.seen("m", "1")
+    assert tracker.state("m", "1") == OPEN
+    assert tracker.state("m", "2") == UNKNOWN
+    assert tracker.state("other", "1") == UNKNOWN
+
+    now = time.time()
+    tracker.settled("m", now + 1, now + 2)
+    assert tracker.state("m", "1") == CLOSED
+
+
+def test_closes_on_other_workers_are_read_back():
+    tracker = BatchTracker()
+    tracker.seen("m", "1")
+    tracker.last_settled = lambda merchant: (time.time() + 1, time.time() + 2)
+    assert tracker.state("m", "1") == CLOSED
+
+
+def test_transactions_seen_while_closing_are_unknown():
+    tracker = BatchTracker()
+    tracker.settled("m", time.time() - 1, time.time() + 60)
+    tracker.seen("m", "1")
+    assert tracker.state("m", "1") == UNKNOWN
+
+
+def test_failed_void_closes_earlier_transactions():
+    tracker = BatchTracker()
+    tracker.seen("m", "1")
+    tracker.seen("m", "2")
+    tracker.closed("m", "2")
+    assert tracker.state("m", "1") == CLOSED
+
+
+class FakeBuilder:
+    def __init__(self, calls, name, error=None):
+        self.calls, self.name, self.error = calls, name, error
+
+    def with_currency(self, currency):
+        return self
+
+    def execute(self):
+        self.calls.append(self.name)
+        if self.error is not None:
+            raise self.error
+        return object()
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    calls = []
+    state = {"void_error": None}
+
+    class FakeTransaction:
+        @staticmethod
+        def from_id(transaction_id):
+            return FakeTransaction()
+
+        def void(self):
+            return FakeBuilder(calls, "void", state["void_error"])
+
+        def refund(self, amount):
+            return FakeBuilder(calls, "refund")
+
+    monkeypatch.setattr(functions, "Transaction", FakeTransaction)
+    batches.clear()
+    yield calls, state
+    batches.clear()
+
+
+def refund(transaction_id):
+    OnlinePayments(PARAMS, reference=None).refund(transaction_id, "10.00", None)
+
+
+def test_refund_after_close_skips_the_void(gateway):
+    calls, _ = gateway
+    batches.seen(merchant_id(PARAMS), "1")
+    batches.settled(merchant_id(PARAMS), time.time() + 1, time.time() + 2)
+    refund("1")
+    assert calls == ["refund"]
+
+
+SETTLED = GatewayException("Unexpected Gateway Response: 3", "3")
+
+
+def test_refund_of_unknown_transaction_falls_back(gateway):
+    calls, state = gateway
+    state["void_error"] = SETTLED
+    refund("2")
+    assert calls == ["void", "refund"]
+
+
+def test_only_a_settled_void_closes_the_batch(gateway):
+    calls, state = gateway
+    merchant = merchant_id(PARAMS)
+    batches.seen(merchant, "1")
+    batches.seen(merchant, "2")
+
+    state["void_error"] = GatewayException("Error occurred while communicating with gateway.")
+    with pytest.raises(GatewayException):
+        refund("2")
+    assert calls == ["void"]
+
+    state["void_error"] = GatewayException("Unexpected Gateway Response: 1", "1")
+    refund("2")
+    assert batches.state(merchant, "1") == OPEN
+
+    state["void_error"] = SETTLED
+    refund("2")
+    assert batches.state(merchant, "1") == CLOSED
+
+
+def test_only_sales_and_captures_join_the_batch(monkeypatch):
+    class FakeCharge:
+        def __init__(self, transaction_id):
+            self.transaction_id = transaction_id
+
+        def with_currency(self, currency):
+            return self
+
+        def with_client_transaction_id(self, reference):
+            return self
+
+        def execute(self):
+            return type("Result", (), {"transaction_id": self.transaction_id})()
+
+    class FakeCard:
+        cvn = None
+
+        def charge(self, amount):
+            return FakeCharge("sale")
+
+        def authorize(self, amount):
+            return FakeCharge("auth")
+
+    monkeypatch.setattr(functions, "extract_results", lambda transaction, projection: {})
+    batches.clear()
+    payments = OnlinePayments(PARAMS, reference=None)
+    payments.sale(1.0, FakeCard())
+    payments.authorize(1.0, FakeCard())
+    assert batches.state(merchant_id(PARAMS), "sale") == OPEN
+    assert batches.state(merchant_id(PARAMS), "auth") == UNKNOWN
+    batches.clear()
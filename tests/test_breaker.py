@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from python_sdk.globalpayments.api.entities.exceptions import GatewayException
+
+from service.breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    ConcurrencyLimiter,
+    GatewayGuard,
+    GatewayUnavailable,
+    gateway_host,
+)
+from service.business.params import Constants, HeartlandParams
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+async def _fail():
+    raise GatewayException("Error occurred while communicating with gateway.")
+
+
+async def _ok():
+    return {"response_code": "00"}
+
+
+def _guard(clock):
+    return GatewayGuard(
+        breaker=dict(min_calls=4, failure_rate=0.5, open_seconds=10.0, probes=2),
+        limiter=dict(initial=8, minimum=1),
+        clock=clock,
+    )
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_probes_and_closes():
+    clock = _Clock()
+    guard = _guard(clock)
+    for _ in range(4):
+        with pytest.raises(GatewayException):
+            await guard.run("https://gateway", _fail)
+    breaker, _ = guard.get("https://gateway")
+    assert breaker.state == OPEN
+
+    with pytest.raises(GatewayUnavailable) as rejected:
+        await guard.run("https://gateway", _ok)
+    assert rejected.value.headers["Retry-After"] == "10"
+
+    clock.now = 11.0
+    assert await guard.run("https://gateway", _ok) == {"response_code": "00"}
+    assert breaker.state == HALF_OPEN
+    await guard.run("https://gateway", _ok)
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_gateway_declines_do_not_open_the_circuit():
+    guard = _guard(_Clock())
+
+    async def declined():
+        raise GatewayException("Unexpected Gateway Response: -2", "-2")
+
+    for _ in range(10):
+        with pytest.raises(GatewayException):
+            await guard.run("https://gateway", declined)
+    assert guard.stats()["https://gateway"]["state"] == CLOSED
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker(min_calls=1, open_seconds=5.0, probes=1)
+    breaker.after(0.0, 0.1, failed=True)
+    assert breaker.state == OPEN
+    breaker.before(6.0)
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(GatewayUnavailable):
+        breaker.before(6.0)
+    breaker.after(6.5, 0.5, failed=True)
+    assert breaker.state == OPEN
+
+
+def test_limiter_backs_off_and_sheds():
+    limiter = ConcurrencyLimiter(initial=2, minimum=1, latency_threshold=1.0, backoff=0.5)
+    limiter.acquire()
+    limiter.acquire()
+    with pytest.raises(GatewayUnavailable):
+        limiter.acquire()
+    limiter.release(2.0, failed=False)
+    assert limiter.limit == 1.0
+    limiter.release(0.1, failed=False)
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_guards_are_keyed_on_the_host_and_bounded():
+    assert gateway_host("https://Cert.API2.heartlandportico.com/Hps.Exchange.PosGateway/x?y") == \
+        "cert.api2.heartlandportico.com"
+    assert gateway_host("https://user:pw@gateway:8443/a") == "gateway:8443"
+
+    params = HeartlandParams(
+        url="https://GATEWAY/one", public_key="", private_key="k", term_id="", cert_str="",
+        account_num="", developer_id="", version_number="", username="", password="",
+        constants=Constants(default_currency="USD"),
+    )
+    guard = GatewayGuard(max_entries=2)
+    other_path = HeartlandParams(**{**params.__dict__, "url": "https://gateway/two"})
+    assert guard.key(params) == guard.key(other_path) == "gateway"
+
+    started = asyncio.Event()
+    finish = asyncio.Event()
+
+    async def slow():
+        started.set()
+        await finish.wait()
+        return {"response_code": "00"}
+
+    busy = asyncio.ensure_future(guard.run("busy", slow))
+    await started.wait()
+    for i in range(10):
+        await guard.run(f"host{i}", _ok)
+    # bounded, and the guard with a call in flight is kept
+    assert set(guard.stats()) == {"busy", "host9"}
+    finish.set()
+    await busy
@@ -0,0 +1,113 @@
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from python_sdk.globalpayments.api.entities.exceptions import GatewayException
+
+from service.business.cassette import RECORD, REPLAY, Cassette, request_key
+from service.business.exchange import GatewayRequest
+from service.business.transport import PooledTransport
+
+SALE = (
+    "<soap:Envelope><soap:Body><PosRequest><Ver1.0><Header>"
+    "<SecretAPIKey>skapi_cert_secret</SecretAPIKey></Header>"
+    "<Transaction><CreditSale><Block1><Amt>10.25</Amt><CardData><ManualEntry>"
+    "<CardNbr>4111111111111111</CardNbr><ExpMonth>12</ExpMonth><ExpYear>2030</ExpYear>"
+    "<CVV2>123</CVV2></ManualEntry></CardData></Block1></CreditSale></Transaction>"
+    "</Ver1.0></PosRequest></soap:Body></soap:Envelope>"
+)
+RESPONSE = (
+    "<PosResponse><Ver1.0><Header><GatewayTxnId>1234567890</GatewayTxnId>"
+    "<GatewayRspCode>0</GatewayRspCode></Header><Transaction><CreditSale>"
+    "<RspCode>00</RspCode><AuthAmt>10.25</AuthAmt><CardNbr>4111111111111111</CardNbr>"
+    "</CreditSale></Transaction></Ver1.0></PosResponse>"
+)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = RESPONSE.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Gateway:
+    content_type = "text/xml; charset=UTF-8"
+    headers = {}
+
+    def __init__(self, service_url):
+        self.service_url = service_url
+
+
+@pytest.fixture
+def gateway_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_record_masks_card_data_and_replays_offline(gateway_url, tmp_path):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    transport = PooledTransport()
+    gateway = transport.install(_Gateway(gateway_url + "/Hps.Exchange.PosGateway"))
+    transport.cassette = Cassette(path, RECORD)
+    recorded = gateway.send_request("POST", "", SALE)
+    transport.cassette.close()
+
+    with gzip.open(path, "rt") as f:
+        text = f.read()
+    assert "4111111111111111" not in text
+    assert "skapi_cert_secret" not in text
+    entry = json.loads(text)
+    assert entry["key"] == "POST /Hps.Exchange.PosGateway CreditSale"
+    assert "<GatewayTxnId>1234567890</GatewayTxnId>" in entry["response"]
+    assert "<AuthAmt>10.25</AuthAmt>" in entry["response"]
+
+    # nothing listens there: a replayed request must not be sent
+    offline = PooledTransport(retries=0)
+    gateway = offline.install(_Gateway("http://127.0.0.1:9/Hps.Exchange.PosGateway"))
+    offline.cassette = Cassette(path, REPLAY, latency_scale=0.0)
+    for _ in range(2):
+        replayed = gateway.send_request("POST", "", SALE.replace("10.25", "3.00"))
+        assert replayed.status_code == recorded.status_code == 200
+        assert replayed.response_text == entry["response"]
+
+    with pytest.raises(GatewayException, match="No recorded response"):
+        gateway.send_request("POST", "", SALE.replace("CreditSale", "CreditVoid"))
+
+
+def test_replay_waits_the_scaled_latency(tmp_path):
+    path = tmp_path / "cassette.jsonl"
+    path.write_text(
+        json.dumps({"key": "POST /gw CreditAuth", "seconds": 0.2, "status": 200, "response": "a"})
+        + "\n"
+        + json.dumps({"key": "POST /gw CreditAuth", "seconds": 0.2, "error": "timed out"})
+        + "\n"
+    )
+    cassette = Cassette(str(path), REPLAY, latency_scale=0.25)
+    request = GatewayRequest(
+        "POST", "https://gw.example/gw", {}, "<Transaction><CreditAuth/></Transaction>"
+    )
+    assert request_key(request) == "POST /gw CreditAuth"
+
+    start = time.perf_counter()
+    assert cassette.send(request, None).response_text == "a"
+    assert 0.05 <= time.perf_counter() - start < 0.2
+    with pytest.raises(GatewayException, match="timed out"):
+        cassette.send(request, None)
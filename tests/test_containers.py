@@ -0,0 +1,58 @@
+from dataclasses import replace
+
+from python_sdk.globalpayments.api import ServicesContainer
+
+from service.business.containers import ContainerRegistry, bind
+from service.business.params import HeartlandParams, Constants
+
+HEARTLAND_PARAMS = HeartlandParams(
+    url="https://cert.api2.heartlandportico.com",
+    public_key="None",
+    private_key="skapi_cert_one",
+    term_id="None",
+    cert_str="None",
+    account_num="None",
+    developer_id="None",
+    version_number="None",
+    username="None",
+    password="None",
+    constants=Constants(default_currency="USD"),
+)
+
+
+def test_registry_reuses_containers_per_merchant():
+    registry = ContainerRegistry(max_size=8, ttl=60.0)
+    other = replace(HEARTLAND_PARAMS, private_key="skapi_cert_two")
+
+    first = registry.get(HEARTLAND_PARAMS)
+    assert registry.get(HEARTLAND_PARAMS) is first
+    assert registry.get(other) is not first
+    assert len(registry) == 2
+
+
+def test_registry_evicts_least_recently_used():
+    registry = ContainerRegistry(max_size=1, ttl=60.0)
+    other = replace(HEARTLAND_PARAMS, private_key="skapi_cert_two")
+
+    first = registry.get(HEARTLAND_PARAMS)
+    registry.get(other)
+    assert len(registry) == 1
+    assert registry.get(HEARTLAND_PARAMS) is not first
+
+
+def test_registry_expires_entries():
+    registry = ContainerRegistry(max_size=8, ttl=0.0)
+    first = registry.get(HEARTLAND_PARAMS)
+    assert registry.get(HEARTLAND_PARAMS) is not first
+
+
+def test_bind_overrides_services_container_instance():
+    registry = ContainerRegistry()
+    first = registry.get(HEARTLAND_PARAMS)
+    second = registry.get(replace(HEARTLAND_PARAMS, private_key="skapi_cert_two"))
+
+    with bind(first):
+        assert ServicesContainer.instance() is first
+        with bind(second):
+            assert ServicesContainer.instance() is second
+        assert ServicesContainer.instance() is first
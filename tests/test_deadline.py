@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+
+from service import deadline, dispatch
+from service.blue_print import OPERATIONS, SaleRequestInput
+from service.business.functions import CreditCardDataDataclass
+from service.business.params import Constants, HeartlandParams
+from service.deadline import DeadlineExceeded
+from service.dispatch import Dispatcher
+from service.executor import PaymentsExecutor
+from service.metrics import DEADLINE_EXCEEDED, ORPHANED_RESULTS
+from service.packages.lumberjack.SensitiveDataFilter import SensitiveDataFilter
+
+PARAMS = HeartlandParams(
+    url="https://cert.api2.heartlandportico.com",
+    public_key="None",
+    private_key="skapi_cert_deadline",
+    term_id="None",
+    cert_str="None",
+    account_num="None",
+    developer_id="000000",
+    version_number="None",
+    username="None",
+    password="None",
+    constants=Constants(default_currency="USD"),
+)
+
+
+def sale_input(**kwargs) -> SaleRequestInput:
+    return SaleRequestInput(
+        params=PARAMS,
+        reference=uuid4(),
+        qa=False,
+        amount=1.0,
+        zip_code=None,
+        credit_card_data=CreditCardDataDataclass(
+            number="4111111111111111", exp_month="12", exp_year="30",
+        ),
+        **kwargs,
+    )
+
+
+def test_parses_epoch_seconds_and_iso_8601():
+    assert deadline.parse("1700000000.5") == 1700000000.5
+    assert deadline.parse(1700000000) == 1700000000.0
+    assert deadline.parse("2023-11-14T22:13:20Z") == 1700000000.0
+    assert deadline.parse("2023-11-14T22:13:20") == 1700000000.0
+    assert deadline.parse("2023-11-14T17:13:20-05:00") == 1700000000.0
+    with pytest.raises(ValueError):
+        deadline.parse("soon")
+    with pytest.raises(ValueError):
+        sale_input(deadline="soon")
+
+
+def test_the_earlier_deadline_applies():
+    assert deadline.remaining() is None
+    assert deadline.cap(5.0) == 5.0
+    with deadline.until(time.time() + 10):
+        with deadline.until(time.time() + 60):
+            assert 9 < deadline.remaining() <= 10
+        with deadline.until(time.time() + 1):
+            assert deadline.cap(5.0) <= 1
+        with deadline.until(None):
+            assert deadline.remaining() > 9
+    assert deadline.remaining() is None
+
+
+@pytest.mark.asyncio
+async def test_executor_drops_calls_that_waited_past_the_deadline():
+    executor = PaymentsExecutor(max_workers=1, max_queue=1, timeout=5.0)
+    release = threading.Event()
+    ran = []
+    try:
+        busy = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0)
+        dropped = DEADLINE_EXCEEDED.value(stage="wait")
+        with deadline.until(time.time() + 0.05):
+            with pytest.raises(DeadlineExceeded):
+                await executor.run(lambda: ran.append(True))
+        release.set()
+        await busy
+        await asyncio.sleep(0.05)
+        assert ran == []
+        assert DEADLINE_EXCEEDED.value(stage="wait") == dropped + 1
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_expired_requests_are_not_dispatched():
+    calls = []
+
+    async def handler(call):
+        calls.append(call)
+
+    dispatcher = Dispatcher(dispatch.MIDDLEWARE, handler)
+    app = SimpleNamespace(ctx=SimpleNamespace())
+    with pytest.raises(DeadlineExceeded):
+        await dispatcher.run(app, OPERATIONS["sale"], sale_input(deadline=time.time() - 1))
+    with deadline.until(time.time() - 1):
+        with pytest.raises(DeadlineExceeded):
+            await dispatcher.run(app, OPERATIONS["sale"], sale_input())
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_late_results_are_logged_as_orphans(monkeypatch, caplog):
+    finished = threading.Event()
+
+    class SlowPayments:
+        def __init__(self, **kwargs):
+            pass
+
+        def sale(self, **kwargs):
+            time.sleep(0.2)
+            finished.set()
+            return {"response_code": "00", "transaction_id": "123456789"}
+
+    monkeypatch.setattr(dispatch, "OnlinePayments", SlowPayments)
+    executor = PaymentsExecutor(max_workers=1, max_queue=0, timeout=5.0)
+    app = SimpleNamespace(ctx=SimpleNamespace(executor=executor))
+    orphans = ORPHANED_RESULTS.value(operation="sale", outcome="ok")
+    try:
+        with pytest.raises(DeadlineExceeded):
+            await Dispatcher().run(
+                app, OPERATIONS["sale"], sale_input(deadline=time.time() + 0.05)
+            )
+        assert ORPHANED_RESULTS.value(operation="sale", outcome="ok") == orphans
+        assert finished.wait(1.0)
+        await asyncio.sleep(0.01)
+        assert ORPHANED_RESULTS.value(operation="sale", outcome="ok") == orphans + 1
+        # the ids survive SensitiveDataFilter
+        orphan, = [record for record in caplog.records if record.msg.startswith("Orphaned sale")]
+        assert SensitiveDataFilter().filter(orphan)
+        assert orphan.identifiers["transaction_id"] == "123456789"
+    finally:
+        executor.shutdown()
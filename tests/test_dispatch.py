@@ -0,0 +1,192 @@
+import asyncio
+import threading
+import time
+from dataclasses import replace
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+
+from service.blue_print import OPERATIONS, RefundRequestInput, SaleRequestInput
+from service.business.functions import CreditCardDataDataclass
+from service.business.params import Constants, HeartlandParams
+from service import blue_print, dispatch
+from service.deadline import DeadlineExceeded
+from service.dispatch import MIDDLEWARE, Call, Dispatcher
+from service.executor import PaymentsExecutor
+from service.idempotency import IdempotencyCache, IdempotencyMismatch, MemoryIdempotencyStore
+from service.jobs import Job
+from service.metrics import OPERATION_SECONDS
+
+PARAMS = HeartlandParams(
+    url="https://cert.api2.heartlandportico.com",
+    public_key="None",
+    private_key="skapi_cert_dispatch",
+    term_id="None",
+    cert_str="None",
+    account_num="None",
+    developer_id="000000",
+    version_number="None",
+    username="None",
+    password="None",
+    constants=Constants(default_currency="USD"),
+)
+
+
+def sale_input(reference=None, **kwargs) -> SaleRequestInput:
+    return SaleRequestInput(
+        params=PARAMS,
+        reference=reference,
+        qa=False,
+        amount=1.0,
+        zip_code=None,
+        credit_card_data=CreditCardDataDataclass(
+            number="4111111111111111", exp_month="12", exp_year="30",
+        ),
+        **kwargs,
+    )
+
+
+def app(**ctx) -> SimpleNamespace:
+    return SimpleNamespace(ctx=SimpleNamespace(**ctx))
+
+
+@pytest.mark.asyncio
+async def test_middleware_runs_outermost_first():
+    seen = []
+
+    def middleware(name):
+        async def wrap(call, call_next):
+            seen.append(name)
+            return await call_next(call)
+        return wrap
+
+    async def handler(call: Call):
+        seen.append("handler")
+        return call.kwargs
+
+    dispatcher = Dispatcher([middleware("outer"), middleware("inner")], handler)
+    kwargs = await dispatcher.run(app(), OPERATIONS["sale"], sale_input())
+    assert seen == ["outer", "inner", "handler"]
+    assert kwargs["amount"] == 1.0 and kwargs["zip_code"] is None
+
+
+@pytest.mark.asyncio
+async def test_only_idempotent_operations_share_results():
+    calls = []
+
+    async def handler(call: Call):
+        calls.append(call.operation.name)
+        return {"response_code": "00", "call": len(calls)}
+
+    dispatcher = Dispatcher(MIDDLEWARE, handler)
+    ctx = app(idempotency=IdempotencyCache(MemoryIdempotencyStore()))
+    reference = uuid4()
+    first = await dispatcher.run(ctx, OPERATIONS["sale"], sale_input(reference))
+    assert await dispatcher.run(ctx, OPERATIONS["sale"], sale_input(reference)) == first
+    # a retry with a later deadline is the same sale, a different amount is not
+    retry = sale_input(reference, deadline=time.time() + 60)
+    assert await dispatcher.run(ctx, OPERATIONS["sale"], retry) == first
+    with pytest.raises(IdempotencyMismatch):
+        await dispatcher.run(ctx, OPERATIONS["sale"], replace(sale_input(reference), amount=2.0))
+
+    void = RefundRequestInput(
+        params=PARAMS, reference=reference, qa=False,
+        heartland_transaction_id="1", payment_transaction_amount="1.00",
+    )
+    await dispatcher.run(ctx, OPERATIONS["void"], void)
+    await dispatcher.run(ctx, OPERATIONS["void"], void)
+    assert calls == ["sale", "void", "void"]
+    assert OPERATION_SECONDS.count(operation="void") >= 2
+
+
+def slow_payments(sales: list, finished: threading.Event):
+    class SlowPayments:
+        def __init__(self, **kwargs):
+            pass
+
+        def sale(self, **kwargs):
+            sales.append(kwargs)
+            time.sleep(0.1)
+            finished.set()
+            return {"response_code": "00", "transaction_id": "1234567890"}
+
+    return SlowPayments
+
+
+@pytest.mark.asyncio
+async def test_a_cancelled_sale_is_not_sent_again(monkeypatch):
+    sales = []
+    finished = threading.Event()
+    monkeypatch.setattr(dispatch, "OnlinePayments", slow_payments(sales, finished))
+    executor = PaymentsExecutor(max_workers=1, max_queue=0, timeout=5.0)
+    cache = IdempotencyCache(MemoryIdempotencyStore(), wait_timeout=1.0, poll_interval=0.01)
+    ctx = app(executor=executor, idempotency=cache)
+    reference = uuid4()
+    try:
+        first = asyncio.ensure_future(Dispatcher().run(ctx, OPERATIONS["sale"], sale_input(reference)))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        # still running: the retry waits for it instead of charging again
+        retry = await Dispatcher().run(ctx, OPERATIONS["sale"], sale_input(reference))
+        assert finished.is_set()
+        assert retry["transaction_id"] == "1234567890"
+        assert len(sales) == 1
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_a_sale_past_its_deadline_is_not_sent_again(monkeypatch):
+    sales = []
+    finished = threading.Event()
+    monkeypatch.setattr(dispatch, "OnlinePayments", slow_payments(sales, finished))
+    executor = PaymentsExecutor(max_workers=1, max_queue=0, timeout=5.0)
+    cache = IdempotencyCache(MemoryIdempotencyStore(), wait_timeout=1.0, poll_interval=0.01)
+    ctx = app(executor=executor, idempotency=cache)
+    reference = uuid4()
+    try:
+        late = sale_input(reference, deadline=time.time() + 0.02)
+        with pytest.raises(DeadlineExceeded):
+            await Dispatcher().run(ctx, OPERATIONS["sale"], late)
+        retry = await Dispatcher().run(ctx, OPERATIONS["sale"], sale_input(reference))
+        assert retry["transaction_id"] == "1234567890"
+        assert len(sales) == 1
+    finally:
+        executor.shutdown()
+
+
+def test_routes_come_from_the_operation_table():
+    from service import app as sanic_app
+
+    routes = {route.name.rsplit(".", 1)[-1]: route.path for route in sanic_app.router.routes}
+    for operation in OPERATIONS.values():
+        if operation.path is not None:
+            assert routes[operation.name] == "api/heartland" + operation.path
+    assert OPERATIONS["capture"].response({"response_code": "00"}) == {"settle_status": True}
+
+
+@pytest.mark.asyncio
+async def test_batch_and_job_items_answer_like_their_routes(monkeypatch):
+    async def run(app, operation, request_input):
+        return {"response_code": "00", "transaction_id": "1234567890"}
+
+    monkeypatch.setattr(blue_print.dispatcher, "run", run)
+    capture = {
+        "operation": "capture", "params": PARAMS, "reference": None, "qa": False,
+        "heartland_transaction_id": "1", "payment_transaction_amount": "1.00",
+    }
+    ctx = app()
+    assert await blue_print.run_item(ctx, capture) == {
+        "status": "ok", "result": {"settle_status": True},
+    }
+    job = Job("job", "merchant", False, None, 1, False, 0.0, 0.0)
+    row = {
+        "operation": "capture", "heartland_transaction_id": "1",
+        "payment_transaction_amount": "1.00",
+    }
+    assert await blue_print.job_item(ctx, job, PARAMS, 0, row) == {
+        "status": "ok", "result": {"settle_status": True},
+    }
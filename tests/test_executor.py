@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+import pytest
+
+from service.executor import ExecutorSaturated, ExecutorTimeout, PaymentsExecutor
+
+
+@pytest.mark.asyncio
+async def test_executor_runs_off_the_event_loop():
+    executor = PaymentsExecutor(max_workers=2, max_queue=0, timeout=1.0)
+    try:
+        name = await executor.run(lambda: threading.current_thread().name)
+        assert name.startswith("payments")
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_executor_rejects_when_saturated():
+    executor = PaymentsExecutor(max_workers=1, max_queue=0, timeout=1.0)
+    release = threading.Event()
+    try:
+        pending = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0)
+        with pytest.raises(ExecutorSaturated):
+            await executor.run(lambda: None)
+        release.set()
+        assert await pending is True
+        assert await executor.run(lambda: 1) == 1
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_executor_times_out():
+    executor = PaymentsExecutor(max_workers=1, max_queue=0, timeout=0.05)
+    release = threading.Event()
+    try:
+        with pytest.raises(ExecutorTimeout):
+            await executor.run(release.wait)
+    finally:
+        release.set()
+        executor.shutdown()
@@ -0,0 +1,31 @@
+from urllib.request import Request, urlopen
+
+from benchmarks.fake_portico import Behaviour, start_in_thread
+
+SALE = (
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>'
+    '<hps:PosRequest xmlns:hps="http://Hps.Exchange.PosGateway"><hps:Ver1.0><hps:Header>'
+    "<hps:ClientTxnId>abc</hps:ClientTxnId></hps:Header>"
+    "<hps:Transaction><hps:CreditSale><hps:Amt>1.00</hps:Amt></hps:CreditSale></hps:Transaction>"
+    "</hps:Ver1.0></hps:PosRequest></soap:Body></soap:Envelope>"
+).encode()
+
+
+def _post(url: str) -> str:
+    request = Request(url + "/Hps.Exchange.PosGateway/PosGatewayService.asmx", data=SALE,
+                      headers={"Content-Type": "text/xml; charset=UTF-8"})
+    with urlopen(request, timeout=5) as response:
+        assert response.status == 200
+        return response.read().decode()
+
+
+def test_fake_portico_answers_by_transaction_type():
+    text = _post(start_in_thread(Behaviour(latency_ms=0)))
+    assert "<Transaction><CreditSale><RspCode>00</RspCode>" in text
+    assert "<GatewayRspCode>0</GatewayRspCode>" in text
+    assert "<ClientTxnId>abc</ClientTxnId>" in text
+
+
+def test_fake_portico_declines():
+    text = _post(start_in_thread(Behaviour(latency_ms=0, decline_rate=1.0)))
+    assert "<RspCode>05</RspCode><RspText>DECLINE</RspText>" in text
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from dataclasses import replace
+from types import SimpleNamespace
+
+import pytest
+
+from service.business.functions import CreditCardDataDataclass
+from service.executor import ExecutorTimeout
+from service.idempotency import (
+    IdempotencyCache,
+    IdempotencyConflict,
+    IdempotencyMismatch,
+    MemoryIdempotencyStore,
+    request_fingerprint,
+    SQLiteIdempotencyStore,
+)
+
+
+@pytest.mark.asyncio
+async def test_coalesces_in_flight_duplicates():
+    cache = IdempotencyCache(MemoryIdempotencyStore())
+    calls = []
+
+    async def charge():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"response_code": "00"}
+
+    results = await asyncio.gather(*(cache.run("sale:m:r", charge) for _ in range(5)))
+    assert results == [{"response_code": "00"}] * 5
+    assert len(calls) == 1
+    assert await cache.run("sale:m:r", charge) == {"response_code": "00"}
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_failures_release_the_key():
+    cache = IdempotencyCache(MemoryIdempotencyStore())
+
+    async def fail():
+        raise RuntimeError("connection refused")
+
+    async def charge():
+        return {"response_code": "00"}
+
+    with pytest.raises(RuntimeError):
+        await cache.run("sale:m:r", fail)
+    assert await cache.run("sale:m:r", charge) == {"response_code": "00"}
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "idempotency.sqlite3")
+    first = IdempotencyCache(SQLiteIdempotencyStore(path))
+    second = IdempotencyCache(SQLiteIdempotencyStore(path), wait_timeout=0.2, poll_interval=0.01)
+
+    async def charge():
+        return {"response_code": "00"}
+
+    async def unexpected():
+        raise AssertionError("second worker must not call the gateway")
+
+    assert await first.run("sale:m:r", charge) == {"response_code": "00"}
+    assert await second.run("sale:m:r", unexpected) == {"response_code": "00"}
+
+
+@pytest.mark.asyncio
+async def test_timeouts_keep_the_key_pending(tmp_path):
+    path = str(tmp_path / "idempotency.sqlite3")
+    first = IdempotencyCache(SQLiteIdempotencyStore(path))
+    second = IdempotencyCache(SQLiteIdempotencyStore(path), wait_timeout=0.05, poll_interval=0.01)
+    memory = IdempotencyCache(MemoryIdempotencyStore(), wait_timeout=0.05, poll_interval=0.01)
+
+    async def timeout():
+        raise ExecutorTimeout("Payment call timed out")
+
+    async def charge():
+        return {"response_code": "00"}
+
+    with pytest.raises(ExecutorTimeout):
+        await first.run("sale:m:r", timeout)
+    with pytest.raises(IdempotencyConflict):
+        await second.run("sale:m:r", charge)
+
+    with pytest.raises(ExecutorTimeout):
+        await memory.run("sale:m:r", timeout)
+    with pytest.raises(IdempotencyConflict):
+        await memory.run("sale:m:r", charge)
+
+
+@pytest.mark.asyncio
+async def test_a_reference_reused_for_another_request_is_refused(tmp_path):
+    path = str(tmp_path / "idempotency.sqlite3")
+    for store in (MemoryIdempotencyStore(), SQLiteIdempotencyStore(path)):
+        cache = IdempotencyCache(store)
+        started = asyncio.Event()
+
+        async def charge():
+            started.set()
+            await asyncio.sleep(0.01)
+            return {"response_code": "00"}
+
+        first = asyncio.ensure_future(cache.run("sale:m:r", charge, "amount=1"))
+        await started.wait()
+        with pytest.raises(IdempotencyMismatch):
+            await cache.run("sale:m:r", charge, "amount=2")
+        assert await first == {"response_code": "00"}
+        with pytest.raises(IdempotencyMismatch):
+            await cache.run("sale:m:r", charge, "amount=2")
+        # also while another worker holds the key
+        assert store.claim("sale:m:p", "amount=1")
+        with pytest.raises(IdempotencyMismatch):
+            store.claim("sale:m:p", "amount=2")
+
+
+def test_expired_pending_keys_are_evicted():
+    store = MemoryIdempotencyStore(pending_ttl=0.0)
+    for i in range(100):
+        assert store.claim(f"sale:m:{i}")  # never completed nor released
+    store.complete("sale:m:done", {"response_code": "00"})
+    assert store._pending == {}
+
+
+@pytest.mark.asyncio
+async def test_stored_fingerprints_need_the_secret(tmp_path):
+    card = CreditCardDataDataclass(number="4111111111111111", exp_month="12", exp_year="30", cvn="123")
+    body = SimpleNamespace(reference="r", amount=1.0, credit_card_data=card)
+    store = SQLiteIdempotencyStore(str(tmp_path / "idempotency.sqlite3"))
+    cache = IdempotencyCache(store, secret=b"s3cret")
+
+    async def charge():
+        return {"response_code": "00"}
+
+    fingerprint = cache.fingerprint(body)
+    await cache.run("sale:m:r", charge, fingerprint)
+    stored, = store._db.execute("SELECT fingerprint FROM idempotency").fetchone()
+    assert stored == fingerprint
+
+    unkeyed = json.dumps(
+        {"reference": "r", "amount": 1.0, "credit_card_data": vars(card)},
+        sort_keys=True,
+    ).encode()
+    assert stored != hashlib.sha256(unkeyed).hexdigest()
+    assert stored != request_fingerprint(body, b"guess")
+    # the CVN is not part of it
+    other_cvn = SimpleNamespace(**{**vars(body), "credit_card_data": replace(card, cvn="999")})
+    assert cache.fingerprint(other_cvn) == fingerprint
+
+
+@pytest.mark.asyncio
+async def test_a_locked_sqlite_store_does_not_block_the_loop(tmp_path):
+    path = str(tmp_path / "idempotency.sqlite3")
+    cache = IdempotencyCache(SQLiteIdempotencyStore(path))
+    blocker = sqlite3.connect(path, isolation_level=None)
+    blocker.execute("BEGIN EXCLUSIVE")  # another worker mid-write
+
+    async def charge():
+        return {"response_code": "00"}
+
+    task = asyncio.ensure_future(cache.run("sale:m:r", charge))
+    lags = []
+    for _ in range(20):
+        start = time.monotonic()
+        await asyncio.sleep(0.01)
+        lags.append(time.monotonic() - start)
+    assert not task.done()
+    assert max(lags) < 0.1
+    blocker.execute("COMMIT")
+    assert await task == {"response_code": "00"}
+    cache.close()
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from service.business.params import Constants, HeartlandParams
+from service.jobs import (
+    INTERRUPTED,
+    OK,
+    QUEUED,
+    RUNNING,
+    JobBusy,
+    JobJournal,
+    JobRequestInput,
+    JobRunner,
+    parse_rows,
+    row_fingerprint,
+    row_reference,
+    RowMismatch,
+    WrongMerchant,
+)
+
+PARAMS = HeartlandParams(
+    url="https://cert.api2.heartlandportico.com",
+    public_key="None",
+    private_key="skapi_cert_jobs",
+    term_id="None",
+    cert_str="None",
+    account_num="None",
+    developer_id="000000",
+    version_number="None",
+    username="None",
+    password="None",
+    constants=Constants(default_currency="USD"),
+)
+
+
+async def chunked(data: bytes, size: int = 7):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def collect(rows):
+    return [row async for row in rows]
+
+
+@pytest.mark.asyncio
+async def test_parses_csv_and_ndjson_across_chunks():
+    csv_rows = await collect(parse_rows(chunked(
+        b"operation,heartland_transaction_id,payment_transaction_amount,amount\n"
+        b"refund,1001,10.00,\n"
+        b"\n"
+        b"capture,1002,5.00,2.5"
+    ), "text/csv; charset=utf-8"))
+    assert csv_rows == [
+        (0, {"operation": "refund", "heartland_transaction_id": "1001",
+             "payment_transaction_amount": "10.00", "amount": None}),
+        (1, {"operation": "capture", "heartland_transaction_id": "1002",
+             "payment_transaction_amount": "5.00", "amount": 2.5}),
+    ]
+    ndjson_rows = await collect(parse_rows(chunked(
+        b'{"operation": "void", "heartland_transaction_id": "1"}\n'
+        b'{"operation": "void", "heartland_transaction_id": "2"}\n'
+    ), "application/x-ndjson"))
+    assert [line for line, _ in ndjson_rows] == [0, 1]
+
+
+
+@pytest.mark.asyncio
+async def test_records_longer_than_the_limit_are_refused():
+    long = b'{"operation": "void", "note": "' + b"x" * 100 + b'"}'
+    with pytest.raises(ValueError, match="Record 1 is longer than 64 bytes"):
+        await collect(parse_rows(chunked(b'{"operation": "void"}\n' + long + b"\n"), "", max_line=64))
+    # never buffered whole when no newline comes
+    with pytest.raises(ValueError, match="Record 0"):
+        await collect(parse_rows(chunked(b"x" * 10000, size=50), "", max_line=64))
+
+def ndjson(count: int) -> bytes:
+    return b"".join(
+        json.dumps({"operation": "void", "heartland_transaction_id": str(i)}).encode() + b"\n"
+        for i in range(count)
+    )
+
+
+@pytest.mark.asyncio
+async def test_upload_runs_rows_with_bounded_concurrency(tmp_path):
+    journal = JobJournal(str(tmp_path / "jobs.sqlite3"))
+    in_flight = peak = 0
+
+    async def call(job, params, line, row):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+        item = job.item(params, line, row)
+        assert item["reference"] == row_reference(job.job_id, line)
+        return {"status": "ok", "result": {"transaction_id": item["heartland_transaction_id"]}}
+
+    runner = JobRunner(journal, call)
+    job = journal.create(JobRequestInput(params=PARAMS), concurrency=3)
+    assert await runner.run_upload(job, PARAMS, parse_rows(chunked(ndjson(20)), "")) == 20
+    assert peak == 3
+
+    status = journal.status(journal.get(job.job_id))
+    assert status["done"] and status["rows"][OK] == 20
+    assert "params" not in status
+    # the journal keeps a handle for the merchant, not its credentials
+    dump = "\n".join(journal._db.iterdump())
+    assert PARAMS.private_key not in dump
+    outcomes = [outcome for page in journal.outcomes(job.job_id, page=6) for outcome in page]
+    assert [outcome["line"] for outcome in outcomes] == list(range(20))
+    assert outcomes[4]["result"] == {"transaction_id": "4"}
+
+    # uploading the same input again runs nothing twice
+    assert await runner.run_upload(job, PARAMS, parse_rows(chunked(ndjson(20)), "")) == 0
+
+    # and a different input is refused, not matched up by line
+    with pytest.raises(RowMismatch):
+        await runner.run_upload(job, PARAMS, parse_rows(chunked(
+            b'{"operation": "refund", "heartland_transaction_id": "0"}\n'
+        ), ""))
+
+    # nor can another merchant's params run the job
+    other = HeartlandParams(**{**PARAMS.__dict__, "private_key": "skapi_cert_other"})
+    with pytest.raises(WrongMerchant):
+        await runner.run_upload(job, other, parse_rows(chunked(ndjson(1)), ""))
+
+
+@pytest.mark.asyncio
+async def test_resume_after_a_worker_died(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    dead = JobJournal(path, lease=0.0)
+    job = dead.create(JobRequestInput(params=PARAMS), concurrency=2)
+    rows = [(line, row) async for line, row in parse_rows(chunked(ndjson(5)), "")]
+    assert dead.claim(job.job_id)
+    for line, row in rows[:2]:
+        dead.add(job.job_id, line, row)  # in flight when the worker died
+    for line, row in rows[2:]:
+        dead._db.execute(
+            "INSERT INTO job_rows (job_id, line, operation, input, fingerprint, status)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (job.job_id, line, row["operation"], json.dumps(row), row_fingerprint(row), QUEUED),
+        )
+    dead.complete_input(job.job_id)
+    assert dead.counts(job.job_id)[RUNNING] == 2
+
+    calls = []
+
+    async def call(job, params, line, row):
+        calls.append(row["heartland_transaction_id"])
+        return {"status": "ok", "result": {}}
+
+    runner = JobRunner(JobJournal(path), call)
+    assert await runner.resume(runner.journal.get(job.job_id), PARAMS) == 3
+    assert calls == ["2", "3", "4"]
+    counts = runner.journal.counts(job.job_id)
+    assert counts[INTERRUPTED] == 2 and counts[OK] == 3
+
+
+@pytest.mark.asyncio
+async def test_a_running_job_is_not_taken_over(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    first, second = JobJournal(path), JobJournal(path)
+    job = first.create(JobRequestInput(params=PARAMS), concurrency=1)
+    assert first.claim(job.job_id)
+    runner = JobRunner(second, None)
+    with pytest.raises(JobBusy):
+        await runner.run_upload(job, PARAMS, parse_rows(chunked(ndjson(1)), ""))
+    with pytest.raises(JobBusy):
+        await runner.resume(job, PARAMS)
+
+
+@pytest.mark.asyncio
+async def test_old_jobs_are_deleted(tmp_path):
+    journal = JobJournal(str(tmp_path / "jobs.sqlite3"), ttl=60.0)
+    old = journal.create(JobRequestInput(params=PARAMS), concurrency=1)
+    journal.add(old.job_id, 0, {"operation": "void", "heartland_transaction_id": "1"})
+    journal._db.execute("UPDATE jobs SET updated = ? WHERE job_id = ?", (time.time() - 61.0, old.job_id))
+
+    new = journal.create(JobRequestInput(params=PARAMS), concurrency=1)
+    assert journal.get(old.job_id) is None
+    assert journal._db.execute("SELECT COUNT(*) FROM job_rows").fetchone() == (0,)
+    assert journal.get(new.job_id) is not None
+
+
+@pytest.mark.asyncio
+async def test_the_lease_is_renewed_while_rows_run(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    journal = JobJournal(path, lease=0.1)
+    other = JobJournal(path, lease=0.1)
+    job = journal.create(JobRequestInput(params=PARAMS), concurrency=1)
+    taken_over = []
+
+    async def call(job, params, line, row):
+        # much longer than the lease, with no new row read meanwhile
+        for _ in range(5):
+            await asyncio.sleep(0.06)
+            taken_over.append(other.claim(job.job_id))
+        return {"status": "ok", "result": {}}
+
+    runner = JobRunner(journal, call)
+    assert await runner.run_upload(job, PARAMS, parse_rows(chunked(ndjson(1)), "")) == 1
+    assert not any(taken_over)
+    assert journal.counts(job.job_id)[OK] == 1
@@ -0,0 +1,104 @@
+from dataclasses import asdict
+from json import dumps, loads
+from uuid import UUID, uuid4
+
+from service.blue_print import SaleRequestInput, VerifyRequestInput
+from service.business.functions import CreditCardDataDataclass, VerifyAddressDataClass
+from service.business.params import HeartlandParams, Constants
+import pytest
+
+from service import json_util
+from service.json_util import decode_json, decoder_for, ignore_properties, serializer, stdlib_dumps
+
+CREDIT_CARD_DATA = CreditCardDataDataclass(
+    number="None", exp_month="None", exp_year="None", cvn="None",
+)
+
+HEARTLAND_PARAMS = HeartlandParams(
+    url="https://cert.api2.heartlandportico.com",
+    public_key="None",
+    private_key="None",
+    term_id="None",
+    cert_str="None",
+    account_num="None",
+    developer_id="None",
+    version_number="None",
+    username="None",
+    password="None",
+    constants=Constants(default_currency="USD"),
+)
+
+
+def _sale_payload(**overrides):
+    payload = {
+        "params": asdict(HEARTLAND_PARAMS),
+        "reference": str(uuid4()),
+        "qa": True,
+        "amount": 3.33,
+        "zip_code": None,
+        "credit_card_data": asdict(CREDIT_CARD_DATA),
+        "unknown": "ignored",
+    }
+    payload.update(overrides)
+    return payload
+
+
+def test_decoder_is_compiled_once():
+    assert decoder_for(SaleRequestInput) is decoder_for(SaleRequestInput)
+
+
+def test_decoder_builds_nested_types():
+    payload = _sale_payload()
+    sale = ignore_properties(SaleRequestInput, payload)
+    assert isinstance(sale.params, HeartlandParams)
+    assert isinstance(sale.params.constants, Constants)
+    assert isinstance(sale.credit_card_data, CreditCardDataDataclass)
+    assert sale.reference == UUID(payload["reference"])
+
+
+def test_decoder_keeps_invalid_reference():
+    sale = ignore_properties(SaleRequestInput, _sale_payload(reference="not-a-uuid"))
+    assert sale.reference == "not-a-uuid"
+
+
+def test_decode_json_matches_lenient_path():
+    payload = _sale_payload()
+    assert decode_json(SaleRequestInput, dumps(payload).encode()) == \
+        ignore_properties(SaleRequestInput, payload)
+
+
+def test_decode_json_falls_back_for_loose_types():
+    payload = _sale_payload(amount=3, credit_card_data={
+        "number": "4111111111111111", "exp_month": 12, "exp_year": 30,
+    })
+    sale = decode_json(SaleRequestInput, dumps(payload).encode())
+    assert sale.credit_card_data.exp_month == 12
+
+
+def test_decode_json_optional_nested_dataclass():
+    payload = {
+        "params": asdict(HEARTLAND_PARAMS),
+        "reference": None,
+        "qa": False,
+        "credit_card_data": asdict(CREDIT_CARD_DATA),
+        "address": {"postal_code": "12345", "city": None, "province": None,
+                    "street_address_1": None, "street_address_2": None,
+                    "street_address_3": None},
+    }
+    verify = decode_json(VerifyRequestInput, dumps(payload))
+    assert isinstance(verify.address, VerifyAddressDataClass)
+    assert verify.address.postal_code == "12345"
+
+
+def test_serializers_agree():
+    sale = ignore_properties(SaleRequestInput, _sale_payload())
+    expected = loads(stdlib_dumps(sale))
+    assert expected["reference"] == str(sale.reference)
+    assert expected["credit_card_data"]["number"] == sale.credit_card_data.number
+    if json_util.orjson is not None:
+        assert loads(serializer("orjson")(sale)) == expected
+
+
+def test_serializer_rejects_unknown_name():
+    with pytest.raises(ValueError):
+        serializer("yaml")
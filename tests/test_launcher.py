@@ -0,0 +1,29 @@
+import socket
+
+from service.launcher import LaunchSettings, bind_reuseport, default_start_method
+
+
+def test_settings_from_env():
+    settings = LaunchSettings.from_env({"WORKERS": "3", "PORT": "9000", "REUSE_PORT": "true"})
+    assert settings.workers == 3
+    assert settings.port == 9000
+    assert settings.reuse_port is True
+    assert settings.access_log is False
+    assert settings.graceful_timeout is None
+    assert settings.start_method == default_start_method()
+    assert LaunchSettings.from_env({"START_METHOD": "spawn"}).start_method == "spawn"
+
+
+def test_workers_default_to_available_cpus():
+    assert LaunchSettings.from_env({}).workers >= 1
+
+
+def test_reuseport_sockets_share_a_port():
+    first = bind_reuseport("127.0.0.1", 0)
+    try:
+        port = first.getsockname()[1]
+        second = bind_reuseport("127.0.0.1", port)
+        second.close()
+        assert first.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT)
+    finally:
+        first.close()
@@ -0,0 +1,115 @@
+import io
+import logging
+import logging.config
+import threading
+
+from service.packages.lumberjack.AsyncQueueHandler import AsyncQueueHandler
+from service.packages.lumberjack.SensitiveDataFilter import SensitiveDataFilter
+
+
+def _logger(handler, name):
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def test_queue_handler_masks_and_writes_on_listener_thread():
+    stream = io.StringIO()
+    target = logging.StreamHandler(stream)
+    target.addFilter(SensitiveDataFilter())
+    threads = []
+    target.setFormatter(logging.Formatter("%(message)s"))
+    target.addFilter(lambda record: threads.append(threading.current_thread()) or True)
+    handler = AsyncQueueHandler([target])
+    handler.start()
+    logger = _logger(handler, "lumberjack.test.async")
+
+    logger.info("charging %s", "4111111111111111")
+    handler.stop()
+
+    assert stream.getvalue() == "charging [REDACTED]\n"
+    assert threads and threading.current_thread() not in threads
+
+
+def test_queue_handler_survives_other_dict_config():
+    stream = io.StringIO()
+    target = logging.StreamHandler(stream)
+    target.setFormatter(logging.Formatter("%(message)s"))
+    handler = AsyncQueueHandler([target])
+    handler.start()
+    logger = _logger(handler, "lumberjack.test.reconfigured")
+
+    logger.info("before")
+    logging.config.dictConfig({"version": 1, "disable_existing_loggers": False})
+    logger.info("after")
+    handler.stop()
+
+    assert stream.getvalue().splitlines() == ["before", "after"]
+
+
+def test_queue_handler_drops_when_full():
+    stream = io.StringIO()
+    target = logging.StreamHandler(stream)
+    target.setFormatter(logging.Formatter("%(message)s"))
+    handler = AsyncQueueHandler([target], maxsize=2, overflow_timeout=0)
+    logger = _logger(handler, "lumberjack.test.overflow")
+
+    for i in range(5):
+        logger.info("line %d", i)
+    handler.start()
+    handler.stop()
+
+    assert handler.dropped == 3
+    assert stream.getvalue().splitlines() == [
+        "line 0", "line 1", "Log queue overflowed, 3 records dropped",
+    ]
+
+
+def test_sampling_a_full_queue_keeps_its_errors():
+    stream = io.StringIO()
+    target = logging.StreamHandler(stream)
+    target.setFormatter(logging.Formatter("%(message)s"))
+    handler = AsyncQueueHandler(
+        [target], maxsize=3, overflow="sample", sample_rate=1, overflow_timeout=0
+    )
+    logger = _logger(handler, "lumberjack.test.sample")
+
+    logger.error("error 0")
+    logger.info("info 0")
+    logger.error("error 1")
+    logger.info("info 1")  # replaces info 0
+    logger.info("info 2")  # replaces info 1
+    logger.error("error 2")  # replaces info 2
+    logger.info("info 3")  # nothing as or less severe to replace, dropped
+    handler.start()
+    handler.stop()
+
+    assert handler.dropped == 4
+    assert stream.getvalue().splitlines() == [
+        "error 0", "error 1", "error 2", "Log queue overflowed, 4 records dropped",
+    ]
+
+def test_get_logger_configures_once():
+    from service.packages import lumberjack
+
+    logger = lumberjack.get_logger()
+    handlers = list(logger.handlers)
+    assert lumberjack.get_logger() is logger
+    assert logger.handlers == handlers
+    assert lumberjack.get_logger("child").parent is logger
+
+
+def test_set_level_keeps_handlers():
+    from service.packages import lumberjack
+
+    logger = lumberjack.get_logger()
+    handlers = list(logger.handlers)
+    previous = logger.level
+    try:
+        lumberjack.set_level("10")
+        assert logger.level == logging.DEBUG
+        assert logger.handlers == handlers
+    finally:
+        lumberjack.set_level(previous)
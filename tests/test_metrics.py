@@ -0,0 +1,51 @@
+import pytest
+
+from service import app
+from service.metrics import stage, current_route, STAGE_SECONDS
+from service.packages.metrics import Registry
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, route="sale")
+    histogram.observe(0.5, route="sale")
+    histogram.observe(5.0, route="sale")
+    text = registry.render()
+    assert 'latency_seconds_bucket{route="sale",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="sale",le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{route="sale",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{route="sale"} 3' in text
+    assert "# TYPE latency_seconds histogram" in text
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    counter = registry.counter("responses_total", "Responses.", ("code",))
+    counter.inc(code="00")
+    counter.inc(2, code="00")
+    gauge = registry.gauge("pool_idle", "Idle.", ("host",))
+    gauge.set_function(lambda: [(("a\"b",), 3)])
+    text = registry.render()
+    assert 'responses_total{code="00"} 3.0' in text
+    assert 'pool_idle{host="a\\"b"} 3.0' in text
+    with pytest.raises(ValueError):
+        counter.inc(other="x")
+
+
+def test_stage_uses_current_route():
+    token = current_route.set("test_route")
+    try:
+        with stage("decode"):
+            pass
+    finally:
+        current_route.reset(token)
+    assert STAGE_SECONDS.count(route="test_route", stage="decode") == 1
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    _, response = await app.asgi_client.get("/metrics")
+    assert response.status == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "payments_request_seconds" in response.text
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from service import app, profiler
+from service.executor import PaymentsExecutor
+from service.metrics import current_route
+from service.profiler import ProfileRunning
+
+
+def busy_sale(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def busy_verify(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        await asyncio.sleep(0)
+        busy_sale(0.05)
+
+
+async def profiled_traffic(route=None):
+    executor = PaymentsExecutor(max_workers=2, max_queue=0, timeout=5.0)
+
+    async def sale():
+        current_route.set("sale")
+        await executor.run(busy_sale, 0.3)
+
+    async def verify():
+        task = asyncio.current_task()
+        profiler._task_routes[task] = "verify"
+        await busy_verify(0.3)
+
+    try:
+        profile = asyncio.ensure_future(profiler.profile(0.4, 0.005, route))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(sale(), verify())
+        return await profile
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_samples_are_attributed_to_routes():
+    sampler = await profiled_traffic()
+    routes = {stack[0] for stack in sampler.stacks}
+    assert {"sale", "verify"} <= routes
+    sale = [stack for stack in sampler.stacks if stack[0] == "sale"]
+    assert any(label.startswith("busy_sale (") for stack in sale for label in stack)
+
+    lines = sampler.collapsed().splitlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == sampler.samples
+    assert any(line.startswith("verify;") for line in lines)
+
+    document = sampler.speedscope("test")
+    profile = document["profiles"][0]
+    assert profile["type"] == "sampled"
+    assert len(profile["samples"]) == len(profile["weights"]) == len(sampler.stacks)
+    frames = document["shared"]["frames"]
+    assert all(0 <= index < len(frames) for sample in profile["samples"] for index in sample)
+    assert profile["endValue"] == pytest.approx(sampler.samples * 0.005)
+
+
+@pytest.mark.asyncio
+async def test_route_filter_and_one_profile_at_a_time():
+    profile = asyncio.ensure_future(profiled_traffic(route="sale"))
+    await asyncio.sleep(0.05)
+    with pytest.raises(ProfileRunning):
+        await profiler.profile(0.01)
+    sampler = await profile
+    assert sampler.samples > 0
+    assert {stack[0] for stack in sampler.stacks} == {"sale"}
+    assert profiler._thread_routes == {}
+    # not tracked once the profile is over
+    with profiler.attributed():
+        assert profiler._thread_routes == {}
+
+
+@pytest.mark.asyncio
+async def test_profile_endpoint_needs_the_admin_token():
+    token = app.config.ADMIN_TOKEN
+    try:
+        app.config.ADMIN_TOKEN = ""
+        _, response = await app.asgi_client.get("/admin/profile?seconds=0")
+        assert response.status == 404
+
+        app.config.ADMIN_TOKEN = "s3cret"
+        _, response = await app.asgi_client.get(
+            "/admin/profile?seconds=0", headers={"authorization": "Bearer wrong"}
+        )
+        assert response.status == 401
+
+        _, response = await app.asgi_client.get(
+            "/admin/profile?seconds=0.05&format=speedscope",
+            headers={"authorization": "Bearer s3cret"},
+        )
+        assert response.status == 200
+        assert json.loads(response.body)["profiles"][0]["type"] == "sampled"
+        assert response.headers["x-profile-pid"]
+    finally:
+        app.config.ADMIN_TOKEN = token
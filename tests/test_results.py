@@ -0,0 +1,67 @@
+from service.business.results import extract_results, plan_for
+
+
+class _Reference:
+    transaction_id = None
+    auth_code = None
+
+
+class _Transaction:
+    card_type = None
+    response_code = None
+    response_message = None
+    avs_response_code = None
+    transaction_reference = None
+
+    @property
+    def transaction_id(self):
+        return self.transaction_reference.transaction_id
+
+    @property
+    def authorization_code(self):
+        return self.transaction_reference.auth_code
+
+    def refund(self, amount=None):
+        raise NotImplementedError
+
+
+def _transaction():
+    transaction = _Transaction()
+    transaction.transaction_reference = _Reference()
+    transaction.transaction_reference.transaction_id = "1234567"
+    transaction.transaction_reference.auth_code = "A1B2C3"
+    transaction.response_code = "00"
+    transaction.response_message = "APPROVAL"
+    transaction.avs_response_code = "Y"
+    transaction.card_type = "Visa"
+    transaction.batch_id = "42"
+    transaction.balance = 10.0
+    return transaction
+
+
+def _dir_results(transaction):
+    fields = {}
+    for key in dir(transaction):
+        value = getattr(transaction, key)
+        if not key.startswith("_") and isinstance(value, str):
+            fields[key] = value
+    return fields
+
+
+def test_full_projection_matches_reflection():
+    transaction = _transaction()
+    assert extract_results(transaction) == _dir_results(transaction)
+
+
+def test_plan_is_cached_per_type():
+    assert plan_for(_Transaction) is plan_for(_Transaction)
+    assert "refund" not in plan_for(_Transaction)[1]
+
+
+def test_minimal_projection():
+    assert extract_results(_transaction(), "minimal") == {
+        "response_code": "00",
+        "response_message": "APPROVAL",
+        "transaction_id": "1234567",
+        "authorization_code": "A1B2C3",
+    }
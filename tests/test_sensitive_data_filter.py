@@ -0,0 +1,55 @@
+import logging
+import sys
+
+from service.packages.lumberjack.SensitiveDataFilter import SensitiveDataFilter
+
+
+def _record(msg, args=None, exc_info=None, **extra):
+    record = logging.LogRecord(
+        "AppLogger", logging.INFO, __file__, 1, msg, args, exc_info
+    )
+    record.__dict__.update(extra)
+    return record
+
+
+def test_masks_card_numbers_in_one_pass():
+    masked = SensitiveDataFilter().mask_sensitive_data(
+        "card 4111-1111-1111-1111 or 4111 1111 1111 1111 or 4111111111111111"
+    )
+    assert masked == "card [REDACTED] or [REDACTED] or [REDACTED]"
+
+
+def test_masks_ssn_as_a_whole():
+    masked = SensitiveDataFilter().mask_sensitive_data("ssn 123-45-6789")
+    assert masked == "ssn [REDACTED]"
+
+
+def test_masks_args_and_extra_fields():
+    record = _record(
+        "charging %s", ("4111111111111111",),
+        payload={"card": "4111111111111111", "amount": "ten"},
+    )
+    assert SensitiveDataFilter().filter(record)
+    assert record.getMessage() == "charging [REDACTED]"
+    assert record.payload == {"card": "[REDACTED]", "amount": "ten"}
+
+
+def test_leaves_identifiers_unmasked():
+    record = _record(
+        "orphaned sale", identifiers={"transaction_id": "123456789"},
+        payload={"transaction_id": "123456789"},
+    )
+    SensitiveDataFilter().filter(record)
+    assert record.identifiers == {"transaction_id": "123456789"}
+    assert record.payload == {"transaction_id": "[REDACTED]"}
+
+
+def test_masks_exception_text():
+    try:
+        raise ValueError("bad card 4111111111111111")
+    except ValueError:
+        record = _record("failed", exc_info=sys.exc_info())
+    SensitiveDataFilter().filter(record)
+    assert record.exc_info is None
+    assert "4111111111111111" not in record.exc_text
+    assert "bad card [REDACTED]" in record.exc_text
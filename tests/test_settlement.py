@@ -0,0 +1,111 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from service.business.params import Constants, HeartlandParams
+from service.settlement import (
+    FAILED,
+    RUNNING,
+    SUCCEEDED,
+    ScheduledSettle,
+    SettlementFailed,
+    SettlementJobs,
+    SettlementScheduler,
+    load_schedule,
+)
+
+PARAMS = HeartlandParams(
+    url="https://cert.api2.heartlandportico.com",
+    public_key="None",
+    private_key="skapi_cert_key",
+    term_id="None",
+    cert_str="None",
+    account_num="None",
+    developer_id="000000",
+    version_number="None",
+    username="None",
+    password="None",
+    constants=Constants(default_currency="USD"),
+)
+SUMMARY = SimpleNamespace(id=1001, sequence_number=7, transaction_count=3, total_amount="30.00")
+
+
+def test_jobs_are_single_flight_across_workers(tmp_path):
+    path = str(tmp_path / "settlement.sqlite3")
+    first, second = SettlementJobs(path), SettlementJobs(path)
+    job, created = first.create("merchant", "request")
+    assert created and job.status == RUNNING
+    joined, created = second.create("merchant", "request")
+    assert not created and joined.job_id == job.job_id
+    assert second.create("other merchant", "request")[1]
+
+    first.finish(job.job_id, {"batch_id": "1001"})
+    done = second.get(job.job_id)
+    assert done.status == SUCCEEDED and done.result == {"batch_id": "1001"}
+    assert second.create("merchant", "request")[1]
+
+
+def test_stale_jobs_are_abandoned(tmp_path):
+    jobs = SettlementJobs(str(tmp_path / "settlement.sqlite3"), stale_after=0.0)
+    job, _ = jobs.create("merchant", "request")
+    replacement, created = jobs.create("merchant", "request")
+    assert created and replacement.job_id != job.job_id
+    assert jobs.get(job.job_id).status == FAILED
+
+
+@pytest.mark.asyncio
+async def test_concurrent_settles_share_one_close(tmp_path):
+    calls = 0
+
+    async def close_batch(params):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return SUMMARY
+
+    settlement = SettlementScheduler(SettlementJobs(str(tmp_path / "s.sqlite3")), close_batch)
+    jobs = [settlement.submit(PARAMS) for _ in range(5)]
+    assert len({job.job_id for job in jobs}) == 1
+    done = await settlement.wait(jobs[0], timeout=1.0)
+    assert calls == 1
+    assert done.status == SUCCEEDED
+    assert done.result == {
+        "batch_id": "1001", "sequence_number": "7", "transaction_count": "3", "total_amount": "30.00",
+    }
+    await settlement.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_close_is_recorded(tmp_path):
+    path = str(tmp_path / "s.sqlite3")
+
+    async def close_batch(params):
+        raise RuntimeError("gateway down")
+
+    settlement = SettlementScheduler(SettlementJobs(path), close_batch)
+    job = settlement.submit(PARAMS)
+    with pytest.raises(RuntimeError):
+        await settlement.wait(job, timeout=1.0)
+    assert settlement.get(job.job_id).error == "RuntimeError: gateway down"
+
+    # a worker that only sees the job in the store
+    other = SettlementScheduler(SettlementJobs(path), close_batch)
+    with pytest.raises(SettlementFailed):
+        await other.wait(job, timeout=1.0)
+    await settlement.close()
+    await other.close()
+
+
+def test_schedule_is_daily_utc(tmp_path):
+    entry = ScheduledSettle(PARAMS, 23, 30)
+    before = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc).timestamp()
+    at = datetime(2024, 5, 1, 23, 30, tzinfo=timezone.utc).timestamp()
+    assert entry.next_due(before) == at
+    assert entry.next_due(at) == at + 86400
+
+    path = tmp_path / "schedule.json"
+    path.write_text(json.dumps([{"params": {**PARAMS.__dict__, "constants": {"default_currency": "USD"}}, "at": "23:30"}]))
+    assert load_schedule(str(path)) == [entry]
@@ -0,0 +1,151 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from urllib3.connection import HTTPConnection
+
+from python_sdk.globalpayments.api.entities.exceptions import GatewayException
+
+from service import deadline
+from service.breaker import is_gateway_failure
+from service.business.transport import PooledTransport
+from service.deadline import GatewayDeadlineExceeded
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    peers: set = set()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        _Handler.peers.add(self.client_address[1])
+        if self.path.endswith("/slow"):
+            time.sleep(0.3)
+        body = b"<PosResponse/>"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _IdleClosingHandler(_Handler):
+    """Drops a kept-alive connection that was idle for over 0.2 s as the next
+    request arrives, without answering, like a gateway's idle timer firing."""
+    answered = None
+
+    def do_POST(self):
+        if self.answered is not None and time.monotonic() - self.answered > 0.2:
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.close_connection = True
+            return
+        super().do_POST()
+        self.answered = time.monotonic()
+
+
+class _Gateway:
+    content_type = "text/xml; charset=UTF-8"
+    headers = {}
+
+    def __init__(self, service_url):
+        self.service_url = service_url
+
+
+@pytest.fixture
+def gateway_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    _Handler.peers = set()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def idle_closing_gateway_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _IdleClosingHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    _Handler.peers = set()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_transport_reuses_connections(gateway_url):
+    transport = PooledTransport(maxsize=2)
+    gateway = transport.install(_Gateway(gateway_url + "/Hps.Exchange.PosGateway"))
+
+    for _ in range(5):
+        response = gateway.send_request("POST", "", "<PosRequest/>")
+        assert response.status_code == 200
+        assert response.response_text == "<PosResponse/>"
+
+    assert len(_Handler.peers) == 1
+    stats = transport.stats()[gateway_url]
+    assert stats["connections_opened"] == 1
+    assert stats["requests"] == 5
+    assert stats["idle_connections"] == 1
+
+
+def test_timeouts_caused_by_the_deadline_are_not_gateway_failures(gateway_url):
+    # the gateway's own read timeout is a gateway failure
+    gateway = PooledTransport(read_timeout=0.1, retries=0).install(_Gateway(gateway_url))
+    with pytest.raises(GatewayException) as slow:
+        gateway.send_request("POST", "/slow", "<PosRequest/>")
+    assert is_gateway_failure(slow.value)
+
+    # the caller's deadline cutting the same wait short is not
+    gateway = PooledTransport(read_timeout=5.0, retries=0).install(_Gateway(gateway_url))
+    with deadline.until(time.time() + 0.1):
+        with pytest.raises(GatewayDeadlineExceeded) as late:
+            gateway.send_request("POST", "/slow", "<PosRequest/>")
+    assert not is_gateway_failure(late.value)
+
+
+def test_idle_connections_are_not_reused(idle_closing_gateway_url):
+    transport = PooledTransport(idle_timeout=0.1, retries=0)
+    gateway = transport.install(_Gateway(idle_closing_gateway_url))
+
+    assert gateway.send_request("POST", "", "<PosRequest/>").status_code == 200
+    # reused while fresh
+    assert gateway.send_request("POST", "", "<PosRequest/>").status_code == 200
+    assert len(_Handler.peers) == 1
+
+    time.sleep(0.3)
+    assert gateway.send_request("POST", "", "<PosRequest/>").status_code == 200
+    assert len(_Handler.peers) == 2
+
+    # kept past the gateway's idle timer, the POST fails and is not retried
+    stale = PooledTransport(idle_timeout=60.0, retries=2).install(
+        _Gateway(idle_closing_gateway_url)
+    )
+    stale.send_request("POST", "", "<PosRequest/>")
+    time.sleep(0.3)
+    with pytest.raises(GatewayException):
+        stale.send_request("POST", "", "<PosRequest/>")
+
+
+def test_a_post_that_failed_while_sending_on_a_reused_connection_is_retried(
+    gateway_url, monkeypatch
+):
+    gateway = PooledTransport(retries=1).install(_Gateway(gateway_url))
+    assert gateway.send_request("POST", "", "<PosRequest/>").status_code == 200
+
+    send = HTTPConnection.request
+    failures = []
+
+    def reset_once(self, *args, **kwargs):
+        if not failures:
+            failures.append(self)
+            raise BrokenPipeError("connection reset by peer")
+        return send(self, *args, **kwargs)
+
+    monkeypatch.setattr(HTTPConnection, "request", reset_once)
+    assert gateway.send_request("POST", "", "<PosRequest/>").status_code == 200
+    assert failures
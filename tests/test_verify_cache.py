@@ -0,0 +1,64 @@
+import asyncio
+from dataclasses import replace
+
+import pytest
+
+from service.business.functions import CreditCardDataDataclass, VerifyAddressDataClass
+from service.business.params import Constants, HeartlandParams
+from service.idempotency import IdempotencyCache, MemoryIdempotencyStore
+from service.verify_cache import VerifyCache
+
+PARAMS = HeartlandParams(
+    url="https://cert.api2.heartlandportico.com",
+    public_key="None",
+    private_key="skapi_cert_key",
+    term_id="None",
+    cert_str="None",
+    account_num="None",
+    developer_id="000000",
+    version_number="None",
+    username="None",
+    password="None",
+    constants=Constants(default_currency="USD"),
+)
+CARD = CreditCardDataDataclass(number="4111111111111111", exp_month="12", exp_year="30", cvn="123")
+ADDRESS = VerifyAddressDataClass(None, None, None, None, None, "75024")
+
+
+def _cache():
+    return VerifyCache(IdempotencyCache(MemoryIdempotencyStore(ttl=30.0, pending_ttl=0.0)), b"salt")
+
+
+def test_key_never_contains_card_data():
+    key = _cache().key(PARAMS, CARD, ADDRESS)
+    assert CARD.number not in key
+    assert "75024" not in key
+
+
+def test_key_changes_with_card_and_address():
+    cache = _cache()
+    key = cache.key(PARAMS, CARD, ADDRESS)
+    assert key == cache.key(PARAMS, replace(CARD), replace(ADDRESS))
+    assert key != cache.key(PARAMS, replace(CARD, cvn="999"), ADDRESS)
+    assert key != cache.key(PARAMS, CARD, replace(ADDRESS, postal_code="75025"))
+    assert key != cache.key(PARAMS, CARD, None)
+    other = VerifyCache(_cache().cache, b"other salt")
+    assert key.split(":")[-1] != other.key(PARAMS, CARD, ADDRESS).split(":")[-1]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_verifies_share_one_call():
+    cache = _cache()
+    calls = 0
+
+    async def verify():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"response_code": "85"}
+
+    key = cache.key(PARAMS, CARD, ADDRESS)
+    results = await asyncio.gather(*(cache.run(key, verify) for _ in range(5)))
+    assert results == [{"response_code": "85"}] * 5
+    assert await cache.run(key, verify) == {"response_code": "85"}
+    assert calls == 1